@@ -553,6 +553,7 @@ def route_osrm(from_lat, from_lng, to_lat, to_lng, bicycle_type='Mountain'):
 
 LOCAL_SERVER_PID = None
 TILES_DIR = "/home/user/MyDocs/Maps.OSM/valhalla/tiles"
+TILE_SUFFIXES = ('.gph.gz', '.gph')  # str.endswith() takes the tuple in one call
 
 def check_local_server():
     """Check if local routing server is running"""
@@ -998,29 +999,39 @@ def get_installed_tiles():
     if not os.path.isdir(tiles_dir):
         return {'success': True, 'tiles': [], 'count': 0, 'tiles_dir': tiles_dir}
     
-    for level in ['0', '1', '2']:
-        level_dir = os.path.join(tiles_dir, level)
-        if not os.path.isdir(level_dir):
-            continue
+    # os.scandir entries carry their file type, so the walk doesn't stat() every tile
+    def subdirs(path):
+        try:
+            with os.scandir(path) as entries:
+                return [(e.name, e.path) for e in entries if e.is_dir()]
+        except OSError:
+            return []
+    
+    for level in (0, 1, 2):
+        level_dir = os.path.join(tiles_dir, str(level))
         
         # 3-level structure: level/xxx/yyy/zzz.gph.gz
-        for d1 in os.listdir(level_dir):
-            d1_path = os.path.join(level_dir, d1)
-            if not os.path.isdir(d1_path):
+        for d1, d1_path in subdirs(level_dir):
+            try:
+                d1_base = int(d1) * 1000000
+            except ValueError:
                 continue
             
-            for d2 in os.listdir(d1_path):
-                d2_path = os.path.join(d1_path, d2)
-                if not os.path.isdir(d2_path):
+            for d2, d2_path in subdirs(d1_path):
+                try:
+                    d2_base = d1_base + int(d2) * 1000
+                except ValueError:
                     continue
                 
-                for f in os.listdir(d2_path):
-                    if f.endswith('.gph.gz') or f.endswith('.gph'):
-                        try:
-                            tile_id = int(d1) * 1000000 + int(d2) * 1000 + int(f.split('.')[0])
-                            tiles.append({'level': int(level), 'id': tile_id})
-                        except:
-                            pass
+                with os.scandir(d2_path) as entries:
+                    for entry in entries:
+                        f = entry.name
+                        if f.endswith(TILE_SUFFIXES) and entry.is_file():
+                            try:
+                                tile_id = d2_base + int(f.partition('.')[0])
+                            except ValueError:
+                                continue
+                            tiles.append({'level': level, 'id': tile_id})
     
     return {'success': True, 'tiles': tiles, 'count': len(tiles), 'tiles_dir': tiles_dir}
 
@@ -1047,8 +1058,9 @@ def mark_region_downloaded(region_id):
     
     try:
         os.makedirs(os.path.dirname(DOWNLOADED_REGIONS_FILE), exist_ok=True)
+        payload = json.dumps({'regions': regions})
         with open(DOWNLOADED_REGIONS_FILE, 'w') as f:
-            json.dump({'regions': regions}, f)
+            f.write(payload)
     except Exception as e:
         print(f"Error saving downloaded regions: {e}")
 
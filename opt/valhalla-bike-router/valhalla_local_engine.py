@@ -14,19 +14,56 @@ from __future__ import print_function, division
 import struct
 import gzip
 import os
+import re
 import sys
 import json
+import logging
 import math
 import heapq
 import time
+import mmap
+import pickle
 import threading
+import contextlib
+import socket
+from concurrent.futures import Future, ThreadPoolExecutor
+from array import array
+from collections import OrderedDict
+from itertools import compress
+from bisect import bisect_left, bisect_right
 
 try:
     from http.server import HTTPServer, BaseHTTPRequestHandler
-    from urllib.parse import urlparse, parse_qs
+    from urllib.parse import urlparse, unquote_plus
 except ImportError:
     from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
-    from urlparse import urlparse, parse_qs
+    from urlparse import urlparse
+    from urllib import unquote_plus
+
+# Numba is optional (not available on the N9); the pure Python code paths are used without it
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# orjson is optional (no build for the N9); it encodes large route/geocode responses faster
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    def dumps_json(data):
+        """Serialize an HTTP response body to UTF-8 JSON bytes"""
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    loads_json = orjson.loads
+else:
+    def dumps_json(data):
+        """Serialize an HTTP response body to UTF-8 JSON bytes"""
+        return json.dumps(data).encode('utf-8')
+    loads_json = json.loads
+
+logger = logging.getLogger(__name__)
 
 # ============================================================================
 # Configuration
@@ -35,9 +72,34 @@ except ImportError:
 TILES_DIR = "/home/user/MyDocs/Maps.OSM/valhalla/tiles"
 SERVER_PORT = 8553
 
+# Compiled router (vrouter.c), tried before the Python router
+C_ROUTER_PATH = '/opt/valhalla-bike-router/vrouter'
+
+# Print vrouter's stderr for successful one-shot runs too, not just failures (VROUTER_DEBUG=1)
+VROUTER_DEBUG = os.environ.get('VROUTER_DEBUG') == '1'
+
+# Request handler threads, so a long route or geocode doesn't block status polls
+SERVER_WORKERS = 4
+
+# Time tile loads and print [PROFILE] lines from route() (VALHALLA_PROFILE=1)
+PROFILE = os.environ.get('VALHALLA_PROFILE') == '1'
+
 # Tile hierarchy (same as Valhalla)
 TILE_LEVELS = {0: 4.0, 1: 1.0, 2: 0.25}
 
+# Tile file names (gzipped or plain), for str.endswith()
+TILE_SUFFIXES = ('.gph.gz', '.gph')
+
+# Bump whenever the layout of parsed TileData changes so stale .cache files are re-parsed
+TILE_CACHE_VERSION = 12
+
+# Tile cache pickles use protocol 5 so typed columns are written out-of-band
+CACHE_PICKLE_PROTOCOL = 5
+CACHE_BUFFER_ALIGN = 8
+
+# Most tile loads TileCache.prefetch() keeps in flight at once
+PREFETCH_MAX_PENDING = 4
+
 
 # ============================================================================
 # Shape Decoding (Valhalla's decode7 format)
@@ -49,6 +111,9 @@ def decode7_shape(data, offset, size):
     
     Format: 7-bit varint with zigzag encoding, delta-encoded lat/lon pairs.
     Precision: 1e-6 (6 decimal places)
+    
+    The varint reads are inlined (no closure / nonlocal) since this runs for
+    every edge whose shape is materialized.
     """
     if size <= 0 or size > 10000:
         return []
@@ -59,35 +124,41 @@ def decode7_shape(data, offset, size):
     lat = 0
     lon = 0
     points = []
+    append = points.append
     max_points = 1000  # Reasonable limit for a single edge
     
-    def read_varint():
-        nonlocal pos
+    while pos < end and len(points) < max_points:
+        # Latitude delta (max 10 bytes per varint)
         result = 0
         shift = 0
-        iterations = 0
-        while pos < end and iterations < 10:  # Max 10 bytes per varint
+        while pos < end and shift < 70:
             byte = data[pos]
             pos += 1
             result |= (byte & 0x7F) << shift
-            if (byte & 0x80) == 0:
+            if byte < 0x80:
                 break
             shift += 7
-            iterations += 1
-        # Zigzag decode
-        return (result >> 1) ^ -(result & 1)
-    
-    while pos < end and len(points) < max_points:
-        lat += read_varint()
+        lat += (result >> 1) ^ -(result & 1)  # Zigzag decode
         if pos >= end:
             break
-        lon += read_varint()
+        
+        # Longitude delta
+        result = 0
+        shift = 0
+        while pos < end and shift < 70:
+            byte = data[pos]
+            pos += 1
+            result |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        lon += (result >> 1) ^ -(result & 1)
         
         # Validate coordinates (roughly in valid range)
         lat_deg = lat * 1e-6
         lon_deg = lon * 1e-6
         if -90 <= lat_deg <= 90 and -180 <= lon_deg <= 180:
-            points.append((lat_deg, lon_deg))
+            append((lat_deg, lon_deg))
         else:
             # Invalid coordinate, stop parsing
             break
@@ -97,18 +168,32 @@ def decode7_shape(data, offset, size):
 # Structure sizes
 HEADER_SIZE = 272
 NODE_SIZE = 32
+NODE_WORDS = NODE_SIZE // 8
 EDGE_SIZE = 48
+EDGE_WORDS = EDGE_SIZE // 8
 
 # Header offsets (from graphtileheader.h)
 HEADER_EDGEINFO_OFFSET = 112  # Offset to edgeinfo_offset field
 HEADER_TEXTLIST_OFFSET = 116  # Offset to textlist_offset field
 
+# Precompiled struct formats (avoids the format-string lookup on every unpack)
+_U64 = struct.Struct('<Q')
+_UI = struct.Struct('<I')
+_HEADER_BASE = struct.Struct('<Qff')   # graphid word, base_lon, base_lat
+
+# node_trans_flags bits (NodeInfo word 1, bits 56-57)
+NODE_TRANS_UP = 1
+NODE_TRANS_DOWN = 2
+
 # Access constants (from graphconstants.h)
 kAutoAccess = 1
 kPedestrianAccess = 2
 kBicycleAccess = 4
 kTruckAccess = 8
 
+# Bicycle bit in forwardaccess (bits 0-11) or reverseaccess (bits 12-23) of edge word 3
+kBicycleAccessMask = kBicycleAccess | (kBicycleAccess << 12)
+
 # Road classes
 class RoadClass:
     kMotorway = 0
@@ -508,25 +593,44 @@ class BicycleCost:
         # Speed factor table (3.6 / speed for converting to sec/m)
         self.kSpeedFactor = [3.6 / max(s, 1) for s in range(256)]
     
+    def cache_key(self):
+        """Hashable summary of the options that affect routing results"""
+        return (self.bicycle_type, self.speed_, self.use_roads_, self.use_hills_,
+                self.avoid_bad_surfaces_, self.avoid_cars)
+    
     def edge_cost(self, edge):
         """
-        Calculate cost and time for traversing an edge.
+        Calculate cost and time for traversing an edge given as a details dict.
+        
+        Returns: (cost, time_seconds)
+        """
+        return self.edge_cost_fields(
+            edge.get('length', 0), edge.get('use', 0), edge.get('surface', 0),
+            edge.get('classification', 5), edge.get('cycle_lane', 0),
+            edge.get('bike_network', False), edge.get('grade', 7), edge.get('speed', 50),
+            lanecount=edge.get('lanecount', 1), shoulder=edge.get('shoulder', False),
+            truck_route=edge.get('truck_route', False),
+            use_sidepath=edge.get('use_sidepath', False), dismount=edge.get('dismount', False))
+    
+    def edge_cost_fields(self, length, use, surface, classification, cyclelane,
+                         bike_network, weighted_grade, edge_speed, lanecount=1,
+                         shoulder=False, truck_route=False, use_sidepath=False,
+                         dismount=False):
+        """
+        Calculate cost and time for traversing an edge from its decoded fields.
         EXACT port of BicycleCost::EdgeCost() from bicyclecost.cc
         
         Returns: (cost, time_seconds)
         """
-        length = edge.get('length', 0)
         if length <= 0:
             return (float('inf'), 0.0)
         
-        # Get edge attributes
-        use = edge.get('use', 0)
-        surface = max(0, min(7, edge.get('surface', 0)))
-        classification = max(0, min(7, edge.get('classification', 5)))
-        cyclelane = max(0, min(3, edge.get('cycle_lane', 0)))
-        bike_network = edge.get('bike_network', False)
-        weighted_grade = max(0, min(15, edge.get('grade', 7)))
-        edge_speed = max(1, min(255, edge.get('speed', 50)))
+        # Clamp edge attributes to table ranges
+        surface = max(0, min(7, surface))
+        classification = max(0, min(7, classification))
+        cyclelane = max(0, min(3, cyclelane))
+        weighted_grade = max(0, min(15, weighted_grade))
+        edge_speed = max(1, min(255, edge_speed))
         
         # Check surface allowed
         if surface > self.worst_allowed_surface_:
@@ -558,16 +662,14 @@ class BicycleCost:
             roadway_stress = self.track_factor_
         else:
             # Regular road
-            shoulder = 1 if edge.get('shoulder', False) else 0
-            accommodation_factor = self.cyclelane_factor_[shoulder * 4 + cyclelane]
+            accommodation_factor = self.cyclelane_factor_[(4 if shoulder else 0) + cyclelane]
             
             # Lane count penalty
-            lanecount = edge.get('lanecount', 1)
             if lanecount > 1:
                 roadway_stress += (float(lanecount) - 1) * 0.05 * self.road_factor_
             
             # Truck route penalty
-            if edge.get('truck_route', False):
+            if truck_route:
                 roadway_stress += self.kTruckStress
             
             # Road class penalty
@@ -577,7 +679,7 @@ class BicycleCost:
             roadway_stress *= self.speedpenalty_[edge_speed]
         
         # Sidepath penalty
-        if edge.get('use_sidepath', False):
+        if use_sidepath:
             accommodation_factor += self.sidepath_factor_
         
         # Bike network bonus
@@ -607,7 +709,7 @@ class BicycleCost:
                 factor += self.avoid_bad_surfaces_ * self.kSurfaceFactors[surf_idx]
         
         # Compute bicycle speed
-        if edge.get('dismount', False):
+        if dismount:
             bike_speed = int(self.kDismountSpeed)
         else:
             surface_factor = self.surface_speed_factor_[surface]
@@ -647,8 +749,43 @@ class BicycleCost:
 # Tile Parser
 # ============================================================================
 
+class NodeView(object):
+    """Lightweight view of one node; reads fields straight from the tile arrays"""
+    __slots__ = ('_t', '_i')
+    
+    def __init__(self, tile, idx):
+        self._t = tile
+        self._i = idx
+    
+    @property
+    def lat(self):
+        return self._t.node_lats[self._i]
+    
+    @property
+    def lon(self):
+        return self._t.node_lons[self._i]
+    
+    @property
+    def edge_index(self):
+        return self._t.node_edge_idx[self._i]
+    
+    @property
+    def edge_count(self):
+        return self._t.node_edge_cnt[self._i]
+    
+    def __getitem__(self, key):
+        # Backward compatible node['lat'] style access
+        if key not in ('lat', 'lon', 'edge_index', 'edge_count'):
+            raise KeyError(key)
+        return getattr(self, key)
+
+
 class NodeListProxy:
-    """Proxy that makes separate node arrays behave like a list of dicts"""
+    """Proxy that makes separate node arrays behave like a list of nodes.
+    
+    Only for external callers - code in this module reads the node_* arrays directly
+    (use get_node() for a plain dict).
+    """
     def __init__(self, tile):
         self._tile = tile
     
@@ -658,25 +795,172 @@ class NodeListProxy:
     def __getitem__(self, idx):
         if idx < 0 or idx >= self._tile.node_count:
             raise IndexError("node index out of range")
-        return {
-            'lat': self._tile.node_lats[idx],
-            'lon': self._tile.node_lons[idx],
-            'edge_index': self._tile.node_edge_idx[idx],
-            'edge_count': self._tile.node_edge_cnt[idx],
-        }
+        return NodeView(self._tile, idx)
+
+
+class EdgeEndsProxy:
+    """Proxy giving (level, tile_id, node_id, has_bike, opp_index) tuples per edge.
+    
+    Only for external callers - code in this module reads the edge_end_* columns directly.
+    """
+    def __init__(self, tile):
+        self._tile = tile
+    
+    def __len__(self):
+        return self._tile.edge_count
+    
+    def __getitem__(self, idx):
+        t = self._tile
+        return (t.edge_end_level[idx], t.edge_end_tileid[idx], t.edge_end_id[idx],
+                bool(t.edge_has_bike[idx]), t.edge_opp_index[idx])
 
 
 class TileData:
     """Parsed Valhalla tile"""
+    # Raw tile bytes and per-costing memos are re-acquired on demand and never pickled
+    _TRANSIENT = ('edge_data', '_nodes', '_edge_ends', '_neighbor_tiles', 'edge_costs')
+    
     def __init__(self):
         self.level = 0
         self.tile_id = 0
         self.base_lat = 0.0
         self.base_lon = 0.0
-        self.nodes = []
         self.edges = []
-        self.adj = None
-        self.node_index = {}
+        # CSR adjacency (see build_adjacency_cross_tile), None until built
+        self.adj_offsets = None
+        # (costing key, cost array, time array) memo, see TileCache.get_edge_costs
+        self.edge_costs = None
+        self.cache_version = TILE_CACHE_VERSION
+        # Spatial index: sorted unique bucket keys with (start, count) slices
+        # into node_index_ids (node ids sorted by bucket key)
+        self.node_index_keys = array('q')
+        self.node_index_starts = array('i')
+        self.node_index_counts = array('i')
+        self.node_index_ids = array('i')
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in self._TRANSIENT:
+            state.pop(name, None)
+        # Typed columns travel as raw buffers so protocol 5 can store them out-of-band
+        for name, value in list(state.items()):
+            if isinstance(value, array):
+                state[name] = ('__column__', value.typecode, pickle.PickleBuffer(value))
+            elif isinstance(value, memoryview):
+                state[name] = ('__column__', value.format, pickle.PickleBuffer(value))
+        return state
+    
+    def __setstate__(self, state):
+        # Columns come back as zero-copy typed memoryviews over the loaded buffers
+        for name, value in list(state.items()):
+            if type(value) is tuple and len(value) == 3 and value[0] == '__column__':
+                state[name] = memoryview(value[2]).cast('B').cast(value[1])
+        self.__dict__.update(state)
+        for name in self._TRANSIENT:
+            self.__dict__[name] = None
+    
+    @property
+    def nodes(self):
+        """List-like node access for external callers, created on first use"""
+        proxy = self.__dict__.get('_nodes')
+        if proxy is None:
+            proxy = self.__dict__['_nodes'] = NodeListProxy(self)
+        return proxy
+    
+    @property
+    def edge_ends(self):
+        """Per-edge end tuples for external callers, created on first use"""
+        proxy = self.__dict__.get('_edge_ends')
+        if proxy is None:
+            proxy = self.__dict__['_edge_ends'] = EdgeEndsProxy(self)
+        return proxy
+    
+    @property
+    def adj(self):
+        """Per-node adjacency tuples generated on demand from the CSR arrays"""
+        if self.adj_offsets is None:
+            return None
+        return AdjacencyProxy(self)
+    
+    def neighbor_tile_keys(self):
+        """Set of other (level, tile_id) tiles that this tile's edges end in (memoized)"""
+        keys = self.__dict__.get('_neighbor_tiles')
+        if keys is None:
+            keys = set(zip(self.edge_end_level, self.edge_end_tileid))
+            keys.discard((self.level, self.tile_id))
+            self.__dict__['_neighbor_tiles'] = keys
+        return keys
+    
+    def neighbors(self, ni):
+        """CSR slices (tileids, nodeids, costs, times, lengths) of node ni's edges"""
+        lo = self.adj_offsets[ni]
+        hi = self.adj_offsets[ni + 1]
+        return (self.adj_tileids[lo:hi], self.adj_nodeids[lo:hi], self.adj_costs[lo:hi],
+                self.adj_times[lo:hi], self.adj_lengths[lo:hi])
+    
+    def lookup_bucket(self, lat_b, lon_b):
+        """Return node ids in spatial bucket (lat_b, lon_b) - binary search, no dict"""
+        keys = self.node_index_keys
+        key = bucket_key(lat_b, lon_b)
+        pos = bisect_left(keys, key)
+        if pos < len(keys) and keys[pos] == key:
+            start = self.node_index_starts[pos]
+            return self.node_index_ids[start:start + self.node_index_counts[pos]]
+        return ()
+    
+    def lookup_bucket_range(self, lat_b, lon_b0, lon_b1):
+        """
+        Node ids of buckets (lat_b, lon_b0..lon_b1) as one slice of node_index_ids.
+        
+        Buckets of one lat row are adjacent in key order, so the whole row is two
+        bisects and a single contiguous slice instead of one lookup per bucket.
+        """
+        if lon_b0 < 0 <= lon_b1:
+            # Negative lon buckets sort after the positive ones (unsigned low word)
+            return (list(self.lookup_bucket_range(lat_b, lon_b0, -1)) +
+                    list(self.lookup_bucket_range(lat_b, 0, lon_b1)))
+        keys = self.node_index_keys
+        lo = bisect_left(keys, bucket_key(lat_b, lon_b0))
+        hi = bisect_right(keys, bucket_key(lat_b, lon_b1), lo)
+        if lo >= hi:
+            return ()
+        start = self.node_index_starts[lo]
+        return self.node_index_ids[start:self.node_index_starts[hi - 1] + self.node_index_counts[hi - 1]]
+
+
+def read_u64_words(data, offset, count):
+    """Bulk-decode count little-endian uint64 words starting at offset"""
+    words = array('Q')
+    words.frombytes(data[offset:offset + count * 8])
+    if sys.byteorder != 'little':
+        words.byteswap()
+    return words
+
+
+def bucket_key(lat_b, lon_b):
+    """Pack a (lat*100, lon*100) spatial bucket into one sortable int64 key"""
+    return (lat_b << 32) | (lon_b & 0xFFFFFFFF)
+
+
+def build_node_index(tile, keys):
+    """Build the packed spatial index from per-node bucket keys (groupby over sorted keys)"""
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    unique_keys = array('q')
+    starts = array('i')
+    counts = array('i')
+    prev = None
+    for pos, ni in enumerate(order):
+        key = keys[ni]
+        if key != prev:
+            unique_keys.append(key)
+            starts.append(pos)
+            counts.append(0)
+            prev = key
+        counts[-1] += 1
+    tile.node_index_keys = unique_keys
+    tile.node_index_starts = starts
+    tile.node_index_counts = counts
+    tile.node_index_ids = array('i', order)
 
 
 def parse_tile(filepath):
@@ -695,23 +979,21 @@ def parse_tile(filepath):
     tile.source_path = filepath
     
     # Header
-    word0 = struct.unpack_from('<Q', data, 0)[0]
+    word0, tile.base_lon, tile.base_lat = _HEADER_BASE.unpack_from(data, 0)
     graphid = word0 & 0x3FFFFFFFFFFF
     tile.level = graphid & 0x7
     tile.tile_id = (graphid >> 3) & 0x3FFFFF
     
-    tile.base_lon, tile.base_lat = struct.unpack_from('<ff', data, 8)
-    
-    word5 = struct.unpack_from('<Q', data, 40)[0]
+    word5 = _U64.unpack_from(data, 40)[0]
     node_count = word5 & 0x1FFFFF
     edge_count = (word5 >> 21) & 0x1FFFFF
     
-    word6 = struct.unpack_from('<I', data, 48)[0]
+    word6 = _UI.unpack_from(data, 48)[0]
     transition_count = word6 & 0x3FFFFF
     
     # Read edgeinfo and textlist offsets from header
-    tile.header_edgeinfo_offset = struct.unpack_from('<I', data, HEADER_EDGEINFO_OFFSET)[0]
-    tile.header_textlist_offset = struct.unpack_from('<I', data, HEADER_TEXTLIST_OFFSET)[0]
+    tile.header_edgeinfo_offset = _UI.unpack_from(data, HEADER_EDGEINFO_OFFSET)[0]
+    tile.header_textlist_offset = _UI.unpack_from(data, HEADER_TEXTLIST_OFFSET)[0]
     
     nodes_offset = HEADER_SIZE
     edges_offset = nodes_offset + node_count * NODE_SIZE + transition_count * 8
@@ -719,86 +1001,122 @@ def parse_tile(filepath):
     base_lat = tile.base_lat
     base_lon = tile.base_lon
     
-    # Parse nodes - store as simple lists for pickle compatibility
-    tile.node_lats = []
-    tile.node_lons = []
-    tile.node_edge_idx = []
-    tile.node_edge_cnt = []
-    tile.node_trans_idx = []   # Transition index
-    tile.node_trans_up = []    # Has upward transition
-    tile.node_trans_down = []  # Has downward transition
     tile.node_count = node_count
     
     # Store transitions offset for later
     tile.transitions_offset = nodes_offset + node_count * NODE_SIZE
     tile.transition_count = transition_count
     
-    for i in range(node_count):
-        offset = nodes_offset + i * NODE_SIZE
-        
-        w0 = struct.unpack_from('<Q', data, offset)[0]
-        lat = base_lat + ((w0 & 0x3FFFFF) * 1e-6 + ((w0 >> 22) & 0xF) * 1e-7)
-        lon = base_lon + (((w0 >> 26) & 0x3FFFFF) * 1e-6 + ((w0 >> 48) & 0xF) * 1e-7)
-        
-        w1 = struct.unpack_from('<Q', data, offset + 8)[0]
-        edge_idx = w1 & 0x1FFFFF
-        edge_cnt = (w1 >> 21) & 0x7F
-        trans_idx = (w1 >> 49) & 0x7F
-        trans_up = bool((w1 >> 56) & 1)
-        trans_down = bool((w1 >> 57) & 1)
-        
-        tile.node_lats.append(lat)
-        tile.node_lons.append(lon)
-        tile.node_edge_idx.append(edge_idx)
-        tile.node_edge_cnt.append(edge_cnt)
-        tile.node_trans_idx.append(trans_idx)
-        tile.node_trans_up.append(trans_up)
-        tile.node_trans_down.append(trans_down)
-        
-        # Build spatial index
-        bucket = (int(lat * 100), int(lon * 100))
-        if bucket not in tile.node_index:
-            tile.node_index[bucket] = []
-        tile.node_index[bucket].append(i)
+    # Pre-decode all node words into per-field columns (SoA) in one pass
+    words = read_u64_words(data, nodes_offset, node_count * NODE_WORDS)
+    w0s = words[0::NODE_WORDS]
+    w1s = words[1::NODE_WORDS]
+    
+    # Word 0: lat (22 bits 1e-6 + 4 bits 1e-7), lon (bits 26-47 1e-6 + 48-51 1e-7)
+    tile.node_lats = array('d', [base_lat + ((w & 0x3FFFFF) * 1e-6 + ((w >> 22) & 0xF) * 1e-7)
+                                 for w in w0s])
+    tile.node_lons = array('d', [base_lon + (((w >> 26) & 0x3FFFFF) * 1e-6 + ((w >> 48) & 0xF) * 1e-7)
+                                 for w in w0s])
+    # cos(lat) per node, for haversine_precomp / find_nearest_node. Only feeds heuristics
+    # and candidate ranking, so float32 is plenty (lat/lon stay float64 - float32's ~4e-6
+    # degree steps would show up in the 1e-6 polyline output)
+    cos = math.cos
+    tile.node_cos_lat = array('f', [cos(lat * DEG_TO_RAD) for lat in tile.node_lats])
+    
+    # Word 1: edge_index: 0-20, edge_count: 21-27, transition_index: 49-55,
+    #         has up/down transitions: 56-57 (NODE_TRANS_UP | NODE_TRANS_DOWN)
+    tile.node_edge_idx = array('i', [w & 0x1FFFFF for w in w1s])
+    tile.node_edge_cnt = array('B', [(w >> 21) & 0x7F for w in w1s])
+    tile.node_trans_idx = array('B', [(w >> 49) & 0x7F for w in w1s])
+    tile.node_trans_flags = array('B', [(w >> 56) & 0x3 for w in w1s])
+    
+    bucket_keys = [bucket_key(int(lat * 100), int(lon * 100))
+                   for lat, lon in zip(tile.node_lats, tile.node_lons)]
+    
+    # Build spatial index
+    build_node_index(tile, bucket_keys)
     
     # Store edges offset for lazy loading
     tile.edges_offset = edges_offset
     tile.edge_count = edge_count
     
-    # Pre-parse edge connectivity and edgeinfo offsets
-    tile.edge_ends = []
-    tile.edge_edgeinfo_offsets = []  # For shape lookup
+    # Pre-decode all edge words into per-field columns (SoA) in one pass
+    words = read_u64_words(data, edges_offset, edge_count * EDGE_WORDS)
+    w0s = words[0::EDGE_WORDS]
+    w1s = words[1::EDGE_WORDS]
+    w2s = words[2::EDGE_WORDS]
+    w3s = words[3::EDGE_WORDS]
+    w4s = words[4::EDGE_WORDS]
+    
+    # Word 0: endnode graphid (level: 0-2, tileid: 3-24, id: 25-45), opp_index: 54-60
+    tile.edge_end_level = array('B', [w & 0x7 for w in w0s])
+    tile.edge_end_tileid = array('i', [(w >> 3) & 0x3FFFFF for w in w0s])
+    tile.edge_end_id = array('i', [(w >> 25) & 0x1FFFFF for w in w0s])
+    tile.edge_opp_index = array('B', [(w >> 54) & 0x7F for w in w0s])
+    
+    # Word 1: edgeinfo_offset (bits 0-24) - for shape lookup
+    tile.edge_edgeinfo_offsets = array('i', [w & 0x1FFFFFF for w in w1s])
+    
+    # Word 2: speed: 0-7, use: 40-45, lanecount: 46-49, density: 50-53,
+    #         classification: 54-56, surface: 57-59
+    tile.edge_speed = array('B', [w & 0xFF for w in w2s])
+    tile.edge_use = array('B', [(w >> 40) & 0x3F for w in w2s])
+    tile.edge_lanecount = array('B', [(w >> 46) & 0xF for w in w2s])
+    tile.edge_density = array('B', [(w >> 50) & 0xF for w in w2s])
+    tile.edge_classification = array('B', [(w >> 54) & 0x7 for w in w2s])
+    tile.edge_surface = array('B', [(w >> 57) & 0x7 for w in w2s])
+    
+    # Word 3: forwardaccess: 0-11, reverseaccess: 12-23, cycle_lane: 37-38,
+    #         bike_network: 39, use_sidepath: 40, shoulder: 41, dismount: 42
+    tile.edge_has_bike = array('B', [(w & kBicycleAccessMask) != 0 for w in w3s])
+    tile.edge_cycle_lane = array('B', [(w >> 37) & 0x3 for w in w3s])
+    tile.edge_bike_network = array('B', [(w >> 39) & 1 for w in w3s])
+    tile.edge_use_sidepath = array('B', [(w >> 40) & 1 for w in w3s])
+    tile.edge_shoulder = array('B', [(w >> 41) & 1 for w in w3s])
+    tile.edge_dismount = array('B', [(w >> 42) & 1 for w in w3s])
+    
+    # Word 4: length: 32-55, weighted_grade: 56-59 (0-15, 7 = flat)
+    tile.edge_length = array('i', [(w >> 32) & 0xFFFFFF for w in w4s])
+    tile.edge_grade = array('B', [(w >> 56) & 0xF for w in w4s])
+    
+    # Keep already decompressed .gz bytes for shapes/transitions (plain .gph files are
+    # mmapped on demand instead); never pickled
+    tile.edge_data = data if filepath.endswith('.gz') else None
+    tile.raw_path = None
     
-    for i in range(edge_count):
-        offset = edges_offset + i * EDGE_SIZE
-        
-        w0 = struct.unpack_from('<Q', data, offset)[0]
-        endnode = w0 & 0x3FFFFFFFFFFF
-        end_level = endnode & 0x7  # Lower 3 bits = level
-        end_tileid = (endnode >> 3) & 0x3FFFFF
-        end_id = (endnode >> 25) & 0x1FFFFF
-        
-        # Extract opp_index (bits 54-60 of word 0) - opposing edge index at end node
-        opp_index = (w0 >> 54) & 0x7F
-        
-        # Extract edgeinfo_offset from word 1 (bits 0-24)
-        w1 = struct.unpack_from('<Q', data, offset + 8)[0]
-        edgeinfo_offset = w1 & 0x1FFFFFF  # 25 bits
-        tile.edge_edgeinfo_offsets.append(edgeinfo_offset)
-        
-        # Quick bicycle access check
-        w3 = struct.unpack_from('<Q', data, offset + 24)[0]
-        has_bike = bool(((w3 & 0xFFF) | ((w3 >> 12) & 0xFFF)) & kBicycleAccess)
-        
-        tile.edge_ends.append((end_level, end_tileid, end_id, has_bike, opp_index))
+    return tile
+
+
+def _ensure_data(tile):
+    """
+    Raw tile bytes for the lazy getters (shapes, transitions), acquired once per tile.
     
-    # Don't store edge_data - will reload on demand in get_edge_details
-    tile.edge_data = None
+    Plain .gph files and the decompressed .raw copy of .gph.gz tiles written by
+    TileCache are mmapped read-only so the kernel page cache owns the pages (clean,
+    evictable without swap); otherwise a .gph.gz is decompressed once into bytes.
+    """
+    data = tile.edge_data
+    if data is not None:
+        return data
     
-    # Create nodes proxy for backward compatibility
-    tile.nodes = NodeListProxy(tile)
+    path = getattr(tile, 'raw_path', None)
+    if not path or not os.path.exists(path):
+        path = getattr(tile, 'source_path', None)
+    if not path:
+        return None
     
-    return tile
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as f:
+            data = f.read()
+    else:
+        with open(path, 'rb') as f:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError):
+                data = f.read()  # Empty file or mmap unsupported
+    
+    tile.edge_data = data
+    return data
 
 
 # Compatibility wrapper for node access
@@ -815,81 +1133,40 @@ def get_node(tile, idx):
 
 
 def get_edge_details(tile, edge_idx):
-    """Lazy load full edge details when needed"""
-    if edge_idx >= tile.edge_count:
-        return None
-    
-    end_level, end_tileid, end_id, has_bike, opp_index = tile.edge_ends[edge_idx]
-    if not has_bike:
+    """Edge details as a dict, packed from the pre-decoded edge columns"""
+    if edge_idx >= tile.edge_count or not tile.edge_has_bike[edge_idx]:
         return None
     
-    # Reload data if not cached
-    if tile.edge_data is None:
-        if hasattr(tile, 'source_path') and tile.source_path:
-            if tile.source_path.endswith('.gz'):
-                with gzip.open(tile.source_path, 'rb') as f:
-                    tile.edge_data = f.read()
-            else:
-                with open(tile.source_path, 'rb') as f:
-                    tile.edge_data = f.read()
-        else:
-            return None
-    
-    data = tile.edge_data
-    offset = tile.edges_offset + edge_idx * EDGE_SIZE
-    
-    # Word 2 (offset 16): speeds, use, classification, surface
-    # Bit layout:
-    #   speed: 0-7, free_flow_speed: 8-15, constrained_flow_speed: 16-23
-    #   truck_speed: 24-31, name_consistency: 32-39, use: 40-45
-    #   lanecount: 46-49, density: 50-53, classification: 54-56, surface: 57-59
-    w2 = struct.unpack_from('<Q', data, offset + 16)[0]
-    speed = w2 & 0xFF
-    use = (w2 >> 40) & 0x3F
-    lanecount = (w2 >> 46) & 0xF       # NEW: lane count
-    density = (w2 >> 50) & 0xF
-    classification = (w2 >> 54) & 0x7
-    surface = (w2 >> 57) & 0x7
-    
-    # Word 3 (offset 24): access, slopes, cycle info
-    # Bit layout:
-    #   forwardaccess: 0-11, reverseaccess: 12-23
-    #   max_up_slope: 24-28, max_down_slope: 29-33
-    #   sac_scale: 34-36, cycle_lane: 37-38, bike_network: 39
-    #   use_sidepath: 40, shoulder: 41, dismount: 42, ...
-    w3 = struct.unpack_from('<Q', data, offset + 24)[0]
-    cycle_lane = (w3 >> 37) & 0x3
-    bike_network = bool((w3 >> 39) & 1)
-    use_sidepath = bool((w3 >> 40) & 1)  # NEW
-    shoulder = bool((w3 >> 41) & 1)      # NEW
-    dismount = bool((w3 >> 42) & 1)      # NEW
-    
-    # Word 4 (offset 32): length, weighted_grade
-    # Bit layout: turntype: 0-23, edge_to_left: 24-31, length: 32-55, weighted_grade: 56-59
-    w4 = struct.unpack_from('<Q', data, offset + 32)[0]
-    length = (w4 >> 32) & 0xFFFFFF
-    weighted_grade = (w4 >> 56) & 0xF  # 0-15, 7 = flat
-    
     return {
-        'end_level': end_level,
-        'end_tileid': end_tileid,
-        'end_id': end_id,
-        'length': length,
-        'speed': speed,
-        'classification': classification,
-        'use': use,
-        'surface': surface,
-        'cycle_lane': cycle_lane,
-        'bike_network': bike_network,
-        'grade': weighted_grade,
-        'density': density,
-        'lanecount': lanecount,       # NEW
-        'shoulder': shoulder,          # NEW
-        'use_sidepath': use_sidepath,  # NEW
-        'dismount': dismount,          # NEW
+        'end_level': tile.edge_end_level[edge_idx],
+        'end_tileid': tile.edge_end_tileid[edge_idx],
+        'end_id': tile.edge_end_id[edge_idx],
+        'length': tile.edge_length[edge_idx],
+        'speed': tile.edge_speed[edge_idx],
+        'classification': tile.edge_classification[edge_idx],
+        'use': tile.edge_use[edge_idx],
+        'surface': tile.edge_surface[edge_idx],
+        'cycle_lane': tile.edge_cycle_lane[edge_idx],
+        'bike_network': bool(tile.edge_bike_network[edge_idx]),
+        'grade': tile.edge_grade[edge_idx],
+        'density': tile.edge_density[edge_idx],
+        'lanecount': tile.edge_lanecount[edge_idx],
+        'shoulder': bool(tile.edge_shoulder[edge_idx]),
+        'use_sidepath': bool(tile.edge_use_sidepath[edge_idx]),
+        'dismount': bool(tile.edge_dismount[edge_idx]),
     }
 
 
+def edge_cost_at(tile, edge_idx, costing):
+    """(cost, time) of an edge computed straight from the tile's edge columns"""
+    return costing.edge_cost_fields(
+        tile.edge_length[edge_idx], tile.edge_use[edge_idx], tile.edge_surface[edge_idx],
+        tile.edge_classification[edge_idx], tile.edge_cycle_lane[edge_idx],
+        tile.edge_bike_network[edge_idx], tile.edge_grade[edge_idx], tile.edge_speed[edge_idx],
+        tile.edge_lanecount[edge_idx], tile.edge_shoulder[edge_idx], False,
+        tile.edge_use_sidepath[edge_idx], tile.edge_dismount[edge_idx])
+
+
 def get_edge_shape(tile, edge_idx):
     """
     Get the shape (list of lat/lon points) for an edge from EdgeInfo.
@@ -904,19 +1181,9 @@ def get_edge_shape(tile, edge_idx):
     if edge_idx >= tile.edge_count or edge_idx >= len(tile.edge_edgeinfo_offsets):
         return []
     
-    # Reload data if needed
-    if tile.edge_data is None:
-        if hasattr(tile, 'source_path') and tile.source_path:
-            if tile.source_path.endswith('.gz'):
-                with gzip.open(tile.source_path, 'rb') as f:
-                    tile.edge_data = f.read()
-            else:
-                with open(tile.source_path, 'rb') as f:
-                    tile.edge_data = f.read()
-        else:
-            return []
-    
-    data = tile.edge_data
+    data = _ensure_data(tile)
+    if data is None:
+        return []
     
     # Calculate absolute offset to this edge's EdgeInfo
     edgeinfo_offset = tile.edge_edgeinfo_offsets[edge_idx]
@@ -927,7 +1194,7 @@ def get_edge_shape(tile, edge_idx):
     
     # Parse EdgeInfoInner (12 bytes)
     # Word 2 (bytes 8-11): name_count (4 bits), encoded_shape_size (16 bits), ...
-    word2 = struct.unpack_from('<I', data, abs_offset + 8)[0]
+    word2 = _UI.unpack_from(data, abs_offset + 8)[0]
     name_count = word2 & 0xF
     encoded_shape_size = (word2 >> 4) & 0xFFFF
     
@@ -941,151 +1208,303 @@ def get_edge_shape(tile, edge_idx):
     if shape_offset + encoded_shape_size > len(data):
         return []
     
-    # Decode the shape
-    try:
-        shape = decode7_shape(data, shape_offset, encoded_shape_size)
-        # Sanity check on result
-        if len(shape) > 5000:
-            return []  # Too many points, likely corrupted
-        return shape
-    except:
-        return []
+    # Decode the shape (bounds were checked above, decoder never reads past end)
+    shape = decode7_shape(data, shape_offset, encoded_shape_size)
+    # Sanity check on result
+    if len(shape) > 5000:
+        return []  # Too many points, likely corrupted
+    return shape
 
 
 def get_transitions(tile, node_id):
-    """Get transitions for a node. Returns list of (level, tile_id, node_id, is_up)."""
+    """
+    Get transitions for a node. Returns list of (level, tile_id, node_id, is_up).
+    
+    The node's transition words are read in one bulk decode.
+    """
     if node_id >= tile.node_count:
         return []
     
-    if not tile.node_trans_up[node_id] and not tile.node_trans_down[node_id]:
+    flags = tile.node_trans_flags[node_id]
+    if not flags:
         return []
     
-    # Reload data if needed
-    if tile.edge_data is None:
-        if hasattr(tile, 'source_path') and tile.source_path:
-            if tile.source_path.endswith('.gz'):
-                with gzip.open(tile.source_path, 'rb') as f:
-                    tile.edge_data = f.read()
-            else:
-                with open(tile.source_path, 'rb') as f:
-                    tile.edge_data = f.read()
-        else:
-            return []
+    data = _ensure_data(tile)
+    if data is None:
+        return []
+    count = (flags & NODE_TRANS_UP) + (flags >> 1)
+    offset = tile.transitions_offset + tile.node_trans_idx[node_id] * 8
     
-    data = tile.edge_data
     transitions = []
-    trans_idx = tile.node_trans_idx[node_id]
-    count = (1 if tile.node_trans_up[node_id] else 0) + (1 if tile.node_trans_down[node_id] else 0)
-    
-    for i in range(count):
-        offset = tile.transitions_offset + (trans_idx + i) * 8
-        trans = struct.unpack_from('<Q', data, offset)[0]
-        
+    for trans in read_u64_words(data, offset, count):
         graphid = trans & 0x3FFFFFFFFFFF
-        is_up = bool((trans >> 46) & 1)
-        
-        level = graphid & 0x7
-        tid = (graphid >> 3) & 0x3FFFFF
-        nid = (graphid >> 25) & 0x1FFFFF
-        
-        transitions.append((level, tid, nid, is_up))
-    
+        transitions.append((graphid & 0x7, (graphid >> 3) & 0x3FFFFF,
+                            (graphid >> 25) & 0x1FFFFF, bool((trans >> 46) & 1)))
     return transitions
 
 
-def build_adjacency_cross_tile(tile, costing):
-    """Build adjacency list with cross-tile edges - OPTIMIZED"""
-    if tile.adj is not None:
-        return
+class AdjacencyProxy:
+    """Per-node view over the CSR adjacency arrays (list of tuples per node)"""
+    def __init__(self, tile):
+        self._tile = tile
     
-    num_nodes = len(tile.nodes)
-    tile.adj = [[] for _ in range(num_nodes)]
+    def __len__(self):
+        return len(self._tile.adj_offsets) - 1
     
-    # Build node -> edge index mapping first (O(n))
-    # Each node has edge_index and edge_count
-    for ni in range(num_nodes):
-        node = tile.nodes[ni]
-        start_edge = node['edge_index']
-        end_edge = start_edge + node['edge_count']
-        
-        for ei in range(start_edge, min(end_edge, tile.edge_count)):
-            end_level, end_tileid, end_id, has_bike, opp_index = tile.edge_ends[ei]
-            
-            if not has_bike:
-                continue
-            
-            # Get full edge details (lazy loaded)
-            edge = get_edge_details(tile, ei)
-            if edge is None:
-                continue
-            
-            # Calculate cost
-            cost, time_secs = costing.edge_cost(edge)
-            length = edge['length']
-            
-            if cost >= float('inf'):
+    def __getitem__(self, ni):
+        return list(zip(*self._tile.neighbors(ni)))
+
+
+def _build_adj_kernel(tile, edge_cost_fields):
+    """
+    Tight adjacency loop over the tile's SoA columns bound to locals - no dicts.
+    
+    Returns CSR arrays: (offsets, tileids, nodeids, costs, times, lengths) where the
+    neighbours of node ni are entries offsets[ni]:offsets[ni+1].
+    """
+    node_edge_idx = tile.node_edge_idx
+    node_edge_cnt = tile.node_edge_cnt
+    edge_count = tile.edge_count
+    has_bike = tile.edge_has_bike
+    end_tileids = tile.edge_end_tileid
+    end_ids = tile.edge_end_id
+    e_length = tile.edge_length
+    e_use = tile.edge_use
+    e_surface = tile.edge_surface
+    e_class = tile.edge_classification
+    e_cycle_lane = tile.edge_cycle_lane
+    e_bike_network = tile.edge_bike_network
+    e_grade = tile.edge_grade
+    e_speed = tile.edge_speed
+    e_lanecount = tile.edge_lanecount
+    e_shoulder = tile.edge_shoulder
+    e_use_sidepath = tile.edge_use_sidepath
+    e_dismount = tile.edge_dismount
+    
+    offsets = array('i', [0])
+    tileids = array('i')
+    nodeids = array('i')
+    costs = array('d')
+    times = array('d')
+    lengths = array('i')
+    inf = float('inf')
+    
+    for ni in range(tile.node_count):
+        start_edge = node_edge_idx[ni]
+        end_edge = min(start_edge + node_edge_cnt[ni], edge_count)
+        
+        # Only visit bike-accessible edges; compress() does the filtering in C
+        for ei in compress(range(start_edge, end_edge), has_bike[start_edge:end_edge]):
+            length = e_length[ei]
+            cost, time_secs = edge_cost_fields(
+                length, e_use[ei], e_surface[ei], e_class[ei], e_cycle_lane[ei],
+                e_bike_network[ei], e_grade[ei], e_speed[ei], e_lanecount[ei],
+                e_shoulder[ei], False, e_use_sidepath[ei], e_dismount[ei])
+            if cost >= inf:
                 continue
             
-            # Store: (target_tile_id, target_node_id, cost, time, length)
-            tile.adj[ni].append((end_tileid, end_id, cost, time_secs, length))
+            tileids.append(end_tileids[ei])
+            nodeids.append(end_ids[ei])
+            costs.append(cost)
+            times.append(time_secs)
+            lengths.append(length)
+        
+        offsets.append(len(tileids))
+    
+    return offsets, tileids, nodeids, costs, times, lengths
+
+
+def build_adjacency_cross_tile(tile, costing):
+    """
+    Build adjacency with cross-tile edges as CSR arrays - OPTIMIZED
+    
+    One contiguous array per field plus adj_offsets instead of a list of tuple
+    lists per node; use tile.neighbors(ni) for slices or tile.adj[ni] for tuples.
+    """
+    if tile.adj_offsets is not None:
+        return
+    
+    (tile.adj_offsets, tile.adj_tileids, tile.adj_nodeids,
+     tile.adj_costs, tile.adj_times, tile.adj_lengths) = _build_adj_kernel(
+        tile, costing.edge_cost_fields)
 
 
 # ============================================================================
 # Tile Cache
 # ============================================================================
 
+def tile_center(level, tile_id):
+    """(lat, lon) of the centre of a tile"""
+    tile_size = TILE_LEVELS[level]
+    tiles_per_row = int(360.0 / tile_size)
+    row, col = divmod(tile_id, tiles_per_row)
+    return -90.0 + (row + 0.5) * tile_size, -180.0 + (col + 0.5) * tile_size
+
+
+def tiles_toward(keys, from_key, lat, lon):
+    """
+    The (level, tile_id) keys whose centre is nearer (lat, lon) than from_key's,
+    nearest first - the tiles a search heading for (lat, lon) is likely to enter.
+    """
+    lon_scale = math.cos(lat * DEG_TO_RAD) ** 2
+    
+    def dist_sq(key):
+        c_lat, c_lon = tile_center(key[0], key[1])
+        return (c_lat - lat) ** 2 + (c_lon - lon) ** 2 * lon_scale
+    
+    limit = dist_sq(from_key)
+    return sorted((key for key in keys if dist_sq(key) < limit), key=dist_sq)
+
+
 class TileCache:
-    def __init__(self, tiles_dir, max_tiles=100):
+    def __init__(self, tiles_dir, max_tiles=100, prefetch_workers=2):
         self.tiles_dir = tiles_dir
         self.max_tiles = max_tiles
-        self.tiles = {}
-        self.access_order = []
+        self.tiles = OrderedDict()  # (level, tile_id) -> tile, least recently used first
         self.lock = threading.Lock()
+        # Per-thread most recently returned tile - repeated hits skip the lock
+        self._tls = threading.local()
         self.cache_dir = os.path.join(tiles_dir, '.cache')
         
-        # Route cache for recently computed routes
-        self.route_cache = {}
+        # Background tile loading (see prefetch); 0 workers disables it
+        self.prefetch_workers = prefetch_workers
+        self.prefetch_pool = None
+        self._inflight = {}  # (level, tile_id) -> Future of a tile being prefetched
+        
+        # (level, tile_id) -> tile file, built lazily by rescan()
+        self._path_index = None
+        
+        # Route cache for recently computed routes, least recently used first
+        self.route_cache = OrderedDict()
         self.route_cache_max = 50
         
         # Create cache directory
-        if not os.path.exists(self.cache_dir):
-            try:
-                os.makedirs(self.cache_dir)
-            except:
-                pass
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        except OSError:
+            pass
+    
+    def rescan(self):
+        """
+        (Re)build the (level, tile_id) -> path index with one walk of the tile tree.
+        
+        Valhalla uses different directory structure per level
+        Level 2: 2/000/795/665.gph.gz  (tile_id 795665)
+        Level 1: 1/049/876.gph.gz      (tile_id 49876)
+        Level 0: 0/003/109.gph.gz      (tile_id 3109)
+        
+        The walk uses os.scandir(), whose entries already know whether they are
+        directories, so no file is stat()ed.
+        """
+        index = {}
+        for level in TILE_LEVELS:
+            # (directory, tile_id prefix from its path components)
+            stack = [(os.path.join(self.tiles_dir, str(level)), 0)]
+            while stack:
+                dir_path, prefix = stack.pop()
+                try:
+                    entries = os.scandir(dir_path)
+                except OSError:
+                    continue
+                with entries:
+                    for entry in entries:
+                        name = entry.name
+                        if entry.is_dir():
+                            try:
+                                stack.append((entry.path, prefix * 1000 + int(name)))
+                            except ValueError:
+                                pass
+                            continue
+                        if not name.endswith(TILE_SUFFIXES):
+                            continue
+                        try:
+                            tile_id = prefix * 1000 + int(name.partition('.')[0])
+                        except ValueError:
+                            continue
+                        key = (level, tile_id)
+                        # Prefer .gph.gz when both variants exist
+                        if key in index and index[key].endswith('.gph.gz'):
+                            continue
+                        index[key] = entry.path
+        with self.lock:
+            self._path_index = index
+            # Tiles and routes loaded from the old tile set may no longer be valid
+            self.tiles.clear()
+            self.route_cache.clear()
+        return len(index)
     
     def get_tile_path(self, tile_id, level):
-        # Valhalla uses different directory structure per level
-        # Level 2: 2/000/795/665.gph.gz  (tile_id 795665)
-        # Level 1: 1/049/876.gph.gz      (tile_id 49876)
-        # Level 0: 0/003/109.gph.gz      (tile_id 3109)
-        
-        if level == 2:
-            dir1 = tile_id // 1000000           # millions
-            dir2 = (tile_id // 1000) % 1000     # thousands  
-            dir3 = tile_id % 1000               # ones
-            base = os.path.join(self.tiles_dir, str(level), 
-                               str(dir1).zfill(3), str(dir2).zfill(3))
-            fname = str(dir3).zfill(3)
-        else:
-            # Level 0 and 1: simpler structure
-            dir1 = tile_id // 1000
-            dir2 = tile_id % 1000
-            base = os.path.join(self.tiles_dir, str(level), str(dir1).zfill(3))
-            fname = str(dir2).zfill(3)
-        
-        for ext in ['.gph.gz', '.gph']:
-            path = os.path.join(base, fname + ext)
-            if os.path.exists(path):
-                return path
-        return None
+        if self._path_index is None:
+            self.rescan()
+        return self._path_index.get((level, tile_id))
+    
+    def tile_keys(self):
+        """Sorted (level, tile_id) of the tiles on disk, from the path index"""
+        if self._path_index is None:
+            self.rescan()
+        return sorted(self._path_index)
+    
+    def tile_count(self):
+        """Number of tiles on disk, from the path index"""
+        if self._path_index is None:
+            self.rescan()
+        return len(self._path_index)
+    
+    @staticmethod
+    def route_cache_key(from_lat, from_lon, to_lat, to_lon, costing):
+        """Route cache key - coordinates rounded to ~1 m so near-duplicate requests hit"""
+        return (round(from_lat, 5), round(from_lon, 5), round(to_lat, 5), round(to_lon, 5),
+                costing.cache_key())
+    
+    def route_cache_get(self, key):
+        with self.lock:
+            result = self.route_cache.get(key)
+            if result is not None:
+                self.route_cache.move_to_end(key)
+            return result
+    
+    def route_cache_put(self, key, result):
+        with self.lock:
+            self.route_cache[key] = result
+            self.route_cache.move_to_end(key)
+            while len(self.route_cache) > self.route_cache_max:
+                self.route_cache.popitem(last=False)
+    
+    def get_edge_costs(self, tile, costing):
+        """
+        Per-edge (costs, times) arrays of a tile under costing, memoized on the tile.
+        
+        Entries start as NaN and are filled in by the router the first time an edge
+        is relaxed, so a tile only ever pays for the edges that searches touch.
+        """
+        key = costing.cache_key()
+        memo = tile.edge_costs
+        if memo is None or memo[0] != key:
+            unset = array('d', [float('nan')])
+            memo = tile.edge_costs = (key, unset * tile.edge_count, unset * tile.edge_count)
+        return memo[1], memo[2]
     
     def get_cache_path(self, tile_id, level):
         """Get path for cached parsed tile"""
         return os.path.join(self.cache_dir, "%d_%d.cache" % (level, tile_id))
     
+    def _map_cache_buffers(self, buf_path, layout):
+        """mmap the .buf companion file and slice it into the out-of-band pickle buffers"""
+        with open(buf_path, 'rb') as f:
+            try:
+                view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            except ValueError:
+                view = memoryview(b'')  # Empty file (tile without columns)
+        return [view[offset:offset + size] for offset, size in layout]
+    
     def load_cached_tile(self, tile_id, level, source_path):
-        """Try to load from cache, return None if not available or stale"""
+        """
+        Try to load from cache, return None if not available or stale.
+        
+        Cache layout: <cache> holds the buffer layout followed by the tile pickle,
+        <cache>.buf holds the raw column data, which is mmapped so columns are
+        demand-paged views backed by the page cache instead of copies.
+        """
         cache_path = self.get_cache_path(tile_id, level)
         
         if not os.path.exists(cache_path):
@@ -1099,32 +1518,110 @@ class TileCache:
             if cache_mtime < source_mtime:
                 return None  # Cache is stale
             
-            import pickle
             with open(cache_path, 'rb') as f:
-                return pickle.load(f)
+                layout = pickle.load(f)
+                buffers = self._map_cache_buffers(cache_path + '.buf', layout)
+                tile = pickle.load(f, buffers=buffers)
+            if getattr(tile, 'cache_version', 0) != TILE_CACHE_VERSION:
+                return None  # Cache written by an older parser
+            return tile
         except:
             return None
     
+    def save_raw_tile(self, tile, cache_path):
+        """
+        Write the decompressed bytes of a .gph.gz tile next to its cache and switch the
+        tile over to an mmap of that file, so lazy getters never inflate it again.
+        """
+        data = tile.edge_data
+        if not tile.source_path.endswith('.gz') or data is None:
+            return
+        raw_path = cache_path + '.raw'
+        # Replace atomically - another copy of this tile may still have the old file mmapped
+        with open(raw_path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(raw_path + '.tmp', raw_path)
+        tile.raw_path = raw_path
+        tile.edge_data = None
+        _ensure_data(tile)
+    
     def save_cached_tile(self, tile, tile_id, level):
         """Save parsed tile to cache"""
         cache_path = self.get_cache_path(tile_id, level)
         
         try:
-            import pickle
-            with open(cache_path, 'wb') as f:
-                pickle.dump(tile, f, protocol=2)
+            self.save_raw_tile(tile, cache_path)
+            buffers = []
+            payload = pickle.dumps(tile, protocol=CACHE_PICKLE_PROTOCOL,
+                                   buffer_callback=buffers.append)
+            
+            # Write column buffers first, aligned so typed views need no copies.
+            # Both files are replaced atomically, .buf before the .cache that points
+            # into it - tiles loaded from the old cache may still have .buf mmapped.
+            layout = []
+            offset = 0
+            with open(cache_path + '.buf.tmp', 'wb') as f:
+                for buf in buffers:
+                    raw = buf.raw()
+                    pad = -offset % CACHE_BUFFER_ALIGN
+                    if pad:
+                        f.write(b'\0' * pad)
+                        offset += pad
+                    f.write(raw)
+                    layout.append((offset, raw.nbytes))
+                    offset += raw.nbytes
+            os.replace(cache_path + '.buf.tmp', cache_path + '.buf')
+            
+            with open(cache_path + '.tmp', 'wb') as f:
+                pickle.dump(layout, f, protocol=CACHE_PICKLE_PROTOCOL)
+                f.write(payload)
+            os.replace(cache_path + '.tmp', cache_path)
         except Exception as e:
-            print("Cache save error: %s" % e)
+            logger.warning("Cache save error: %s", e)
     
     def get_tile(self, level, tile_id, costing):
         key = (level, tile_id)
         
+        # Only while the tile is still cached: not after eviction or a rescan()
+        # (read without the lock - a single dict lookup is atomic)
+        last = getattr(self._tls, 'last', None)
+        if last is not None and last[0] == key and self.tiles.get(key) is last[1]:
+            return last[1]
+        
+        owner = False
         with self.lock:
-            if key in self.tiles:
-                self.access_order.remove(key)
-                self.access_order.append(key)
-                return self.tiles[key]
+            tile = self.tiles.get(key)
+            if tile is not None:
+                self.tiles.move_to_end(key)
+            else:
+                future = self._inflight.get(key)
+                if future is None:
+                    # Register the load so prefetch/other threads wait for it instead
+                    # of parsing (and rewriting the cache files of) the same tile twice
+                    future = self._inflight[key] = Future()
+                    owner = True
+        
+        if tile is None:
+            if owner:
+                try:
+                    tile = self._load_tile(level, tile_id)
+                    future.set_result(tile)
+                except BaseException as e:
+                    future.set_exception(e)
+                    raise
+                finally:
+                    with self.lock:
+                        self._inflight.pop(key, None)
+            else:
+                tile = future.result()
+            if tile is None:
+                return None
         
+        self._tls.last = (key, tile)
+        return tile
+    
+    def _load_tile(self, level, tile_id):
+        """Load a tile from the parsed cache (or parse it) and insert it into the LRU"""
         path = self.get_tile_path(tile_id, level)
         if not path:
             return None
@@ -1134,30 +1631,65 @@ class TileCache:
         
         if tile is None:
             # Parse from source
-            print("Parsing tile %d (this may take a moment)..." % tile_id)
+            logger.debug("Parsing tile %d (this may take a moment)...", tile_id)
             tile = parse_tile(path)
             if tile:
                 # Save to cache for next time
                 self.save_cached_tile(tile, tile_id, level)
-                print("Tile %d cached for faster loading next time" % tile_id)
+                logger.debug("Tile %d cached for faster loading next time", tile_id)
         else:
-            print("Loaded tile %d from cache" % tile_id)
+            logger.debug("Loaded tile %d from cache", tile_id)
             # Ensure source_path is set for transition loading
             tile.source_path = path
         
         if not tile:
             return None
         
+        key = (level, tile_id)
         with self.lock:
             self.tiles[key] = tile
-            self.access_order.append(key)
+            self.tiles.move_to_end(key)
             
             while len(self.tiles) > self.max_tiles:
-                old = self.access_order.pop(0)
-                del self.tiles[old]
+                self.tiles.popitem(last=False)
         
         return tile
     
+    def _prefetch_tile(self, key):
+        try:
+            return self._load_tile(key[0], key[1])
+        finally:
+            with self.lock:
+                self._inflight.pop(key, None)
+    
+    def prefetch(self, keys):
+        """
+        Start loading (level, tile_id) tiles in the background, in the given order,
+        so disk reads overlap with routing; cached, in-flight and missing tiles
+        are skipped. get_tile() waits on a pending load instead of repeating it.
+        
+        Only tiles that already have a parsed .cache are prefetched: parsing is
+        pure Python and would take the CPU from the search rather than overlap
+        with it. At most PREFETCH_MAX_PENDING loads are in flight at once.
+        """
+        if not self.prefetch_workers:
+            return
+        for key in keys:
+            if len(self._inflight) >= PREFETCH_MAX_PENDING:
+                return
+            if not self.get_tile_path(key[1], key[0]):
+                continue
+            if not os.path.exists(self.get_cache_path(key[1], key[0])):
+                continue
+            with self.lock:
+                if key in self.tiles or key in self._inflight:
+                    continue
+                if len(self._inflight) >= PREFETCH_MAX_PENDING:
+                    return
+                if self.prefetch_pool is None:
+                    self.prefetch_pool = ThreadPoolExecutor(max_workers=self.prefetch_workers)
+                self._inflight[key] = self.prefetch_pool.submit(self._prefetch_tile, key)
+    
     def get_tile_for_point(self, lat, lon, level, costing):
         tile_size = TILE_LEVELS[level]
         tiles_per_row = int(360.0 / tile_size)
@@ -1171,87 +1703,409 @@ class TileCache:
 # Router
 # ============================================================================
 
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371000
-    dlat = math.radians(lat2 - lat1)
-    dlon = math.radians(lon2 - lon1)
-    a = math.sin(dlat/2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon/2)**2
-    return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+EARTH_RADIUS_M = 6371000
+DEG_TO_RAD = math.pi / 180.0
+DEG_TO_M = EARTH_RADIUS_M * DEG_TO_RAD   # metres per degree of latitude
 
+# A* open set keys: f-score quantized to 1/F_SCALE cost units in the high bits, entry id
+# in the low ENTRY_BITS - plain ints compare much faster in heapq than tuples
+F_SCALE = 100
+ENTRY_BITS = 32
+ENTRY_MASK = (1 << ENTRY_BITS) - 1
 
-def find_nearest_node(tile, lat, lon):
-    bucket = (int(lat * 100), int(lon * 100))
+
+def pack_state(level, tile_id, node_id):
+    """Pack a routing state into one int: level (3 bits) | tile_id (22 bits) | node_id (21 bits)"""
+    return (level << 56) | (tile_id << 32) | node_id
+
+
+def unpack_state(state):
+    """Inverse of pack_state -> (level, tile_id, node_id)"""
+    return state >> 56, (state >> 32) & 0x3FFFFF, state & 0x1FFFFF
+
+
+def haversine_py(lat1, lon1, lat2, lon2, _sin=math.sin, _cos=math.cos,
+                 _atan2=math.atan2, _sqrt=math.sqrt):
+    """Great-circle distance in metres (math functions bound as defaults for speed)"""
+    s_dlat = _sin((lat2 - lat1) * DEG_TO_RAD * 0.5)
+    s_dlon = _sin((lon2 - lon1) * DEG_TO_RAD * 0.5)
+    a = s_dlat * s_dlat + _cos(lat1 * DEG_TO_RAD) * _cos(lat2 * DEG_TO_RAD) * s_dlon * s_dlon
+    return EARTH_RADIUS_M * 2 * _atan2(_sqrt(a), _sqrt(1 - a))
+
+
+def haversine_precomp(lat1, cos_lat1, lon1, lat2, cos_lat2, lon2, _sin=math.sin,
+                      _atan2=math.atan2, _sqrt=math.sqrt):
+    """haversine() with cos(lat) of both points supplied (see TileData.node_cos_lat)"""
+    s_dlat = _sin((lat2 - lat1) * DEG_TO_RAD * 0.5)
+    s_dlon = _sin((lon2 - lon1) * DEG_TO_RAD * 0.5)
+    a = s_dlat * s_dlat + cos_lat1 * cos_lat2 * s_dlon * s_dlon
+    return EARTH_RADIUS_M * 2 * _atan2(_sqrt(a), _sqrt(1 - a))
+
+
+if njit is not None:
+    haversine = njit('f8(f8,f8,f8,f8)', fastmath=True, cache=True)(haversine_py)
+    haversine(0.0, 0.0, 0.0, 0.0)  # compile/load the cached kernel at import, not on the first route
+else:
+    haversine = haversine_py
+
+
+def _nearest_candidates(tile, bucket):
+    """Node ids in the +-2 buckets around bucket (first 2000 nodes if all are empty)"""
     candidates = []
-    
     for dlat in range(-2, 3):
-        for dlon in range(-2, 3):
-            b = (bucket[0] + dlat, bucket[1] + dlon)
-            if b in tile.node_index:
-                candidates.extend(tile.node_index[b])
-    
+        candidates.extend(tile.lookup_bucket_range(bucket[0] + dlat, bucket[1] - 2, bucket[1] + 2))
     if not candidates:
-        candidates = list(range(min(2000, len(tile.nodes))))
+        candidates = range(min(2000, tile.node_count))
+    return candidates
+
+
+def find_nearest_node(tile, lat, lon, candidates=None):
+    """
+    Nearest node to (lat, lon) within +-2 spatial buckets. Returns (node_id, metres).
     
-    best_dist = float('inf')
+    Candidates are ranked by the haversine 'a' term, which is monotonic in the
+    distance, with the query point's radians/cosine hoisted out of the loop; the
+    full haversine is only evaluated for the winner.
+    """
+    if candidates is None:
+        candidates = _nearest_candidates(tile, (int(lat * 100), int(lon * 100)))
+    
+    best_a = float('inf')
     best_node = None
+    node_lats = tile.node_lats
+    node_lons = tile.node_lons
+    node_cos_lat = tile.node_cos_lat
+    sin = math.sin
+    to_rad = DEG_TO_RAD
+    cos_lat = math.cos(lat * to_rad)
     
     for idx in candidates:
-        node = tile.nodes[idx]
-        dist = haversine(lat, lon, node['lat'], node['lon'])
-        if dist < best_dist:
-            best_dist = dist
+        s_dlat = sin((node_lats[idx] - lat) * to_rad * 0.5)
+        s_dlon = sin((node_lons[idx] - lon) * to_rad * 0.5)
+        a = s_dlat * s_dlat + cos_lat * node_cos_lat[idx] * s_dlon * s_dlon
+        if a < best_a:
+            best_a = a
             best_node = idx
     
-    return best_node, best_dist
+    if best_node is None:
+        return None, float('inf')
+    return best_node, haversine(lat, lon, node_lats[best_node], node_lons[best_node])
 
 
-def route(cache, costing, from_lat, from_lon, to_lat, to_lon, level=2, use_hierarchy=True, simple_cost=False):
+def find_nearest_nodes_batch(tile, lats, lons):
     """
-    Hierarchical A* routing with transition support between tile levels.
+    find_nearest_node for many points on one tile -> list of (node_id, metres).
     
-    Uses Valhalla's hierarchical tile system:
-    - Level 2: Fine detail (0.25 degree tiles) - for start/end
-    - Level 1: Medium detail (1.0 degree tiles) - for longer distances
-    - Level 0: Coarse detail (4.0 degree tiles) - for very long routes
+    Queries falling into the same spatial bucket share one candidate gather, which
+    is most of the per-query cost for clustered points (matrix-style requests).
+    """
+    gathered = {}
+    results = []
+    for lat, lon in zip(lats, lons):
+        bucket = (int(lat * 100), int(lon * 100))
+        candidates = gathered.get(bucket)
+        if candidates is None:
+            candidates = gathered[bucket] = _nearest_candidates(tile, bucket)
+        results.append(find_nearest_node(tile, lat, lon, candidates))
+    return results
+
+
+def _astar_core(get_or_load_tile, edge_cost_tables_for, costing, start_state, end_state,
+                end_lat_target, end_lon_target, max_iterations, use_hierarchy, simple_cost):
+    """
+    The A* search loop of route(), over packed int states (see pack_state).
     
-    Transitions between levels are free (cost=0) to allow efficient routing.
-    Uses EdgeInfo shapes for accurate route geometry across all levels.
+    Tile loading, path reconstruction and result formatting stay in route(), so this
+    is the one function to replace with a compiled search (vrouter.c implements the
+    same search as a standalone binary).
     
-    If simple_cost=True, uses simplified cost (length/4) like hierarchical_router.py
+    Returns (entries, entry_parent, entry_edge, end_entry, stats): end_entry is the id
+    in entries the end state was expanded with (None if not reached); entry_parent and
+    entry_edge give each entry's predecessor entry and edge (see below); stats holds
+    the counters.
     """
-    import time as time_module
-    route_start_time = time_module.time()
-    
-    # Profiling counters
-    profile = {
-        'tile_loads': 0,
-        'tile_load_time': 0,
-        'expansions': 0,
-        'heap_pushes': 0,
-    }
+    # A* heuristic: equirectangular distance with cos(lat) fixed at the target - one
+    # sqrt per push instead of haversine's trig; simple_cost keeps the exact haversine
+    cos_lat_target = math.cos(end_lat_target * DEG_TO_RAD)
+    h_lon_scale = DEG_TO_M * cos_lat_target
+    
+    # Priority queue of packed (f_score, entry_id) ints (see F_SCALE / ENTRY_BITS), ties pop
+    # in push order; entries[entry_id] = (g_score, time, distance, state).
+    # best_entry maps state -> its current entry (CLOSED once expanded), so stale heap
+    # entries are dropped with one int compare (lazy deletion) instead of a visited set.
+    CLOSED = -1
+    entries = [(0, 0, 0, start_state)]
+    open_set = [0]
+    best_entry = {start_state: 0}
+    # Per entry, parallel to entries: the entry it was relaxed from and the edge index in
+    # that entry's tile (-1 = transition / start). Two flat int arrays appended per push
+    # instead of a came_from dict entry + tuple per relaxation
+    entry_parent = array('i', [-1])
+    entry_edge = array('i', [-1])
+    
+    # Upper bound: f-score of the end state's current entry. Anything pushed with f >= end_f
+    # would pop after the end state (ties pop in push order), i.e. never - such entries are
+    # still recorded so later relaxations compare against them, but kept off the heap
+    end_f = float('inf')
+    
+    # Exact heuristic per state: a state's h is computed once when it is first pushed and
+    # reused for its later relaxations, its expansion (h_current) and transitions to it
+    h_cache = {}
     
-    def get_tile_id_for_level(lat, lon, lv):
-        tile_size = TILE_LEVELS[lv]
-        tiles_per_row = int(360.0 / tile_size)
-        col = int((lon + 180.0) / tile_size)
-        row = int((lat + 90.0) / tile_size)
-        return row * tiles_per_row + col
+    iterations = 0
+    expansions = 0
+    heap_pushes = 0
+    heap_pruned = 0
+    level_transitions = 0
+    total_transitions_found = 0
+    end_entry = None
+    
+    # Hot-loop names bound as locals (LOAD_FAST instead of global/attribute lookups)
+    sqrt = math.sqrt
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+    best_entry_get = best_entry.get
+    h_cache_get = h_cache.get
+    entries_append = entries.append
+    parent_append = entry_parent.append
+    edge_append = entry_edge.append
+    inf = float('inf')
+    
+    while open_set and iterations < max_iterations:
+        iterations += 1
+        entry_id = heappop(open_set) & ENTRY_MASK
+        g, total_time, total_dist, current_state = entries[entry_id]
+        
+        # Skip stale entries (state since improved or already expanded)
+        if best_entry[current_state] != entry_id:
+            continue
+        best_entry[current_state] = CLOSED
+        expansions += 1
+        
+        # Check if we reached the exact destination node
+        if current_state == end_state:
+            end_entry = entry_id
+            break
+        
+        current_level = current_state >> 56
+        current_tile_id = (current_state >> 32) & 0x3FFFFF
+        current_node_id = current_state & 0x1FFFFF
+        
+        current_tile = get_or_load_tile(current_level, current_tile_id)
+        if not current_tile or current_node_id >= current_tile.node_count:
+            continue
+        
+        # 1. Expand regular edges
+        start_edge = current_tile.node_edge_idx[current_node_id]
+        end_edge = start_edge + current_tile.node_edge_cnt[current_node_id]
+        
+        if not simple_cost:
+            edge_costs, edge_times = edge_cost_tables_for(current_state >> 32, current_tile)
+        
+        end_edge = min(end_edge, current_tile.edge_count)
+        end_levels = current_tile.edge_end_level
+        end_tileids = current_tile.edge_end_tileid
+        end_ids = current_tile.edge_end_id
+        edge_lengths = current_tile.edge_length
+        node_lats = current_tile.node_lats
+        node_lons = current_tile.node_lons
+        node_count = current_tile.node_count
+        
+        # Heuristic of the current node: edges leaving the tile get the lower bound
+        # h(current) - length (triangle inequality), so their end tile is only loaded
+        # if the state is actually popped, not just to read a coordinate
+        h_current = h_cache_get(current_state)
+        if h_current is None:
+            if simple_cost:
+                h_current = haversine_precomp(node_lats[current_node_id],
+                                              current_tile.node_cos_lat[current_node_id],
+                                              node_lons[current_node_id], end_lat_target,
+                                              cos_lat_target, end_lon_target) / 4.0
+            else:
+                dy = (node_lats[current_node_id] - end_lat_target) * DEG_TO_M
+                dx = (node_lons[current_node_id] - end_lon_target) * h_lon_scale
+                h_current = sqrt(dy * dy + dx * dx) / 25.0 * 3.6
+            h_cache[current_state] = h_current
+        
+        # Only bike-accessible edges are visited (filtered by compress() in C)
+        for ei in compress(range(start_edge, end_edge), current_tile.edge_has_bike[start_edge:end_edge]):
+            neighbor_level = end_levels[ei]
+            
+            # If hierarchy is disabled, only follow edges on the same level
+            if not use_hierarchy and neighbor_level != current_level:
+                continue
+            
+            neighbor_tile_id = end_tileids[ei]
+            neighbor_node_id = end_ids[ei]
+            neighbor_state = (neighbor_level << 56) | (neighbor_tile_id << 32) | neighbor_node_id
+            
+            old_entry = best_entry_get(neighbor_state)
+            if old_entry == CLOSED:
+                continue
+            
+            same_tile = neighbor_tile_id == current_tile_id and neighbor_level == current_level
+            if same_tile and neighbor_node_id >= node_count:
+                continue
+            
+            length = edge_lengths[ei]
+            
+            # Use simple cost for debugging (like hierarchical_router.py)
+            if simple_cost:
+                cost = length / 4.0
+                time_secs = length / 4.0  # Rough estimate
+            else:
+                cost = edge_costs[ei]
+                if cost != cost:  # NaN - not costed yet under this costing
+                    cost, time_secs = edge_cost_at(current_tile, ei, costing)
+                    edge_costs[ei] = cost
+                    edge_times[ei] = time_secs
+                else:
+                    time_secs = edge_times[ei]
+            
+            if cost >= inf:
+                continue
+            
+            new_g = g + cost
+            new_time = total_time + time_secs
+            new_dist = total_dist + length
+            
+            # Check if this is a better path
+            if old_entry is not None and new_g >= entries[old_entry][0]:
+                continue
+            
+            # Heuristic - must match cost scale
+            if not same_tile:
+                h = h_cache_get(neighbor_state)
+                if h is None:
+                    h = h_current - (length / 4.0 if simple_cost else length / 25.0 * 3.6)
+                    if h < 0.0:
+                        h = 0.0
+            else:
+                h = h_cache_get(neighbor_state)
+                if h is None:
+                    if simple_cost:
+                        h = haversine_precomp(node_lats[neighbor_node_id],
+                                              current_tile.node_cos_lat[neighbor_node_id],
+                                              node_lons[neighbor_node_id], end_lat_target,
+                                              cos_lat_target, end_lon_target) / 4.0
+                    else:
+                        dy = (node_lats[neighbor_node_id] - end_lat_target) * DEG_TO_M
+                        dx = (node_lons[neighbor_node_id] - end_lon_target) * h_lon_scale
+                        h = sqrt(dy * dy + dx * dx) / 25.0 * 3.6
+                    h_cache[neighbor_state] = h
+            
+            f = new_g + h
+            best_entry[neighbor_state] = len(entries)
+            if neighbor_state == end_state:
+                end_f = f
+            elif f >= end_f:
+                entries_append((new_g, new_time, new_dist, neighbor_state))
+                parent_append(entry_id)
+                edge_append(ei)
+                heap_pruned += 1
+                continue
+            heappush(open_set, (int(f * F_SCALE) << ENTRY_BITS) | len(entries))
+            entries_append((new_g, new_time, new_dist, neighbor_state))
+            parent_append(entry_id)
+            edge_append(ei)
+            heap_pushes += 1
+        
+        # 2. Expand transitions (free cost) - only if hierarchy is enabled
+        if use_hierarchy:
+            transitions = get_transitions(current_tile, current_node_id)
+            total_transitions_found += len(transitions)
+            for trans_level, trans_tid, trans_nid, is_up in transitions:
+                trans_state = (trans_level << 56) | (trans_tid << 32) | trans_nid
+                
+                old_entry = best_entry_get(trans_state)
+                if old_entry == CLOSED:
+                    continue
+                
+                # Transitions are free (cost = 0)
+                if old_entry is None or g < entries[old_entry][0]:
+                    trans_entry = best_entry[trans_state] = len(entries)
+                    entries_append((g, total_time, total_dist, trans_state))
+                    parent_append(entry_id)
+                    edge_append(-1)  # transition, no edge
+                    level_transitions += 1
+                    
+                    h = h_cache_get(trans_state)
+                    if h is None:
+                        trans_tile = get_or_load_tile(trans_level, trans_tid)
+                        if trans_tile and trans_nid < trans_tile.node_count:
+                            trans_lat = trans_tile.node_lats[trans_nid]
+                            trans_lon = trans_tile.node_lons[trans_nid]
+                            if simple_cost:
+                                h = haversine_precomp(trans_lat, trans_tile.node_cos_lat[trans_nid],
+                                                      trans_lon, end_lat_target, cos_lat_target,
+                                                      end_lon_target) / 4.0
+                            else:
+                                dy = (trans_lat - end_lat_target) * DEG_TO_M
+                                dx = (trans_lon - end_lon_target) * h_lon_scale
+                                h = sqrt(dy * dy + dx * dx) / 25.0 * 3.6
+                            h_cache[trans_state] = h
+                    
+                    if h is not None:
+                        if trans_state == end_state:
+                            end_f = g + h
+                        elif g + h >= end_f:
+                            heap_pruned += 1
+                            continue
+                        heappush(open_set, (int((g + h) * F_SCALE) << ENTRY_BITS) | trans_entry)
+    
+    stats = {
+        'iterations': iterations,
+        'expansions': expansions,
+        'heap_pushes': heap_pushes,
+        'heap_pruned': heap_pruned,
+        'level_transitions': level_transitions,
+        'transitions_found': total_transitions_found,
+    }
+    return entries, entry_parent, entry_edge, end_entry, stats
+
+
+def route(cache, costing, from_lat, from_lon, to_lat, to_lon, level=2, use_hierarchy=True, simple_cost=False):
+    """
+    Hierarchical A* routing with transition support between tile levels.
+    
+    Uses Valhalla's hierarchical tile system:
+    - Level 2: Fine detail (0.25 degree tiles) - for start/end
+    - Level 1: Medium detail (1.0 degree tiles) - for longer distances
+    - Level 0: Coarse detail (4.0 degree tiles) - for very long routes
+    
+    Transitions between levels are free (cost=0) to allow efficient routing.
+    Uses EdgeInfo shapes for accurate route geometry across all levels.
+    
+    If simple_cost=True, uses simplified cost (length/4) like hierarchical_router.py
+    """
+    import time as time_module
+    route_start_time = time_module.time()
+    
+    # Tile load counters (timed only with PROFILE)
+    profile = {
+        'tile_loads': 0,
+        'tile_load_time': 0,
+    }
+    
+    def get_tile_id_for_level(lat, lon, lv):
+        tile_size = TILE_LEVELS[lv]
+        tiles_per_row = int(360.0 / tile_size)
+        col = int((lon + 180.0) / tile_size)
+        row = int((lat + 90.0) / tile_size)
+        return row * tiles_per_row + col
     
     # Start on Level 2 (finest detail)
     start_level = 2
     from_tile_id = get_tile_id_for_level(from_lat, from_lon, start_level)
     to_tile_id = get_tile_id_for_level(to_lat, to_lon, start_level)
     
-    # Get start tile
+    # Get start and end tiles
     t0 = time_module.time()
     from_tile = cache.get_tile(start_level, from_tile_id, costing)
-    profile['tile_load_time'] += time_module.time() - t0
     profile['tile_loads'] += 1
     if not from_tile:
         return None, "No tile data for start location"
     
-    # Get end tile
-    t0 = time_module.time()
     to_tile = cache.get_tile(start_level, to_tile_id, costing)
     profile['tile_load_time'] += time_module.time() - t0
     profile['tile_loads'] += 1
@@ -1266,35 +2120,44 @@ def route(cache, costing, from_lat, from_lon, to_lat, to_lon, level=2, use_hiera
         return None, "Could not find nodes near coordinates"
     
     # Target location for heuristic
-    end_lat_target = to_tile.nodes[end_node]['lat']
-    end_lon_target = to_tile.nodes[end_node]['lon']
-    
-    # State = (level, tile_id, node_id) - now includes level!
-    start_state = (start_level, from_tile_id, start_node)
-    end_state = (start_level, to_tile_id, end_node)
+    end_lat_target = to_tile.node_lats[end_node]
+    end_lon_target = to_tile.node_lons[end_node]
     
-    # Priority queue: (f_score, g_score, time, distance, state)
-    # NO MORE path/edges in heap - use predecessor tracking instead!
-    open_set = [(0, 0, 0, 0, start_state)]
-    g_scores = {start_state: (0, 0, 0)}  # state -> (g_score, time, distance)
-    came_from = {}  # state -> (predecessor_state, edge_info)
-    visited = set()
+    # State = (level, tile_id, node_id) packed into one int (see pack_state) - int
+    # hashing/compares are cheaper than tuples in the search's best_entry dict
+    start_state = pack_state(start_level, from_tile_id, start_node)
+    end_state = pack_state(start_level, to_tile_id, end_node)
     
     # Tile cache for this route - keyed by (level, tile_id)
     tiles = {(start_level, from_tile_id): from_tile, (start_level, to_tile_id): to_tile}
+    cache.prefetch(tiles_toward(from_tile.neighbor_tile_keys(), (start_level, from_tile_id),
+                                end_lat_target, end_lon_target))
     
     def get_or_load_tile(lv, tid):
         key = (lv, tid)
         if key not in tiles:
-            t0 = time_module.time()
-            t = cache.get_tile(lv, tid, costing)
-            profile['tile_load_time'] += time_module.time() - t0
+            if PROFILE:
+                t0 = time_module.time()
+                t = cache.get_tile(lv, tid, costing)
+                profile['tile_load_time'] += time_module.time() - t0
+            else:
+                t = cache.get_tile(lv, tid, costing)
             profile['tile_loads'] += 1
             if t:
                 tiles[key] = t
+                # The search reached this tile - start loading the tiles it borders
+                # on the destination's side
+                cache.prefetch(tiles_toward(t.neighbor_tile_keys(), key,
+                                            end_lat_target, end_lon_target))
         return tiles.get(key)
     
-    iterations = 0
+    edge_cost_tables = {}  # state >> 32 -> (costs, times) of that tile, see get_edge_costs
+    
+    def edge_cost_tables_for(tile_key, tile):
+        tables = edge_cost_tables.get(tile_key)
+        if tables is None:
+            tables = edge_cost_tables[tile_key] = cache.get_edge_costs(tile, costing)
+        return tables
     
     # Adaptive max_iterations based on distance
     # Short routes need fewer iterations
@@ -1308,227 +2171,104 @@ def route(cache, costing, from_lat, from_lon, to_lat, to_lon, level=2, use_hiera
     else:
         max_iterations = 300000
     
-    level_transitions = 0
-    total_transitions_found = 0
-    
     # Debug: Count transitions in start tile
-    start_trans_count = sum(1 for i in range(from_tile.node_count) 
-                            if from_tile.node_trans_up[i] or from_tile.node_trans_down[i])
+    start_trans_count = sum(map(bool, from_tile.node_trans_flags))
     print("[ROUTE DEBUG] Start tile %d has %d nodes with transitions" % (from_tile_id, start_trans_count))
     
-    while open_set and iterations < max_iterations:
-        iterations += 1
-        f, g, total_time, total_dist, current_state = heapq.heappop(open_set)
-        
-        # Skip if already visited with better cost
-        if current_state in visited:
-            continue
-        visited.add(current_state)
-        profile['expansions'] += 1
-        
-        current_level, current_tile_id, current_node_id = current_state
-        
-        # Check if we reached the exact destination node
-        if current_state == end_state:
-            # Reconstruct path by following came_from backwards
-            path = []
-            edges = []
-            state = current_state
-            while state in came_from:
-                path.append(state)
-                prev_state, edge_info = came_from[state]
-                if edge_info:  # Regular edge, not transition
-                    edges.append(edge_info)
-                state = prev_state
-            path.append(start_state)
-            path.reverse()
-            edges.reverse()
-            
-            # Build coordinates from path
-            coords = []
-            for lv, tid, nid in path:
-                tile = get_or_load_tile(lv, tid)
-                if tile and nid < len(tile.nodes):
-                    node = tile.nodes[nid]
-                    coords.append({'lat': node['lat'], 'lon': node['lon']})
-            
-            print("[ROUTE DEBUG] Using node coords: %d points" % len(coords))
-            
-            # Calculate road statistics from edges
-            car_distance = 0
-            cycleway_distance = 0
-            level_usage = {}
-            
-            for edge_info in edges:
-                length = edge_info.get('length', 0)
-                use = edge_info.get('use', 0)
-                classification = edge_info.get('classification', 5)
-                cycle_lane = edge_info.get('cycle_lane', 0)
-                edge_level = edge_info.get('level', 2)
-                
-                level_usage[edge_level] = level_usage.get(edge_level, 0) + length
-                
-                if use in (Use.kCycleway, Use.kPath, Use.kFootway, Use.kLivingStreet, 
-                           Use.kTrack, Use.kBridleway, Use.kPedestrian):
-                    cycleway_distance += length
-                elif use == Use.kRoad and classification <= RoadClass.kTertiary and cycle_lane == 0:
-                    car_distance += length
-                elif use == Use.kRoad and cycle_lane > 0:
-                    cycleway_distance += length * 0.5
-                    car_distance += length * 0.5
-                else:
-                    car_distance += length * 0.3
-            
-            print("[ROUTE DEBUG] Found! dist=%.1f km, iters=%d, level_trans=%d, trans_found=%d" % 
-                  (total_dist/1000.0, iterations, level_transitions, total_transitions_found))
-            if level_usage:
-                for lv, dist in sorted(level_usage.items()):
-                    print("[ROUTE DEBUG]   Level %d: %.2f km" % (lv, dist/1000.0))
-            
-            # Print profiling info
-            route_time = time_module.time() - route_start_time
-            print("[PROFILE] Total: %.2fs | Tiles: %d (%.2fs) | Iter: %d | Expand: %d | HeapPush: %d" % (
-                route_time, profile['tile_loads'], profile['tile_load_time'], iterations, profile['expansions'], profile['heap_pushes']
-            ))
-            
-            return {
-                'coords': coords,
-                'distance': total_dist,
-                'time': total_time,
-                'nodes': len(path),
-                'iterations': iterations,
-                'car_distance': car_distance,
-                'cycleway_distance': cycleway_distance,
-                'level_transitions': level_transitions,
-                'level_usage': level_usage,
-                'debug': {
-                    'transitions_found': total_transitions_found,
-                    'start_tile_trans': start_trans_count,
-                    'coord_count': len(coords),
-                }
-            }, None
-        
-        current_tile = get_or_load_tile(current_level, current_tile_id)
-        if not current_tile or current_node_id >= len(current_tile.nodes):
-            continue
-        
-        # 1. Expand regular edges
-        node = current_tile.nodes[current_node_id]
-        start_edge = node['edge_index']
-        end_edge = start_edge + node['edge_count']
-        
-        for ei in range(start_edge, min(end_edge, current_tile.edge_count)):
-            # Edge ends now include level info
-            end_level, neighbor_tile_id, neighbor_node_id, has_bike, opp_index = current_tile.edge_ends[ei]
-            
-            if not has_bike:
-                continue
-            
-            # If hierarchy is disabled, only follow edges on the same level
-            if not use_hierarchy and end_level != current_level:
-                continue
-            
-            # Get edge details for costing
-            edge = get_edge_details(current_tile, ei)
-            if edge is None:
-                continue
-            
-            # Use end_level from edge_ends (already extracted)
-            neighbor_level = end_level
-            neighbor_state = (neighbor_level, neighbor_tile_id, neighbor_node_id)
-            
-            if neighbor_state in visited:
-                continue
-            
-            # Load neighbor tile
-            neighbor_tile = get_or_load_tile(neighbor_level, neighbor_tile_id)
-            if not neighbor_tile or neighbor_node_id >= len(neighbor_tile.nodes):
-                continue
-            
-            length = edge['length']
-            
-            # Use simple cost for debugging (like hierarchical_router.py)
-            if simple_cost:
-                cost = length / 4.0
-                time_secs = length / 4.0  # Rough estimate
-            else:
-                cost, time_secs = costing.edge_cost(edge)
-            
-            if cost >= float('inf'):
-                continue
-            
-            new_g = g + cost
-            new_time = total_time + time_secs
-            new_dist = total_dist + length
-            
-            # Check if this is a better path
-            if neighbor_state in g_scores:
-                old_g, _, _ = g_scores[neighbor_state]
-                if new_g >= old_g:
-                    continue
-            
-            g_scores[neighbor_state] = (new_g, new_time, new_dist)
-            came_from[neighbor_state] = (current_state, {
-                'length': length,
-                'use': edge.get('use', 0),
-                'classification': edge.get('classification', 5),
-                'cycle_lane': edge.get('cycle_lane', 0),
-                'level': current_level,
-                'tile_id': current_tile_id,
-                'edge_idx': ei,
-            })
-            
-            # Heuristic - must match cost scale
-            neighbor_node = neighbor_tile.nodes[neighbor_node_id]
-            if simple_cost:
-                h = haversine(neighbor_node['lat'], neighbor_node['lon'], 
-                             end_lat_target, end_lon_target) / 4.0
-            else:
-                h = haversine(neighbor_node['lat'], neighbor_node['lon'], 
-                             end_lat_target, end_lon_target) / 25.0 * 3.6
-            
-            heapq.heappush(open_set, (new_g + h, new_g, new_time, new_dist, neighbor_state))
-            profile['heap_pushes'] += 1
-        
-        # 2. Expand transitions (free cost) - only if hierarchy is enabled
-        if use_hierarchy:
-            transitions = get_transitions(current_tile, current_node_id)
-            total_transitions_found += len(transitions)
-            for trans_level, trans_tid, trans_nid, is_up in transitions:
-                trans_state = (trans_level, trans_tid, trans_nid)
-                
-                if trans_state in visited:
-                    continue
-                
-                # Transitions are free (cost = 0)
-                old_g = g_scores.get(trans_state, (float('inf'), 0, 0))[0]
-                if g < old_g:
-                    g_scores[trans_state] = (g, total_time, total_dist)
-                    came_from[trans_state] = (current_state, None)  # None = transition, no edge
-                    level_transitions += 1
-                    
-                    trans_tile = get_or_load_tile(trans_level, trans_tid)
-                    if trans_tile and trans_nid < trans_tile.node_count:
-                        trans_node = trans_tile.nodes[trans_nid]
-                        if simple_cost:
-                            h = haversine(trans_node['lat'], trans_node['lon'],
-                                         end_lat_target, end_lon_target) / 4.0
-                        else:
-                            h = haversine(trans_node['lat'], trans_node['lon'],
-                                         end_lat_target, end_lon_target) / 25.0 * 3.6
-                        
-                        heapq.heappush(open_set, (g + h, g, total_time, total_dist, trans_state))
+    entries, entry_parent, entry_edge, end_entry, stats = _astar_core(
+        get_or_load_tile, edge_cost_tables_for, costing, start_state, end_state,
+        end_lat_target, end_lon_target, max_iterations, use_hierarchy, simple_cost)
+    iterations = stats['iterations']
+    level_transitions = stats['level_transitions']
+    total_transitions_found = stats['transitions_found']
+    
+    if PROFILE:
+        route_time = time_module.time() - route_start_time
+        print("[PROFILE] Total: %.2fs | Tiles: %d (%.2fs) | Iter: %d | Expand: %d | HeapPush: %d (pruned %d)" % (
+            route_time, profile['tile_loads'], profile['tile_load_time'], iterations,
+            stats['expansions'], stats['heap_pushes'], stats['heap_pruned']
+        ))
+    
+    if end_entry is None:
+        print("[ROUTE DEBUG] No route found! visited=%d, tiles=%d, level_trans=%d, trans_found=%d" %
+              (stats['expansions'], len(tiles), level_transitions, total_transitions_found))
+        return None, "No route found (searched %d nodes across %d tiles, %d level transitions)" % (
+            stats['expansions'], len(tiles), level_transitions)
+    
+    g, total_time, total_dist, _ = entries[end_entry]
+    
+    # Reconstruct path by following the entry parents backwards
+    path = []
+    edges = []  # (level, tile_id, edge index) of each regular edge on the path
+    entry = end_entry
+    while entry > 0:
+        path.append(entries[entry][3])
+        prev_entry = entry_parent[entry]
+        ei = entry_edge[entry]
+        if ei >= 0:  # Regular edge, not transition
+            prev_state = entries[prev_entry][3]
+            edges.append((prev_state >> 56, (prev_state >> 32) & 0x3FFFFF, ei))
+        entry = prev_entry
+    path.append(start_state)
+    path.reverse()
+    edges.reverse()
+    
+    # Build coordinates from path
+    coords = []
+    for lv, tid, nid in map(unpack_state, path):
+        tile = get_or_load_tile(lv, tid)
+        if tile and nid < tile.node_count:
+            coords.append({'lat': tile.node_lats[nid], 'lon': tile.node_lons[nid]})
+    
+    print("[ROUTE DEBUG] Using node coords: %d points" % len(coords))
+    
+    # Calculate road statistics from the path edges' columns
+    car_distance = 0
+    cycleway_distance = 0
+    level_usage = {}
+    
+    for edge_level, tid, ei in edges:
+        edge_tile = get_or_load_tile(edge_level, tid)
+        length = edge_tile.edge_length[ei]
+        use = edge_tile.edge_use[ei]
+        classification = edge_tile.edge_classification[ei]
+        cycle_lane = edge_tile.edge_cycle_lane[ei]
+        
+        level_usage[edge_level] = level_usage.get(edge_level, 0) + length
+        
+        if use in (Use.kCycleway, Use.kPath, Use.kFootway, Use.kLivingStreet, 
+                   Use.kTrack, Use.kBridleway, Use.kPedestrian):
+            cycleway_distance += length
+        elif use == Use.kRoad and classification <= RoadClass.kTertiary and cycle_lane == 0:
+            car_distance += length
+        elif use == Use.kRoad and cycle_lane > 0:
+            cycleway_distance += length * 0.5
+            car_distance += length * 0.5
+        else:
+            car_distance += length * 0.3
     
-    # Print profiling info even when no route found
-    route_time = time_module.time() - route_start_time
-    print("[PROFILE] Total: %.2fs | Tiles: %d (%.2fs) | Iter: %d | Expand: %d | HeapPush: %d" % (
-        route_time, profile['tile_loads'], profile['tile_load_time'], iterations, profile['expansions'], profile['heap_pushes']
-    ))
+    print("[ROUTE DEBUG] Found! dist=%.1f km, iters=%d, level_trans=%d, trans_found=%d" % 
+          (total_dist/1000.0, iterations, level_transitions, total_transitions_found))
+    if level_usage:
+        for lv, dist in sorted(level_usage.items()):
+            print("[ROUTE DEBUG]   Level %d: %.2f km" % (lv, dist/1000.0))
     
-    print("[ROUTE DEBUG] No route found! visited=%d, tiles=%d, level_trans=%d, trans_found=%d" %
-          (len(visited), len(tiles), level_transitions, total_transitions_found))
-    return None, "No route found (searched %d nodes across %d tiles, %d level transitions)" % (
-        len(visited), len(tiles), level_transitions)
+    return {
+        'coords': coords,
+        'distance': total_dist,
+        'time': total_time,
+        'nodes': len(path),
+        'iterations': iterations,
+        'car_distance': car_distance,
+        'cycleway_distance': cycleway_distance,
+        'level_transitions': level_transitions,
+        'level_usage': level_usage,
+        'debug': {
+            'transitions_found': total_transitions_found,
+            'start_tile_trans': start_trans_count,
+            'coord_count': len(coords),
+        }
+    }, None
 
 
 # ============================================================================
@@ -1536,28 +2276,62 @@ def route(cache, costing, from_lat, from_lon, to_lat, to_lon, level=2, use_hiera
 # ============================================================================
 
 def encode_polyline(coords, precision=6):
-    result = []
+    """
+    Google polyline encoding of [{'lat': .., 'lon': ..}, ...] (Valhalla uses precision 6).
+    
+    Zigzag is done with shifts/xor and the 5-bit groups go straight into a bytearray
+    as ASCII codes - no per-character chr() strings to join. The lat/lon deltas are
+    written out inline rather than looping over a 2-tuple per point, and the
+    continuation bit is folded into the offset (0x20 + 63 = 95).
+    """
+    scale = 10 ** precision
+    out = bytearray()
+    append = out.append
     prev_lat = 0
     prev_lon = 0
     
     for c in coords:
-        lat_int = int(round(c['lat'] * (10 ** precision)))
-        lon_int = int(round(c['lon'] * (10 ** precision)))
-        
-        d_lat = lat_int - prev_lat
-        d_lon = lon_int - prev_lon
+        lat_int = int(round(c['lat'] * scale))
+        lon_int = int(round(c['lon'] * scale))
+        
+        v = lat_int - prev_lat
+        v = (v << 1) ^ (v >> 63)  # zigzag
+        while v >= 0x20:
+            append((v & 0x1f) + 95)
+            v >>= 5
+        append(v + 63)
+        
+        v = lon_int - prev_lon
+        v = (v << 1) ^ (v >> 63)
+        while v >= 0x20:
+            append((v & 0x1f) + 95)
+            v >>= 5
+        append(v + 63)
         
         prev_lat = lat_int
         prev_lon = lon_int
-        
-        for v in [d_lat, d_lon]:
-            v = ~(v << 1) if v < 0 else (v << 1)
-            while v >= 0x20:
-                result.append(chr((0x20 | (v & 0x1f)) + 63))
-                v >>= 5
-            result.append(chr(v + 63))
     
-    return ''.join(result)
+    return out.decode('ascii')
+
+
+def path_length(coords):
+    """
+    Length in metres of a [{'lat': .., 'lon': ..}, ...] path.
+    
+    Each point's cos(lat) is computed once and handed to haversine_precomp() for
+    both segments it belongs to.
+    """
+    distance = 0.0
+    cos = math.cos
+    prev_lat = prev_lon = prev_cos = None
+    for c in coords:
+        lat = c['lat']
+        lon = c['lon']
+        cos_lat = cos(lat * DEG_TO_RAD)
+        if prev_lat is not None:
+            distance += haversine_precomp(prev_lat, prev_cos, prev_lon, lat, cos_lat, lon)
+        prev_lat, prev_lon, prev_cos = lat, lon, cos_lat
+    return distance
 
 
 # ============================================================================
@@ -1570,6 +2344,11 @@ def encode_polyline(coords, precision=6):
 
 MODRANA_BASE = "https://data.modrana.org/osm_scout_server"
 COUNTRIES_JSON_URL = MODRANA_BASE + "/countries_provided.json"
+# Bundled copies of countries_provided.json, tried before COUNTRIES_JSON_URL
+COUNTRIES_JSON_LOCAL_PATHS = (
+    "/opt/valhalla-bike-router/countries_provided.json",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "countries_provided.json"),
+)
 VALHALLA_PACKAGES_URL = MODRANA_BASE + "/valhalla-33/valhalla/packages"
 GEOCODER_NLP_BASE = MODRANA_BASE + "/geocoder-nlp-39/geocoder-nlp"
 
@@ -1642,34 +2421,339 @@ REGION_TO_ISO = {
     'australia-oceania/new-zealand': 'NZ',
 }
 
+# Fallback for region ids missing from REGION_TO_ISO: ISO code by the last path part
+# of the region id (e.g. 'europe/austria' -> 'austria')
+REGION_NAME_TO_ISO = {
+    'austria': 'AT', 'hungary': 'HU', 'germany': 'DE', 'switzerland': 'CH',
+    'czech-republic': 'CZ', 'slovakia': 'SK', 'poland': 'PL', 'italy': 'IT',
+    'france': 'FR', 'spain': 'ES', 'portugal': 'PT', 'netherlands': 'NL',
+    'belgium': 'BE', 'united-kingdom': 'GB', 'great-britain': 'GB',
+    'sweden': 'SE', 'norway': 'NO', 'finland': 'FI', 'denmark': 'DK',
+    'greece': 'GR', 'croatia': 'HR', 'slovenia': 'SI', 'serbia': 'RS',
+    'romania': 'RO', 'bulgaria': 'BG', 'ukraine': 'UA', 'russia': 'RU',
+    'liechtenstein': 'LI', 'luxembourg': 'LU', 'azores': 'PT',
+    'usa': 'US', 'canada': 'CA', 'japan': 'JP', 'china': 'CN',
+    'india': 'IN', 'australia': 'AU', 'new-zealand': 'NZ',
+    'ireland': 'GB-IE', 'cyprus': 'CY', 'malta': 'MT', 'iceland': 'IS',
+    'estonia': 'EE', 'latvia': 'LV', 'lithuania': 'LT',
+    'bosnia-herzegovina': 'BA', 'albania': 'AL', 'montenegro': 'ME',
+    'macedonia': 'MK', 'kosovo': 'RS', 'moldova': 'MD', 'belarus': 'BY',
+}
+
 try:
     from urllib.request import urlopen, Request
-    from urllib.error import URLError
+    from urllib.error import URLError, HTTPError
+    from urllib.parse import urlsplit
+    import http.client as httplib
+except ImportError:
+    from urllib2 import urlopen, Request, URLError, HTTPError
+    from urlparse import urlsplit
+    import httplib
+
+# urllib3 is optional: with it all downloads share its keep-alive pool, without it each
+# download thread keeps its own http.client connection per host (see _keepalive_get)
+try:
+    import urllib3
+except ImportError:
+    urllib3 = None
+
+# bz2 may be missing from the app's Python (wunderw); packages are then staged on disk
+# and decompressed out of process instead of streamed through tarfile
+try:
+    import bz2
 except ImportError:
-    from urllib2 import urlopen, Request, URLError
+    bz2 = None
+
+DOWNLOAD_USER_AGENT = 'ValhallaBikeRouter/3.0'
+
+# Sent with every download
+DOWNLOAD_HEADERS = {'User-Agent': DOWNLOAD_USER_AGENT}
+
+# TCP keepalive on download connections, so a pooled connection idling while a package
+# is extracted isn't silently dropped by a mobile carrier's NAT
+DOWNLOAD_SOCKET_OPTIONS = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+
+# Packages downloaded concurrently ahead of extraction (bounded by the urllib3 pool size)
+PACKAGE_FETCH_WORKERS = 4
+
+# Geocoder / libpostal / parser .bz2 files downloaded (and decompressed) concurrently
+FILE_FETCH_WORKERS = 4
+
+# Minimum seconds between download progress updates (reads arrive every 64 KB)
+PROGRESS_UPDATE_INTERVAL = 0.1
 
-# Cache for countries data
+# Tile member of a package archive -> its path relative to the tiles dir:
+# level 0,1: level/xxx/yyy.gph.gz (3 parts), level 2: level/xxx/yyy/zzz.gph.gz (4 parts)
+TILE_MEMBER_RE = re.compile(r'(?:^|/)((?:[01]/[^/]+|2/[^/]+/[^/]+)/[^/]+\.gph(?:\.gz)?)$')
+
+# Buffer for shutil.copyfileobj() when writing downloaded/extracted/decompressed files
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# Compressed bytes read per BZ2Decompressor call in _bz2_decompress_stream()
+BZ2_READ_SIZE = 256 * 1024
+
+# Extracted tiles are handed back to the kernel with POSIX_FADV_DONTNEED so a region
+# download doesn't push everything else out of the page cache (Linux only)
+posix_fadvise = getattr(os, 'posix_fadvise', None)
+
+# is_package_installed() results are reused while the .list mtime is unchanged, for at
+# most this many seconds (tiles can be deleted without touching the .list); positive
+# libpostal/parser data checks are reused for as long
+PACKAGE_STATUS_TTL = 300
+
+# Cache for countries data: region_id -> (name, size-compressed bytes, valhalla packages)
 _countries_cache = None
 _countries_cache_time = 0
 
+# Downloaded regions, one JSON record per line appended as each download finishes
+# (replaces the rewritten-every-time regions.json, migrated on the next download)
+REGIONS_LOG = 'regions.jsonl'
+
+# Bump when the projection built by _project_countries() changes
+COUNTRIES_PICKLE_VERSION = 1
+
+# Projection of the downloaded countries JSON with its ETag/Last-Modified, so a refresh
+# is a conditional GET answered with 304 unless modrana published a new list
+COUNTRIES_REMOTE_PICKLE = 'countries_provided.remote.pickle'
+
+
+def _bz2_decompress_stream(src, dst):
+    """
+    Decompress the bz2 data read from src into dst -> (compressed, decompressed) sizes.
+    
+    Reads BZ2_READ_SIZE at a time (BZ2File reads its input 8 KB at a time) and caps
+    each decompress() output at COPY_BUFFER_SIZE, so memory stays bounded even for
+    highly compressible files. Multi-stream files (pbzip2) are followed like BZ2File does.
+    """
+    decompressor = bz2.BZ2Decompressor()
+    started = False
+    compressed = decompressed = 0
+    
+    while True:
+        buf = src.read(BZ2_READ_SIZE)
+        if not buf:
+            break
+        compressed += len(buf)
+        while True:
+            out = decompressor.decompress(buf, COPY_BUFFER_SIZE)
+            buf = b''
+            started = True
+            if out:
+                dst.write(out)
+                decompressed += len(out)
+            if decompressor.eof:
+                buf = decompressor.unused_data
+                decompressor = bz2.BZ2Decompressor()
+                started = False
+                if not buf:
+                    break
+            elif decompressor.needs_input:
+                break
+    
+    if started and not decompressor.eof:
+        raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+    return compressed, decompressed
+
+
+def _region_record_line(region_id, packages, timestamp):
+    """One regions.jsonl line"""
+    return json.dumps({'region_id': region_id, 'packages': packages, 'timestamp': timestamp},
+                      separators=(',', ':')) + '\n'
+
+
+def _project_countries(countries):
+    """
+    Reduce parsed countries_provided.json to what the download manager uses:
+    {region_id: (name, size_compressed, packages tuple)}. The full JSON carries every
+    map provider's metadata per region; this is a fraction of its size in memory.
+    """
+    projected = {}
+    for country_id, data in countries.items():
+        valhalla = data.get('valhalla', {})
+        if not isinstance(valhalla, dict):
+            continue  # the top-level 'url' entry maps providers to version strings
+        # Get nice name from data or convert from ID
+        name = data.get('name', country_id.replace('/', ' / ').replace('-', ' ').title())
+        projected[country_id] = (name, int(valhalla.get('size-compressed', 0)),
+                                 tuple(valhalla.get('packages', ())))
+    return projected
+
+
+class _CountingReader(object):
+    """File-like wrapper around a download response that reports each read's size"""
+    
+    def __init__(self, response, on_read):
+        self.response = response
+        self.on_read = on_read
+    
+    def read(self, size=-1):
+        data = self.response.read(size)
+        if data:
+            self.on_read(len(data))
+        return data
+
 
 class DownloadManager:
     """Download Valhalla tiles from modrana.org using countries_provided.json"""
     
     def __init__(self, tiles_dir):
         self.tiles_dir = tiles_dir
-        self.downloads = {}  # region -> {'progress': 0-100, 'status': str}
+        # region -> {'progress': 0-100, 'status': str}. A status is published by storing
+        # a new dict under its region (one atomic store) and read by copying it, so only
+        # download_region()'s check-and-start and the fetch threads' shared byte counters
+        # take self.lock. The fetch threads update their own progress dict in place, but
+        # never one the download thread stored
+        self.downloads = {}
         self.lock = threading.Lock()
+        self.dir_lock = threading.Lock()  # packages extract concurrently into shared dirs
+        self._ensured_dirs = set()  # see _ensure_dir
         self.countries_data = None
+        self._pkg_installed_cache = {}  # str(pkg_num) -> (.list mtime, checked at, installed)
+        self._data_present_at = {}  # 'libpostal' / 'parser:<ISO>' -> time all files were found
+        self._regions_cache = None  # (countries dict it was built from, sorted region tuple)
+        
+        # Everything is fetched from data.modrana.org, so one pool lets packages, geocoder
+        # and libpostal files reuse the same TLS session
+        self.http = None
+        if urllib3 is not None:
+            self.http = urllib3.PoolManager(
+                num_pools=2, maxsize=8, block=True,
+                retries=urllib3.Retry(3, backoff_factor=0.3),
+                headers=DOWNLOAD_HEADERS,
+                socket_options=(urllib3.connection.HTTPConnection.default_socket_options
+                                + DOWNLOAD_SOCKET_OPTIONS))
+        self._http_local = threading.local()  # without urllib3: per-thread connections
+    
+    @contextlib.contextmanager
+    def _open_url(self, url, timeout, headers=None):
+        """
+        GET url as a streaming response (.read(n), .headers, .status) over a kept-alive
+        connection (urllib3's pool, else _keepalive_get). HTTP errors raise like
+        urlopen's do; a 304 answer to conditional headers is yielded with status 304.
+        """
+        if self.http is None:
+            conn, response = self._keepalive_get(url, timeout, headers)
+            if response is not None:
+                try:
+                    yield response
+                finally:
+                    if not response.isclosed():
+                        conn.close()  # body left unread, the connection can't be reused
+                    response.close()
+                return
+            
+            # Redirects and odd schemes: plain urlopen
+            req = Request(url, headers=dict(DOWNLOAD_HEADERS, **(headers or {})))
+            try:
+                response = urlopen(req, timeout=timeout)
+            except HTTPError as e:
+                if e.code != 304:
+                    raise
+                response = e  # urllib treats 304 as an error
+            try:
+                yield response
+            finally:
+                response.close()
+            return
+        
+        # Per-request headers replace the pool's, so merge them
+        if headers:
+            headers = dict(DOWNLOAD_HEADERS, **headers)
+        response = self.http.request('GET', url, headers=headers, preload_content=False,
+                                     timeout=urllib3.Timeout(connect=10, read=timeout))
+        try:
+            if response.status >= 400:
+                response.drain_conn()
+                raise URLError('HTTP %d for %s' % (response.status, url))
+            yield response
+        finally:
+            response.release_conn()
+    
+    def _keepalive_get(self, url, timeout, headers):
+        """
+        Without urllib3: GET url on this thread's kept-alive connection to its host,
+        so the geocoder, libpostal and package files of a download share one TLS
+        handshake per thread. -> (conn, response), or (conn, None) for a redirect or a
+        non-HTTP URL, which the caller leaves to urlopen.
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            return None, None
+        
+        conns = getattr(self._http_local, 'conns', None)
+        if conns is None:
+            conns = self._http_local.conns = {}
+        key = (parts.scheme, parts.netloc)
+        conn = conns.get(key)
+        if conn is None:
+            if parts.scheme == 'https':
+                conn = httplib.HTTPSConnection(parts.netloc, timeout=timeout)
+            else:
+                conn = httplib.HTTPConnection(parts.netloc, timeout=timeout)
+            conns[key] = conn
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        request_headers = dict(DOWNLOAD_HEADERS, **(headers or {}))
+        
+        # The server may have closed an idle connection; retry once on a fresh one
+        for attempt in (0, 1):
+            try:
+                if conn.sock is None:
+                    conn.connect()
+                    for level, option, value in DOWNLOAD_SOCKET_OPTIONS:
+                        conn.sock.setsockopt(level, option, value)
+                conn.request('GET', path, headers=request_headers)
+                response = conn.getresponse()
+                break
+            except (httplib.HTTPException, OSError):
+                conn.close()
+                if attempt:
+                    raise
+        
+        if response.status in (301, 302, 303, 307, 308):
+            response.read()
+            response.close()
+            return conn, None
+        if response.status >= 400:
+            response.read()
+            response.close()
+            raise HTTPError(url, response.status, response.reason, response.headers, None)
+        if response.status == 304:
+            response.read()  # no body; frees the connection for the next request
+        return conn, response
     
     def is_package_installed(self, pkg_num):
-        """Check if a package is installed (all tiles from .list exist)"""
+        """
+        Check if a package is installed (all tiles from .list exist).
+        
+        The full check stats every tile in the .list; its result is memoized on the
+        .list mtime (see PACKAGE_STATUS_TTL), so status polls cost one stat().
+        """
         packages_dir = os.path.join(self.tiles_dir, 'packages')
         list_path = os.path.join(packages_dir, str(pkg_num) + '.list')
         
-        if not os.path.exists(list_path):
+        try:
+            mtime = os.stat(list_path).st_mtime
+        except OSError:
             return False
         
+        key = str(pkg_num)
+        now = time.time()
+        cached = self._pkg_installed_cache.get(key)
+        if cached is not None and cached[0] == mtime and now - cached[1] < PACKAGE_STATUS_TTL:
+            return cached[2]
+        
+        installed = self._package_tiles_present(list_path)
+        self._pkg_installed_cache[key] = (mtime, now, installed)
+        return installed
+    
+    def _package_tiles_present(self, list_path):
+        """True if the .list is non-empty and every tile in it exists"""
         try:
             with open(list_path, 'r') as f:
                 tiles = [line.strip() for line in f if line.strip()]
@@ -1677,14 +2761,22 @@ class DownloadManager:
             if not tiles:
                 return False
             
-            # Check if all tiles exist
+            # Group tile names by directory: one listing per tile dir instead of a
+            # stat() per tile
+            by_dir = {}
             for tile in tiles:
                 # Remove valhalla/tiles/ prefix if present (from original .list files)
                 if tile.startswith('valhalla/tiles/'):
                     tile = tile[len('valhalla/tiles/'):]
                 # Handle both 3-part (level 0,1) and 4-part (level 2) paths
-                tile_path = os.path.join(self.tiles_dir, *tile.split('/'))
-                if not os.path.exists(tile_path):
+                parts = tile.split('/')
+                dir_path = os.path.join(self.tiles_dir, *parts[:-1])
+                by_dir.setdefault(dir_path, set()).add(parts[-1])
+            
+            # Check if all tiles exist
+            for dir_path, names in by_dir.items():
+                present = set(os.listdir(dir_path))
+                if not names <= present:
                     return False
             
             return True
@@ -1707,7 +2799,21 @@ class DownloadManager:
         
         This handles the case where a file exists where a directory should be.
         For example, if /a/b is a file but we need /a/b/c.txt, we delete /a/b first.
+        Directories ensured once are remembered, so the per-tile call during
+        extraction is a set lookup; thread-safe (packages extract concurrently).
         """
+        if dir_path in self._ensured_dirs:
+            return
+        
+        with self.dir_lock:
+            try:
+                os.makedirs(dir_path, exist_ok=True)
+            except (FileExistsError, NotADirectoryError):
+                self._clear_path_blockers(dir_path)
+            self._ensured_dirs.add(dir_path)
+    
+    def _clear_path_blockers(self, dir_path):
+        """Create dir_path, deleting files that sit where it or a parent dir should be"""
         if os.path.exists(dir_path):
             if os.path.isdir(dir_path):
                 return  # Already a directory, nothing to do
@@ -1738,14 +2844,8 @@ class DownloadManager:
     
     def get_installed_regions(self):
         """Get list of installed region IDs"""
-        regions_file = os.path.join(self.tiles_dir, 'packages', 'regions.json')
-        
-        if not os.path.exists(regions_file):
-            return []
-        
         try:
-            with open(regions_file, 'r') as f:
-                regions_data = json.load(f)
+            regions_data = self._load_regions()
             
             installed = []
             for region_id, info in regions_data.items():
@@ -1757,8 +2857,80 @@ class DownloadManager:
         except:
             return []
     
+    def _load_regions(self):
+        """
+        region_id -> {'packages': [...], 'timestamp': str} for downloaded regions: the
+        legacy regions.json (if not migrated yet), then the regions.jsonl log, where
+        the last record of a region wins.
+        """
+        packages_dir = os.path.join(self.tiles_dir, 'packages')
+        regions_data = {}
+        
+        legacy_file = os.path.join(packages_dir, 'regions.json')
+        if os.path.exists(legacy_file):
+            try:
+                with open(legacy_file, 'r') as f:
+                    regions_data = json.load(f)
+            except Exception as e:
+                print("Error reading %s: %s" % (legacy_file, e))
+        
+        try:
+            with open(os.path.join(packages_dir, REGIONS_LOG), 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn line from an interrupted append
+                    regions_data[record.pop('region_id')] = record
+        except (IOError, OSError):
+            pass
+        
+        return regions_data
+    
+    def _append_region_record(self, region_id, packages):
+        """Record a downloaded region by appending one line to the regions.jsonl log"""
+        packages_dir = os.path.join(self.tiles_dir, 'packages')
+        self._ensure_dir(packages_dir)
+        log_file = os.path.join(packages_dir, REGIONS_LOG)
+        legacy_file = os.path.join(packages_dir, 'regions.json')
+        
+        lines = []
+        if os.path.exists(legacy_file):
+            # One-time migration: the legacy records go first (they are older than
+            # anything in the log), then the log is replaced and regions.json removed
+            with open(legacy_file, 'r') as f:
+                for rid, info in json.load(f).items():
+                    lines.append(_region_record_line(rid, info.get('packages', []),
+                                                     info.get('timestamp')))
+            if os.path.exists(log_file):
+                with open(log_file, 'r') as f:
+                    lines.extend(line for line in f if line.endswith('\n'))
+        
+        lines.append(_region_record_line(region_id, packages,
+                                         time.strftime('%Y-%m-%d %H:%M:%S')))
+        
+        if len(lines) == 1:
+            with open(log_file, 'ab+') as f:
+                if f.seek(0, os.SEEK_END) > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        f.write(b'\n')  # don't glue onto a torn line
+                f.write(lines[0].encode('utf-8'))
+            return log_file
+        
+        with open(log_file + '.tmp', 'w') as f:
+            f.write(''.join(lines))
+        os.replace(log_file + '.tmp', log_file)
+        os.remove(legacy_file)
+        return log_file
+    
     def _fetch_countries_json(self):
-        """Fetch and cache countries_provided.json"""
+        """
+        Fetch and cache countries_provided.json, projected by _project_countries().
+        
+        The projection of a local JSON file is pickled next to the tile packages and
+        reused while the JSON's mtime is unchanged, so startup skips json.load().
+        """
         global _countries_cache, _countries_cache_time
         import time
         
@@ -1767,38 +2939,94 @@ class DownloadManager:
             return _countries_cache
         
         # Try local file first (bundled with app)
-        local_paths = [
-            "/opt/valhalla-bike-router/countries_provided.json",
-            os.path.join(os.path.dirname(os.path.abspath(__file__)), "countries_provided.json"),
-        ]
-        
-        for local_path in local_paths:
+        for local_path in COUNTRIES_JSON_LOCAL_PATHS:
             if os.path.exists(local_path):
                 try:
-                    with open(local_path, 'r') as f:
-                        _countries_cache = json.load(f)
-                        _countries_cache_time = time.time()
-                        print("Loaded countries from local file: %s" % local_path)
-                        return _countries_cache
+                    key = (COUNTRIES_PICKLE_VERSION, local_path, os.path.getmtime(local_path))
+                    projected = self._load_countries_pickle(key)
+                    if projected is None:
+                        with open(local_path, 'r') as f:
+                            projected = _project_countries(json.load(f))
+                        self._save_countries_pickle(key, projected)
+                    _countries_cache = projected
+                    _countries_cache_time = time.time()
+                    print("Loaded countries from local file: %s" % local_path)
+                    return _countries_cache
                 except Exception as e:
                     print("Error loading local countries JSON: %s" % e)
         
-        # Fallback to download
+        # Fallback to download, revalidating the last copy with its ETag/Last-Modified
+        remote_path = self._countries_pickle_path(COUNTRIES_REMOTE_PICKLE)
+        validators, projected = self._load_remote_countries()
+        # The JSON compresses ~10x; .tar.bz2 downloads don't ask for gzip
+        headers = {'Accept-Encoding': 'gzip'}
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last-modified'):
+            headers['If-Modified-Since'] = validators['last-modified']
         try:
-            req = Request(COUNTRIES_JSON_URL)
-            req.add_header('User-Agent', 'ValhallaBikeRouter/3.0')
-            response = urlopen(req, timeout=60)
-            data = response.read().decode('utf-8')
-            _countries_cache = json.loads(data)
+            with self._open_url(COUNTRIES_JSON_URL, timeout=60, headers=headers) as response:
+                if response.status == 304:
+                    data = None
+                else:
+                    data = response.read()
+                    if data[:2] == b'\x1f\x8b':
+                        data = gzip.decompress(data)  # urllib3 decodes it, http.client doesn't
+                    data = data.decode('utf-8')
+                    validators = {'etag': response.headers.get('ETag'),
+                                  'last-modified': response.headers.get('Last-Modified')}
+            if data is None:
+                print("Countries JSON not modified")
+            else:
+                projected = _project_countries(json.loads(data))
+                self._save_countries_pickle((COUNTRIES_PICKLE_VERSION, validators), projected,
+                                            remote_path)
+                print("Loaded countries from URL")
+            _countries_cache = projected
             _countries_cache_time = time.time()
-            print("Loaded countries from URL")
             return _countries_cache
         except Exception as e:
             print("Error fetching countries JSON: %s" % e)
             return _countries_cache  # Return old cache if available
     
+    def _countries_pickle_path(self, name='countries_provided.pickle'):
+        return os.path.join(self.tiles_dir, 'packages', name)
+    
+    def _load_countries_pickle(self, key):
+        """Projected countries pickled for key (version, json path, json mtime), or None"""
+        try:
+            with open(self._countries_pickle_path(), 'rb') as f:
+                cached_key, projected = pickle.load(f)
+        except Exception:
+            return None
+        return projected if cached_key == key else None
+    
+    def _load_remote_countries(self):
+        """(validators, projected) of the last downloaded countries JSON, or ({}, None)"""
+        try:
+            with open(self._countries_pickle_path(COUNTRIES_REMOTE_PICKLE), 'rb') as f:
+                (version, validators), projected = pickle.load(f)
+        except Exception:
+            return {}, None
+        if version != COUNTRIES_PICKLE_VERSION or projected is None:
+            return {}, None
+        return validators, projected
+    
+    def _save_countries_pickle(self, key, projected, path=None):
+        path = path or self._countries_pickle_path()
+        try:
+            self._ensure_dir(os.path.dirname(path))
+            with open(path + '.tmp', 'wb') as f:
+                pickle.dump((key, projected), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path + '.tmp', path)
+        except Exception as e:
+            print("Could not write countries cache: %s" % e)
+    
     def get_regions(self):
-        """Get available regions from countries_provided.json"""
+        """
+        Get available regions from countries_provided.json. The sorted list is rebuilt
+        only when _fetch_countries_json() hands out a new countries dict.
+        """
         regions = []
         
         try:
@@ -1806,23 +3034,22 @@ class DownloadManager:
             if not countries:
                 return {'regions': [], 'source': 'error', 'error': 'Could not fetch country list'}
             
-            for country_id, data in countries.items():
+            cached = self._regions_cache
+            if cached is not None and cached[0] is countries:
+                return {
+                    'regions': cached[1],
+                    'source': 'online',
+                    'total_regions': len(cached[1])
+                }
+            
+            for country_id, (name, size_compressed, packages) in countries.items():
                 # Only include countries that have valhalla data
-                if 'valhalla' not in data:
-                    continue
-                
-                valhalla = data['valhalla']
-                packages = valhalla.get('packages', [])
                 if not packages:
                     continue
                 
                 # Calculate size in MB from compressed size
-                size_compressed = int(valhalla.get('size-compressed', 0))
                 size_mb = size_compressed // (1024 * 1024)
                 
-                # Get nice name from data or convert from ID
-                name = data.get('name', country_id.replace('/', ' / ').replace('-', ' ').title())
-                
                 regions.append({
                     'id': country_id,
                     'name': name,
@@ -1833,6 +3060,8 @@ class DownloadManager:
             
             # Sort by name
             regions.sort(key=lambda x: x['name'])
+            regions = tuple(regions)
+            self._regions_cache = (countries, regions)
             
             return {
                 'regions': regions,
@@ -1844,14 +3073,16 @@ class DownloadManager:
             return {'regions': [], 'source': 'error', 'error': str(e)}
     
     def get_download_status(self, region_id=None):
-        """Get download status"""
-        with self.lock:
-            if region_id:
-                return self.downloads.get(region_id, {'progress': 0, 'status': 'idle'})
-            return dict(self.downloads)
+        """Get download status (copies - the fetch threads update their progress dict in place)"""
+        if region_id:
+            return dict(self.downloads.get(region_id, {'progress': 0, 'status': 'idle'}))
+        return dict((rid, dict(status)) for rid, status in list(self.downloads.items()))
     
     def download_region(self, region_id, callback=None):
         """Download a region's tiles"""
+        # Interned once here so every self.downloads lookup by the worker
+        # and the status poller hits the identity fast path
+        region_id = sys.intern(region_id)
         with self.lock:
             if region_id in self.downloads and self.downloads[region_id].get('status') == 'downloading':
                 return {'error': 'Already downloading'}
@@ -1861,8 +3092,7 @@ class DownloadManager:
             try:
                 self._download_region_impl(region_id, callback)
             except Exception as e:
-                with self.lock:
-                    self.downloads[region_id] = {'progress': 0, 'status': 'error', 'error': str(e)}
+                self.downloads[region_id] = {'progress': 0, 'status': 'error', 'error': str(e)}
         
         thread = threading.Thread(target=do_download)
         thread.daemon = True
@@ -1872,6 +3102,7 @@ class DownloadManager:
     
     def update_region(self, region_id, callback=None):
         """Update/repair an installed region - download missing geocoder/libpostal files"""
+        region_id = sys.intern(region_id)
         with self.lock:
             if region_id in self.downloads and self.downloads[region_id].get('status') == 'downloading':
                 return {'error': 'Already downloading'}
@@ -1881,8 +3112,7 @@ class DownloadManager:
             try:
                 self._update_region_impl(region_id, callback)
             except Exception as e:
-                with self.lock:
-                    self.downloads[region_id] = {'progress': 0, 'status': 'error', 'error': str(e)}
+                self.downloads[region_id] = {'progress': 0, 'status': 'error', 'error': str(e)}
         
         thread = threading.Thread(target=do_update)
         thread.daemon = True
@@ -1951,41 +3181,37 @@ class DownloadManager:
         
         if not updates_needed:
             log("[UPDATE] Region %s is up to date, nothing to do" % region_id)
-            with self.lock:
-                self.downloads[region_id] = {
-                    'progress': 100,
-                    'status': 'complete',
-                    'message': 'Already up to date'
-                }
+            self.downloads[region_id] = {
+                'progress': 100,
+                'status': 'complete',
+                'message': 'Already up to date'
+            }
             return
         
         log("[UPDATE] Updates needed: %s" % updates_needed)
         
         # Download libpostal if missing
         if 'libpostal' in updates_needed:
-            with self.lock:
-                self.downloads[region_id] = {
-                    'progress': 20,
-                    'status': 'Downloading libpostal data...'
-                }
+            self.downloads[region_id] = {
+                'progress': 20,
+                'status': 'Downloading libpostal data...'
+            }
             libpostal_ok = self._download_libpostal_data(log)
         
         # Download parser if missing
         if 'parser' in updates_needed:
-            with self.lock:
-                self.downloads[region_id] = {
-                    'progress': 40,
-                    'status': 'Downloading parser data...'
-                }
-            parser_ok = self._download_parser_data(region_id, log)
+            self.downloads[region_id] = {
+                'progress': 40,
+                'status': 'Downloading parser data...'
+            }
+            parser_ok = self._download_parser_data(region_id, log, iso_code)
         
         # Download geocoder if missing
         if 'geocoder' in updates_needed:
-            with self.lock:
-                self.downloads[region_id] = {
-                    'progress': 60,
-                    'status': 'Downloading geocoder...'
-                }
+            self.downloads[region_id] = {
+                'progress': 60,
+                'status': 'Downloading geocoder...'
+            }
             geocoder_ok = self._download_geocoder(region_id, log)
         
         log("[UPDATE] Region %s update complete. Libpostal: %s, Parser: %s, Geocoder: %s" % (
@@ -1995,28 +3221,24 @@ class DownloadManager:
             'OK' if geocoder_ok else 'FAILED'
         ))
         
-        with self.lock:
-            self.downloads[region_id] = {
-                'progress': 100,
-                'status': 'complete'
-            }
+        self.downloads[region_id] = {
+            'progress': 100,
+            'status': 'complete'
+        }
         
         if callback:
             callback(region_id, 'complete')
     
     def _download_region_impl(self, region_id, callback=None):
         """Download all packages for a region"""
-        import tarfile
         import shutil
         import sys
         
         def log(msg):
-            """Log with flush for immediate output"""
-            print(msg)
+            """Log with flush for immediate output (one write, so fetch threads don't interleave lines)"""
+            sys.stdout.write(msg + '\n')
             sys.stdout.flush()
         
-        CHUNK_SIZE = 65536  # 64KB chunks
-        
         log("[DOWNLOAD] Starting download for region: %s" % region_id)
         
         # Get country data
@@ -2024,288 +3246,157 @@ class DownloadManager:
         if not countries:
             error_msg = 'Could not load countries data'
             log("[DOWNLOAD] Error: %s" % error_msg)
-            with self.lock:
-                self.downloads[region_id] = {'progress': 0, 'status': 'error', 'error': error_msg}
+            self.downloads[region_id] = {'progress': 0, 'status': 'error', 'error': error_msg}
             return
         
         if region_id not in countries:
             error_msg = 'Region not found: %s' % region_id
             log("[DOWNLOAD] Error: %s" % error_msg)
-            with self.lock:
-                self.downloads[region_id] = {'progress': 0, 'status': 'error', 'error': error_msg}
+            self.downloads[region_id] = {'progress': 0, 'status': 'error', 'error': error_msg}
             return
         
-        valhalla = countries[region_id].get('valhalla', {})
-        packages = valhalla.get('packages', [])
+        # Packages, and total size from JSON for progress calculation
+        _, total_size_compressed, packages = countries[region_id]
+        packages = list(packages)
         
         if not packages:
             error_msg = 'No packages for region'
             log("[DOWNLOAD] Error: %s" % error_msg)
-            with self.lock:
-                self.downloads[region_id] = {'progress': 0, 'status': 'error', 'error': error_msg}
+            self.downloads[region_id] = {'progress': 0, 'status': 'error', 'error': error_msg}
             return
         
         log("[DOWNLOAD] Found %d packages for %s: %s" % (len(packages), region_id, packages))
         
-        # Get total size from JSON for progress calculation
-        total_size_compressed = int(valhalla.get('size-compressed', 0))
-        total_size_mb = total_size_compressed / (1024.0 * 1024.0)
-        
         total_packages = len(packages)
         downloaded_packages = 0
         tiles_extracted = 0
-        total_bytes_downloaded = 0
         
-        # Create temp directory on MyDocs (has space, unlike /tmp which is only 4MB)
-        # Use /home/user/MyDocs/.valhalla-tmp/ for downloads
-        temp_dir = "/home/user/MyDocs/.valhalla-tmp"
-        if not os.path.exists(temp_dir):
+        # Shared with the fetch threads, guarded by self.lock
+        progress = {
+            'bytes': 0,
+            'bytes_total': total_size_compressed,
+            'packages_done': 0,
+            'packages_total': total_packages,
+            'aborted': False,  # set when a package failed - the other fetches stop
+        }
+        
+        # With bz2 packages stream straight into their tiles; only the staged fallback
+        # needs a temp directory for the archives
+        temp_dir = None
+        if bz2 is None:
+            # Create temp directory on MyDocs (has space, unlike /tmp which is only 4MB)
+            # Use /home/user/MyDocs/.valhalla-tmp/ for downloads
+            temp_dir = "/home/user/MyDocs/.valhalla-tmp"
             try:
-                os.makedirs(temp_dir)
-            except:
+                os.makedirs(temp_dir, exist_ok=True)
+            except OSError:
                 # Fallback to tiles_dir parent
                 temp_dir = os.path.dirname(self.tiles_dir)
-                if not os.path.exists(temp_dir):
-                    os.makedirs(temp_dir)
+                os.makedirs(temp_dir, exist_ok=True)
+        
+        def tar_path_for(pkg_num):
+            if temp_dir is None:
+                return None
+            return os.path.join(temp_dir, str(pkg_num) + ".tar.bz2")
+        
+        # Up to PACKAGE_FETCH_WORKERS packages download (and, with bz2, extract) at once;
+        # staged packages are extracted here one at a time, in package order
+        fetch_pool = ThreadPoolExecutor(max_workers=PACKAGE_FETCH_WORKERS)
+        fetches = {}
+        error_status = None
+        
+        def submit_fetch(i):
+            if i < total_packages:
+                pkg_num = packages[i]
+                fetches[i] = fetch_pool.submit(self._fetch_package, region_id, pkg_num,
+                                               tar_path_for(pkg_num), progress, log)
         
         try:
-            for pkg_num in packages:
-                pkg_url = VALHALLA_PACKAGES_URL + "/" + str(pkg_num) + ".tar.bz2"
-                tar_path = os.path.join(temp_dir, str(pkg_num) + ".tar.bz2")
-                
-                log("[DOWNLOAD] Downloading package %s from %s" % (pkg_num, pkg_url))
+            try:
+                for i in range(PACKAGE_FETCH_WORKERS):
+                    submit_fetch(i)
                 
-                # Download package with streaming
-                try:
-                    req = Request(pkg_url)
-                    req.add_header('User-Agent', 'ValhallaBikeRouter/3.0')
-                    response = urlopen(req, timeout=600)
-                    pkg_size = int(response.headers.get('Content-Length', 0))
-                    log("[DOWNLOAD] Package %s size: %d bytes" % (pkg_num, pkg_size))
+                for i, pkg_num in enumerate(packages):
+                    tar_path = tar_path_for(pkg_num)
                     
-                    pkg_downloaded = 0
-                    with open(tar_path, 'wb') as f:
-                        while True:
-                            chunk = response.read(CHUNK_SIZE)
-                            if not chunk:
-                                break
-                            f.write(chunk)
-                            pkg_downloaded += len(chunk)
-                            
-                            # Update progress based on total size from JSON
-                            current_total = total_bytes_downloaded + pkg_downloaded
-                            if total_size_compressed > 0:
-                                overall_progress = int(current_total * 90 / total_size_compressed)
-                            else:
-                                # Fallback to package count based progress
-                                overall_progress = int((downloaded_packages * 90 + pkg_downloaded * 90 / max(pkg_size, 1)) / total_packages)
-                            
-                            with self.lock:
-                                self.downloads[region_id] = {
-                                    'progress': min(overall_progress, 90),
-                                    'status': 'Downloading %.1f / %.1f MB' % (
-                                        current_total / (1024.0 * 1024.0),
-                                        total_size_mb
-                                    ),
-                                    'current_package': pkg_num,
-                                    'packages_done': downloaded_packages,
-                                    'packages_total': total_packages,
-                                    'bytes_downloaded': current_total,
-                                    'bytes_total': total_size_compressed
-                                }
-                    
-                    total_bytes_downloaded += pkg_downloaded
-                
-                except Exception as e:
-                    error_msg = "Error downloading package %s: %s" % (pkg_num, str(e))
-                    log("[DOWNLOAD] " + error_msg)
-                    import traceback
-                    traceback.print_exc()
-                    # Don't continue - mark as error
-                    with self.lock:
-                        self.downloads[region_id] = {
+                    try:
+                        extracted_tiles = fetches.pop(i).result()
+                    except Exception as e:
+                        error_msg = "Error downloading package %s: %s" % (pkg_num, str(e))
+                        log("[DOWNLOAD] " + error_msg)
+                        logger.exception("Package %s of region %s failed", pkg_num, region_id)
+                        # Don't continue - stop the other fetches and mark as error
+                        with self.lock:
+                            progress['aborted'] = True
+                        error_status = {
                             'progress': 0,
                             'status': 'error',
                             'error': error_msg
                         }
-                    return
-                
-                # Extract tar.bz2 and create .list file
-                with self.lock:
-                    self.downloads[region_id] = {
-                        'progress': min(int(total_bytes_downloaded * 90 / max(total_size_compressed, 1)), 90),
-                        'status': 'Extracting package %d/%d...' % (downloaded_packages + 1, total_packages)
-                    }
-                
-                extracted_tiles = []  # Track tiles from this package
-                
-                try:
-                    # Python's bz2 module may not be available in wunderw, use system python or bunzip2
-                    tar_uncompressed = tar_path.replace('.tar.bz2', '.tar')
-                    
-                    log("[DOWNLOAD] Decompressing package %s..." % pkg_num)
-                    import subprocess
-                    
-                    # Try system python first (has bz2 module)
-                    decompress_script = '''
-import bz2
-import sys
-with open(sys.argv[1], 'rb') as f_in:
-    with open(sys.argv[2], 'wb') as f_out:
-        f_out.write(bz2.decompress(f_in.read()))
-'''
-                    result = subprocess.run(
-                        ['python', '-c', decompress_script, tar_path, tar_uncompressed],
-                        capture_output=True
-                    )
-                    if result.returncode != 0:
-                        # Fallback to bunzip2
-                        log("[DOWNLOAD] Python bz2 failed, trying bunzip2...")
-                        with open(tar_uncompressed, 'wb') as f_out:
-                            result = subprocess.run(
-                                ['bunzip2', '-c', tar_path],
-                                stdout=f_out,
-                                stderr=subprocess.PIPE
-                            )
-                            if result.returncode != 0:
-                                raise Exception("bunzip2 failed: %s" % result.stderr.decode())
-                    
-                    log("[DOWNLOAD] Decompressed, opening tar...")
-                    
-                    # Open as regular tar (not bz2)
-                    tar = tarfile.open(tar_uncompressed, mode='r')
-                    members = tar.getmembers()
-                    log("[DOWNLOAD] Package %s has %d members" % (pkg_num, len(members)))
-                    if members:
-                        log("[DOWNLOAD] First 5 members: %s" % [m.name for m in members[:5]])
+                        self.downloads[region_id] = error_status
+                        return
+                    submit_fetch(i + PACKAGE_FETCH_WORKERS)
                     
-                    for member in members:
-                        name = member.name.replace('\\', '/')
+                    if extracted_tiles is None:
+                        # Staged download (no bz2 module): extract tar.bz2 and create .list file
+                        self.downloads[region_id] = {
+                            'progress': min(int(progress['bytes'] * 90 / max(total_size_compressed, 1)), 90),
+                            'status': 'Extracting package %d/%d...' % (downloaded_packages + 1, total_packages)
+                        }
                         
-                        # Extract .list file from archive (valhalla/packages/XXX.tar.list)
-                        if name.endswith('.tar.list'):
-                            packages_dir = os.path.join(self.tiles_dir, 'packages')
-                            if not os.path.exists(packages_dir):
-                                os.makedirs(packages_dir)
-                            # Rename from XXX.tar.list to XXX.list
-                            list_filename = os.path.basename(name).replace('.tar.list', '.list')
-                            list_path = os.path.join(packages_dir, list_filename)
-                            f = tar.extractfile(member)
-                            if f:
-                                with open(list_path, 'wb') as out:
-                                    out.write(f.read())
-                                log("[DOWNLOAD] Extracted .list file: %s" % list_path)
-                            continue
+                        extracted_tiles = self._extract_package(tar_path, pkg_num, log)
                         
-                        # Extract .gph.gz files (tiles)
-                        if name.endswith('.gph.gz') or name.endswith('.gph'):
-                            parts = name.split('/')
-                            # Find tiles/level/... pattern
-                            # Level 0,1: level/xxx/yyy.gph.gz (3 parts)
-                            # Level 2: level/xxx/yyy/zzz.gph.gz (4 parts)
-                            for i, p in enumerate(parts):
-                                if p in ['0', '1'] and i + 2 < len(parts):
-                                    # 3-part path for level 0 and 1
-                                    rel_path = '/'.join(parts[i:i+3])
-                                    out_path = os.path.join(self.tiles_dir, parts[i], parts[i+1], parts[i+2])
-                                    out_dir = os.path.dirname(out_path)
-                                    
-                                    self._ensure_dir(out_dir)
-                                    
-                                    f = tar.extractfile(member)
-                                    if f:
-                                        with open(out_path, 'wb') as out:
-                                            while True:
-                                                chunk = f.read(CHUNK_SIZE)
-                                                if not chunk:
-                                                    break
-                                                out.write(chunk)
-                                        tiles_extracted += 1
-                                        extracted_tiles.append(rel_path)
-                                    break
-                                elif p == '2' and i + 3 < len(parts):
-                                    # 4-part path for level 2
-                                    rel_path = '/'.join(parts[i:i+4])
-                                    out_path = os.path.join(self.tiles_dir, parts[i], parts[i+1], parts[i+2], parts[i+3])
-                                    out_dir = os.path.dirname(out_path)
-                                    
-                                    self._ensure_dir(out_dir)
-                                    
-                                    f = tar.extractfile(member)
-                                    if f:
-                                        with open(out_path, 'wb') as out:
-                                            while True:
-                                                chunk = f.read(CHUNK_SIZE)
-                                                if not chunk:
-                                                    break
-                                                out.write(chunk)
-                                        tiles_extracted += 1
-                                        extracted_tiles.append(rel_path)
-                                    break
+                        # Delete the temp archive immediately to save space on device
+                        try:
+                            os.remove(tar_path)
+                        except:
+                            pass
                     
-                    tar.close()
-                    log("[DOWNLOAD] Extracted %d tiles from package %s" % (len(extracted_tiles), pkg_num))
-                    
-                    # If no .list file in archive, create one ourselves
-                    packages_dir = os.path.join(self.tiles_dir, 'packages')
-                    list_path = os.path.join(packages_dir, str(pkg_num) + '.list')
-                    if not os.path.exists(list_path) and extracted_tiles:
-                        if not os.path.exists(packages_dir):
-                            os.makedirs(packages_dir)
-                        with open(list_path, 'w') as f:
-                            f.write('\n'.join(extracted_tiles))
-                        log("[DOWNLOAD] Created .list file: %s" % list_path)
+                    tiles_extracted += len(extracted_tiles)
                     
-                except Exception as e:
-                    log("[DOWNLOAD] Error extracting package %s: %s" % (pkg_num, e))
-                    import traceback
-                    traceback.print_exc()
-                
-                # Delete temp tar files immediately to save space on device
-                for f in [tar_path, tar_path.replace('.tar.bz2', '.tar')]:
-                    try:
-                        os.remove(f)
-                    except:
-                        pass
-                
-                downloaded_packages += 1
+                    downloaded_packages += 1
+                    with self.lock:
+                        progress['packages_done'] = downloaded_packages
+            finally:
+                # Stop the fetches an early return left queued/running and drop their files
+                for future in fetches.values():
+                    future.cancel()
+                fetch_pool.shutdown(wait=True)
+                if error_status is not None:
+                    # A fetch may have reported progress before it saw the abort
+                    self.downloads[region_id] = error_status
+                if temp_dir is not None:
+                    for i in fetches:
+                        try:
+                            os.remove(tar_path_for(packages[i]))
+                        except:
+                            pass
+            
+            total_bytes_downloaded = progress['bytes']
             
-            # Write region info file (maps region_id to its packages)
+            # Record region info (maps region_id to its packages)
             try:
-                packages_dir = os.path.join(self.tiles_dir, 'packages')
-                if not os.path.exists(packages_dir):
-                    os.makedirs(packages_dir)
-                regions_file = os.path.join(packages_dir, 'regions.json')
-                regions_data = {}
-                if os.path.exists(regions_file):
-                    with open(regions_file, 'r') as f:
-                        regions_data = json.load(f)
-                regions_data[region_id] = {
-                    'packages': packages,
-                    'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
-                }
-                with open(regions_file, 'w') as f:
-                    json.dump(regions_data, f, indent=2)
+                regions_file = self._append_region_record(region_id, packages)
                 log("[DOWNLOAD] Saved region info to %s" % regions_file)
             except Exception as e:
                 log("[DOWNLOAD] Error saving regions info: %s" % e)
             
             # Success - clean up temp dir (should be empty now)
-            try:
-                os.rmdir(temp_dir)
-            except:
-                pass
+            if temp_dir is not None:
+                try:
+                    os.rmdir(temp_dir)
+                except:
+                    pass
             
             # Download libpostal data for smart address parsing (once, shared by all regions)
             if not self._check_libpostal_data():
                 log("[DOWNLOAD] Downloading libpostal data for smart address parsing...")
-                with self.lock:
-                    self.downloads[region_id] = {
-                        'progress': 90,
-                        'status': 'Downloading libpostal data...',
-                        'tiles_extracted': tiles_extracted,
-                        'packages_downloaded': downloaded_packages
-                    }
+                self.downloads[region_id] = {
+                    'progress': 90,
+                    'status': 'Downloading libpostal data...',
+                    'tiles_extracted': tiles_extracted,
+                    'packages_downloaded': downloaded_packages
+                }
                 libpostal_ok = self._download_libpostal_data(log)
             else:
                 log("[DOWNLOAD] Libpostal data already present")
@@ -2315,14 +3406,13 @@ with open(sys.argv[1], 'rb') as f_in:
             iso_code = self._get_iso_code(region_id)
             if iso_code and not self._check_parser_data(iso_code):
                 log("[DOWNLOAD] Downloading parser data for %s..." % iso_code)
-                with self.lock:
-                    self.downloads[region_id] = {
-                        'progress': 93,
-                        'status': 'Downloading parser data...',
-                        'tiles_extracted': tiles_extracted,
-                        'packages_downloaded': downloaded_packages
-                    }
-                parser_ok = self._download_parser_data(region_id, log)
+                self.downloads[region_id] = {
+                    'progress': 93,
+                    'status': 'Downloading parser data...',
+                    'tiles_extracted': tiles_extracted,
+                    'packages_downloaded': downloaded_packages
+                }
+                parser_ok = self._download_parser_data(region_id, log, iso_code)
             else:
                 if iso_code:
                     log("[DOWNLOAD] Parser data for %s already present" % iso_code)
@@ -2332,53 +3422,288 @@ with open(sys.argv[1], 'rb') as f_in:
             
             # Download geocoder files for offline address search
             log("[DOWNLOAD] Now downloading geocoder...")
-            with self.lock:
-                self.downloads[region_id] = {
-                    'progress': 96,
-                    'status': 'Downloading geocoder...',
-                    'tiles_extracted': tiles_extracted,
-                    'packages_downloaded': downloaded_packages
-                }
+            self.downloads[region_id] = {
+                'progress': 96,
+                'status': 'Downloading geocoder...',
+                'tiles_extracted': tiles_extracted,
+                'packages_downloaded': downloaded_packages
+            }
+            
+            geocoder_ok = self._download_geocoder(region_id, log)
+            
+            log("[DOWNLOAD] SUCCESS! Region %s complete. Tiles: %d, Packages: %d, Geocoder: %s, Libpostal: %s, Parser: %s" % (
+                region_id, tiles_extracted, downloaded_packages, 
+                'OK' if geocoder_ok else 'SKIPPED',
+                'OK' if libpostal_ok else 'SKIPPED',
+                'OK' if parser_ok else 'SKIPPED'))
+            
+            self.downloads[region_id] = {
+                'progress': 100,
+                'status': 'complete',
+                'tiles_extracted': tiles_extracted,
+                'packages_downloaded': downloaded_packages,
+                'bytes_downloaded': total_bytes_downloaded
+            }
+            
+            if callback:
+                callback(region_id, 'complete')
+                
+        except Exception as e:
+            log("[DOWNLOAD] FAILED! Region %s error: %s" % (region_id, e))
+            logger.exception("Region %s failed", region_id)
+            self.downloads[region_id] = {
+                'progress': 0,
+                'status': 'error',
+                'error': str(e)
+            }
+            if callback:
+                callback(region_id, 'error')
+            # Try to clean up on error
+            if temp_dir is not None:
+                try:
+                    for f in os.listdir(temp_dir):
+                        os.remove(os.path.join(temp_dir, f))
+                    os.rmdir(temp_dir)
+                except:
+                    pass
+    
+    def _fetch_package(self, region_id, pkg_num, tar_path, progress, log):
+        """
+        Download one package (runs on the package fetch pool). With the bz2 module the
+        archive is extracted as it streams in and the extracted tile paths are
+        returned (tar_path is None then); otherwise it is saved to tar_path for
+        _extract_package() and None is returned. progress is the region's shared counter dict, updated under self.lock.
+        """
+        import tarfile
+        import shutil
+        
+        pkg_url = VALHALLA_PACKAGES_URL + "/" + str(pkg_num) + ".tar.bz2"
+        log("[DOWNLOAD] Downloading package %s from %s" % (pkg_num, pkg_url))
+        
+        with self._open_url(pkg_url, timeout=600) as response:
+            pkg_size = int(response.headers.get('Content-Length', 0))
+            log("[DOWNLOAD] Package %s size: %d bytes" % (pkg_num, pkg_size))
+            
+            pkg_progress = [0]
+            
+            def on_read(nbytes):
+                pkg_progress[0] += nbytes
+                now = time.monotonic()
+                with self.lock:
+                    if progress['aborted']:
+                        raise IOError("Download of %s aborted, another package failed" % region_id)
+                    progress['bytes'] += nbytes
+                    if now - progress.get('reported_at', 0.0) < PROGRESS_UPDATE_INTERVAL:
+                        return
+                    progress['reported_at'] = now
+                    current_total = progress['bytes']
+                    
+                    # Update progress based on total size from JSON
+                    if progress['bytes_total'] > 0:
+                        overall_progress = int(current_total * 90 / progress['bytes_total'])
+                    else:
+                        # Fallback to package count based progress
+                        overall_progress = int((progress['packages_done'] * 90 + pkg_progress[0] * 90 / max(pkg_size, 1)) / progress['packages_total'])
+                    
+                    # Update the progress dict the fetch threads published last; if the
+                    # download thread has stored its own status since ('starting',
+                    # 'Extracting package ...'), publish a new one instead
+                    status = progress.get('published')
+                    publish = status is None or self.downloads.get(region_id) is not status
+                    if publish:
+                        status = {}
+                    status['progress'] = min(overall_progress, 90)
+                    status['status'] = 'Downloading %.1f / %.1f MB' % (
+                        current_total / (1024.0 * 1024.0),
+                        progress['bytes_total'] / (1024.0 * 1024.0)
+                    )
+                    status['current_package'] = pkg_num
+                    status['packages_done'] = progress['packages_done']
+                    status['packages_total'] = progress['packages_total']
+                    status['bytes_downloaded'] = current_total
+                    status['bytes_total'] = progress['bytes_total']
+                    if publish:
+                        progress['published'] = self.downloads[region_id] = status
+            
+            reader = _CountingReader(response, on_read)
+            
+            if bz2 is not None:
+                # Stream mode: members are decompressed and written as the bytes arrive,
+                # no .tar.bz2/.tar copies on disk and no whole-archive buffer in RAM
+                tar = tarfile.open(fileobj=reader, mode='r|bz2')
+                try:
+                    extracted_tiles = self._extract_members(tar, pkg_num, log)
+                finally:
+                    tar.close()
+                log("[DOWNLOAD] Extracted %d tiles from package %s" % (len(extracted_tiles), pkg_num))
+                return extracted_tiles
+            
+            with open(tar_path, 'wb') as f:
+                shutil.copyfileobj(reader, f, COPY_BUFFER_SIZE)
+        
+        return None
+    
+    def _extract_members(self, tar, pkg_num, log):
+        """
+        Write a package's tiles and .list file from an open tarfile -> tile paths extracted.
+        
+        Members are visited in archive order without getmembers(), so this works on
+        streamed ('r|bz2') archives too. TarFile keeps every TarInfo it has read in
+        tar.members; that list is dropped as we go so a package with thousands of
+        tiles doesn't accumulate them.
+        """
+        import shutil
+        
+        extracted_tiles = []  # Track tiles from this package
+        member_count = 0
+        
+        # Loop invariants, bound once for the thousands of members per package
+        tiles_dir = self.tiles_dir
+        packages_dir = os.path.join(tiles_dir, 'packages')
+        self._ensure_dir(packages_dir)
+        ensure_dir = self._ensure_dir
+        match_tile = TILE_MEMBER_RE.search
+        join = os.path.join
+        dirname = os.path.dirname
+        
+        for member in tar:
+            tar.members = []
+            member_count += 1
+            name = member.name.replace('\\', '/')
             
-            geocoder_ok = self._download_geocoder(region_id, log)
+            # Extract .list file from archive (valhalla/packages/XXX.tar.list)
+            if name.endswith('.tar.list'):
+                # Rename from XXX.tar.list to XXX.list
+                list_filename = os.path.basename(name).replace('.tar.list', '.list')
+                list_path = os.path.join(packages_dir, list_filename)
+                f = tar.extractfile(member)
+                if f:
+                    with open(list_path, 'wb') as out:
+                        out.write(f.read())
+                    self._pkg_installed_cache.pop(list_filename[:-len('.list')], None)
+                    log("[DOWNLOAD] Extracted .list file: %s" % list_path)
+                continue
             
-            log("[DOWNLOAD] SUCCESS! Region %s complete. Tiles: %d, Packages: %d, Geocoder: %s, Libpostal: %s, Parser: %s" % (
-                region_id, tiles_extracted, downloaded_packages, 
-                'OK' if geocoder_ok else 'SKIPPED',
-                'OK' if libpostal_ok else 'SKIPPED',
-                'OK' if parser_ok else 'SKIPPED'))
+            # Extract .gph.gz files (tiles) - see TILE_MEMBER_RE for the path layout
+            m = match_tile(name)
+            if m is None:
+                continue
+            rel_path = m.group(1)
+            out_path = join(tiles_dir, rel_path)
             
-            with self.lock:
-                self.downloads[region_id] = {
-                    'progress': 100,
-                    'status': 'complete',
-                    'tiles_extracted': tiles_extracted,
-                    'packages_downloaded': downloaded_packages,
-                    'bytes_downloaded': total_bytes_downloaded
-                }
+            ensure_dir(dirname(out_path))
             
-            if callback:
-                callback(region_id, 'complete')
-                
-        except Exception as e:
-            log("[DOWNLOAD] FAILED! Region %s error: %s" % (region_id, e))
-            import traceback
-            traceback.print_exc()
-            with self.lock:
-                self.downloads[region_id] = {
-                    'progress': 0,
-                    'status': 'error',
-                    'error': str(e)
-                }
-            if callback:
-                callback(region_id, 'error')
-            # Try to clean up on error
+            f = tar.extractfile(member)
+            if f:
+                with open(out_path, 'wb') as out:
+                    shutil.copyfileobj(f, out, COPY_BUFFER_SIZE)
+                    if posix_fadvise is not None:
+                        # Starts writeback and drops the pages once clean; tiles are
+                        # read back through the tile cache, not right after download
+                        out.flush()
+                        try:
+                            posix_fadvise(out.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+                        except OSError:
+                            pass
+                extracted_tiles.append(rel_path)
+        
+        log("[DOWNLOAD] Package %s has %d members" % (pkg_num, member_count))
+        
+        # If no .list file in archive, create one ourselves
+        list_path = os.path.join(packages_dir, str(pkg_num) + '.list')
+        if not os.path.exists(list_path) and extracted_tiles:
+            with open(list_path, 'w') as f:
+                f.write('\n'.join(extracted_tiles))
+            self._pkg_installed_cache.pop(str(pkg_num), None)
+            log("[DOWNLOAD] Created .list file: %s" % list_path)
+        
+        return extracted_tiles
+    
+    def _extract_package(self, tar_path, pkg_num, log):
+        """Extract a package staged by _fetch_package() (no bz2 module) via bunzip2"""
+        import tarfile
+        import subprocess
+        
+        extracted_tiles = []
+        
+        try:
+            # Python's bz2 module isn't available (wunderw): bunzip2 decompresses to a pipe
+            # that tarfile reads as a stream - no .tar copy on disk
+            log("[DOWNLOAD] Decompressing package %s with bunzip2..." % pkg_num)
+            proc = subprocess.Popen(['bunzip2', '-c', tar_path],
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
             try:
-                for f in os.listdir(temp_dir):
-                    os.remove(os.path.join(temp_dir, f))
-                os.rmdir(temp_dir)
-            except:
-                pass
+                tar = tarfile.open(fileobj=proc.stdout, mode='r|')
+                try:
+                    extracted_tiles = self._extract_members(tar, pkg_num, log)
+                finally:
+                    tar.close()
+            finally:
+                proc.stdout.close()
+                stderr = proc.stderr.read()
+                proc.stderr.close()
+                if proc.wait() != 0:
+                    raise Exception("bunzip2 failed: %s" % stderr.decode())
+            log("[DOWNLOAD] Extracted %d tiles from package %s" % (len(extracted_tiles), pkg_num))
+            
+        except Exception as e:
+            log("[DOWNLOAD] Error extracting package %s: %s" % (pkg_num, e))
+            logger.exception("Extracting package %s failed", pkg_num)
+        
+        return extracted_tiles
+    
+    def _download_bz2(self, url, out_path, timeout, log, on_read=None):
+        """
+        Download a .bz2 file decompressed into out_path -> (compressed, decompressed) sizes.
+        
+        With the bz2 module the response is decompressed as it arrives, so network and
+        decompression overlap and no .bz2 copy touches the disk; otherwise it is staged
+        next to out_path for _decompress_bz2()'s bunzip2 fallback. The output is written
+        to out_path + '.part' and renamed when complete, so an interrupted download
+        doesn't leave a file the "already present" checks would accept.
+        """
+        import shutil
+        
+        part_path = out_path + '.part'
+        staged_path = out_path + '.bz2'
+        try:
+            with self._open_url(url, timeout=timeout) as response:
+                reader = _CountingReader(response, on_read) if on_read else response
+                if bz2 is not None:
+                    with open(part_path, 'wb') as f_out:
+                        sizes = _bz2_decompress_stream(reader, f_out)
+                else:
+                    with open(staged_path, 'wb') as f:
+                        shutil.copyfileobj(reader, f, COPY_BUFFER_SIZE)
+            if bz2 is None:
+                sizes = self._decompress_bz2(staged_path, part_path, log)
+            os.replace(part_path, out_path)
+            return sizes
+        finally:
+            for path in (part_path, staged_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    
+    def _download_bz2_files(self, jobs, timeout, log):
+        """
+        Run _download_bz2() for (url, out_path, on_read) jobs on up to FILE_FETCH_WORKERS
+        threads -> per job, in job order, (compressed, decompressed) sizes or the
+        exception it raised. The files are latency bound, so their round trips overlap.
+        """
+        if not jobs:
+            return []
+        with ThreadPoolExecutor(max_workers=min(FILE_FETCH_WORKERS, len(jobs))) as pool:
+            futures = [pool.submit(self._download_bz2, url, out_path, timeout, log, on_read)
+                       for url, out_path, on_read in jobs]
+            results = []
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    results.append(e)
+        return results
     
     def _decompress_bz2(self, input_path, output_path, log_func=None):
         """Decompress a bz2 file. Uses bz2 module or bunzip2 as fallback."""
@@ -2388,47 +3713,36 @@ with open(sys.argv[1], 'rb') as f_in:
             if log_func:
                 log_func(msg)
         
-        # Try bz2 module first
-        try:
-            import bz2
-            with open(input_path, 'rb') as f_in:
-                compressed_data = f_in.read()
-                decompressed_data = bz2.decompress(compressed_data)
+        # Try bz2 module first (streamed in chunks, never the whole file in memory)
+        if bz2 is not None:
+            try:
+                with open(input_path, 'rb') as f_in:
+                    with open(output_path, 'wb') as f_out:
+                        return _bz2_decompress_stream(f_in, f_out)
+            except (OSError, EOFError, ValueError) as e:
+                # Data the module rejects (corrupt/truncated streams) - bunzip2 gets a try
+                log("[BZ2] bz2 module failed: %s, trying bunzip2..." % e)
+        
+        # Fallback to the bunzip2 command (bzip2 -d where bunzip2 is missing). The archive
+        # is fed on stdin, and both sizes come from fstat() of the files already open
+        with open(input_path, 'rb') as f_in:
+            comp_size = os.fstat(f_in.fileno()).st_size
+            for cmd in (['bunzip2', '-c'], ['bzip2', '-d', '-c']):
                 with open(output_path, 'wb') as f_out:
-                    f_out.write(decompressed_data)
-            return len(compressed_data), len(decompressed_data)
-        except ImportError:
-            pass
-        except Exception as e:
-            log("[BZ2] bz2 module failed: %s, trying bunzip2..." % e)
-        
-        # Fallback to bunzip2 command
-        try:
-            # bunzip2 -k keeps original, -c outputs to stdout
-            result = subprocess.run(
-                ['bunzip2', '-k', '-c', input_path],
-                stdout=open(output_path, 'wb'),
-                stderr=subprocess.PIPE
-            )
-            if result.returncode == 0:
-                comp_size = os.path.getsize(input_path)
-                decomp_size = os.path.getsize(output_path)
-                return comp_size, decomp_size
-            else:
-                raise Exception("bunzip2 failed: %s" % result.stderr.decode())
-        except FileNotFoundError:
-            # bunzip2 not found, try bzip2 -d
-            result = subprocess.run(
-                ['bzip2', '-d', '-k', '-c', input_path],
-                stdout=open(output_path, 'wb'),
-                stderr=subprocess.PIPE
-            )
-            if result.returncode == 0:
-                comp_size = os.path.getsize(input_path)
-                decomp_size = os.path.getsize(output_path)
+                    try:
+                        result = subprocess.run(cmd, stdin=f_in, stdout=f_out,
+                                                stderr=subprocess.PIPE)
+                    except FileNotFoundError:
+                        continue
+                    decomp_size = os.fstat(f_out.fileno()).st_size
+                if result.returncode != 0:
+                    try:
+                        os.remove(output_path)  # don't leave a truncated file behind
+                    except OSError:
+                        pass
+                    raise Exception("%s failed: %s" % (' '.join(cmd), result.stderr.decode()))
                 return comp_size, decomp_size
-            else:
-                raise Exception("bzip2 -d failed: %s" % result.stderr.decode())
+        raise Exception("Neither bunzip2 nor bzip2 found")
 
     def _download_geocoder(self, region_id, log_func=None):
         """Download geocoder-nlp files for a region.
@@ -2445,8 +3759,6 @@ with open(sys.argv[1], 'rb') as f_in:
                 print(msg)
                 sys.stdout.flush()
         
-        CHUNK_SIZE = 65536
-        
         # Convert region_id to geocoder URL format
         # region_id: "europe/austria" -> geocoder URL: "europe-austria"
         geocoder_region = region_id.replace('/', '-')
@@ -2459,22 +3771,13 @@ with open(sys.argv[1], 'rb') as f_in:
         # e.g. /home/user/MyDocs/Maps.OSM/geocoder-nlp/europe-austria/
         geocoder_base = '/home/user/MyDocs/Maps.OSM/geocoder-nlp'
         geocoder_dir = os.path.join(geocoder_base, geocoder_region)
-        if not os.path.exists(geocoder_dir):
-            os.makedirs(geocoder_dir)
-        
-        # Temp directory for downloads
-        temp_dir = "/home/user/MyDocs/.valhalla-tmp"
-        if not os.path.exists(temp_dir):
-            try:
-                os.makedirs(temp_dir)
-            except:
-                temp_dir = os.path.dirname(self.tiles_dir)
+        os.makedirs(geocoder_dir, exist_ok=True)
         
         downloaded_files = []
+        jobs = []
         
         for bz2_file in GEOCODER_FILES:
             file_url = geocoder_url + bz2_file
-            temp_path = os.path.join(temp_dir, bz2_file)
             
             # Output filename (remove .bz2, fix naming)
             out_name = bz2_file.replace('.bz2', '')
@@ -2482,48 +3785,25 @@ with open(sys.argv[1], 'rb') as f_in:
             out_path = os.path.join(geocoder_dir, out_name)
             
             log("[GEOCODER] Downloading %s..." % bz2_file)
-            
-            try:
-                req = Request(file_url)
-                req.add_header('User-Agent', 'ValhallaBikeRouter/3.0')
-                response = urlopen(req, timeout=300)
-                file_size = int(response.headers.get('Content-Length', 0))
-                log("[GEOCODER] File size: %.1f KB" % (file_size / 1024.0))
-                
-                # Download to temp file
-                downloaded = 0
-                with open(temp_path, 'wb') as f:
-                    while True:
-                        chunk = response.read(CHUNK_SIZE)
-                        if not chunk:
-                            break
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                
-                log("[GEOCODER] Downloaded %s (%.1f KB)" % (bz2_file, downloaded / 1024.0))
-                
-                # Decompress bz2
-                log("[GEOCODER] Decompressing to %s..." % out_name)
-                comp_size, decomp_size = self._decompress_bz2(temp_path, out_path, log)
-                
-                log("[GEOCODER] Decompressed %s (%.1f KB -> %.1f KB)" % (
-                    out_name, 
-                    comp_size / 1024.0,
-                    decomp_size / 1024.0
-                ))
-                
-                downloaded_files.append(out_name)
-                
-                # Clean up temp file
-                try:
-                    os.remove(temp_path)
-                except:
-                    pass
-                    
-            except Exception as e:
-                log("[GEOCODER] Error downloading %s: %s" % (bz2_file, e))
+            jobs.append((file_url, out_path, None))
+        
+        results = self._download_bz2_files(jobs, 300, log)
+        
+        for bz2_file, result in zip(GEOCODER_FILES, results):
+            out_name = bz2_file.replace('.bz2', '')
+            if isinstance(result, Exception):
+                log("[GEOCODER] Error downloading %s: %s" % (bz2_file, result))
                 # Continue with other files - geocoder is optional
                 continue
+            
+            comp_size, decomp_size = result
+            log("[GEOCODER] Downloaded %s (%.1f KB -> %.1f KB)" % (
+                out_name, 
+                comp_size / 1024.0,
+                decomp_size / 1024.0
+            ))
+            
+            downloaded_files.append(out_name)
         
         if downloaded_files:
             log("[GEOCODER] SUCCESS! Downloaded %d geocoder files: %s" % (
@@ -2533,12 +3813,20 @@ with open(sys.argv[1], 'rb') as f_in:
             log("[GEOCODER] WARNING: No geocoder files downloaded (offline search unavailable)")
             return False
 
+    def _data_recently_present(self, key):
+        """True if a check for key found all its files within PACKAGE_STATUS_TTL"""
+        checked_at = self._data_present_at.get(key)
+        return checked_at is not None and time.time() - checked_at < PACKAGE_STATUS_TTL
+    
     def _check_libpostal_data(self):
-        """Check if libpostal data files are present."""
+        """Check if libpostal data files are present (positive results are memoized)."""
+        if self._data_recently_present('libpostal'):
+            return True
         for subdir, filename in LIBPOSTAL_FILES:
             filepath = os.path.join(LIBPOSTAL_DATA_DIR, subdir, filename)
             if not os.path.exists(filepath):
                 return False
+        self._data_present_at['libpostal'] = time.time()
         return True
     
     def _download_libpostal_data(self, log_func=None):
@@ -2566,32 +3854,36 @@ with open(sys.argv[1], 'rb') as f_in:
         log("[LIBPOSTAL] Downloading global libpostal data (~35 MB compressed)...")
         log("[LIBPOSTAL] This enables smart address parsing (e.g. 'Hauptstr 5' -> street + house_number)")
         
-        CHUNK_SIZE = 65536
-        
         # Create directories
         for subdir, filename in LIBPOSTAL_FILES:
             subdir_path = os.path.join(LIBPOSTAL_DATA_DIR, subdir)
-            if not os.path.exists(subdir_path):
-                try:
-                    os.makedirs(subdir_path)
-                except Exception as e:
-                    log("[LIBPOSTAL] Error creating directory %s: %s" % (subdir_path, e))
-                    return False
-        
-        # Temp directory for downloads
-        temp_dir = "/home/user/MyDocs/.valhalla-tmp"
-        if not os.path.exists(temp_dir):
             try:
-                os.makedirs(temp_dir)
-            except:
-                temp_dir = "/tmp"
+                os.makedirs(subdir_path, exist_ok=True)
+            except OSError as e:
+                log("[LIBPOSTAL] Error creating directory %s: %s" % (subdir_path, e))
+                return False
         
         downloaded_count = 0
+        jobs = []
+        job_files = []
+        
+        def progress_logger(filename):
+            """on_read callback logging every 5 MB of one file"""
+            LOG_EVERY = 5 * 1024 * 1024
+            state = [0, LOG_EVERY]  # bytes downloaded, next size to log at
+            
+            def on_read(nbytes):
+                state[0] += nbytes
+                if state[0] >= state[1]:
+                    log("[LIBPOSTAL] %s: downloaded %.1f MB..." % (
+                        filename, state[0] / (1024.0 * 1024.0)))
+                    while state[1] <= state[0]:
+                        state[1] += LOG_EVERY
+            return on_read
         
         for subdir, filename in LIBPOSTAL_FILES:
             bz2_filename = filename + ".bz2"
             file_url = LIBPOSTAL_BASE_URL + "/" + subdir + "/" + bz2_filename
-            temp_path = os.path.join(temp_dir, bz2_filename)
             out_path = os.path.join(LIBPOSTAL_DATA_DIR, subdir, filename)
             
             # Skip if already exists
@@ -2601,56 +3893,33 @@ with open(sys.argv[1], 'rb') as f_in:
                 continue
             
             log("[LIBPOSTAL] Downloading %s..." % bz2_filename)
-            
-            try:
-                req = Request(file_url)
-                req.add_header('User-Agent', 'ValhallaBikeRouter/3.0')
-                response = urlopen(req, timeout=600)  # 10 min timeout for large files
-                file_size = int(response.headers.get('Content-Length', 0))
-                log("[LIBPOSTAL] File size: %.1f MB" % (file_size / (1024.0 * 1024.0)))
-                
-                # Download to temp file
-                downloaded = 0
-                with open(temp_path, 'wb') as f:
-                    while True:
-                        chunk = response.read(CHUNK_SIZE)
-                        if not chunk:
-                            break
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        # Progress every 5 MB
-                        if downloaded % (5 * 1024 * 1024) < CHUNK_SIZE:
-                            log("[LIBPOSTAL] Downloaded %.1f MB..." % (downloaded / (1024.0 * 1024.0)))
-                
-                log("[LIBPOSTAL] Downloaded %s (%.1f MB)" % (bz2_filename, downloaded / (1024.0 * 1024.0)))
-                
-                # Decompress bz2
-                log("[LIBPOSTAL] Decompressing %s..." % filename)
-                comp_size, decomp_size = self._decompress_bz2(temp_path, out_path, log)
-                
-                log("[LIBPOSTAL] Decompressed %s (%.1f MB -> %.1f MB)" % (
-                    filename, 
-                    comp_size / (1024.0 * 1024.0),
-                    decomp_size / (1024.0 * 1024.0)
-                ))
-                
-                downloaded_count += 1
-                
-                # Clean up temp file
-                try:
-                    os.remove(temp_path)
-                except:
-                    pass
-                    
-            except Exception as e:
-                log("[LIBPOSTAL] Error downloading %s: %s" % (bz2_filename, e))
+            jobs.append((file_url, out_path, progress_logger(filename)))
+            job_files.append(filename)
+        
+        # 10 min timeout for large files
+        results = self._download_bz2_files(jobs, 600, log)
+        
+        for filename, result in zip(job_files, results):
+            if isinstance(result, Exception):
+                log("[LIBPOSTAL] Error downloading %s: %s" % (filename + ".bz2", result))
                 # Continue with other files
                 continue
+            
+            comp_size, decomp_size = result
+            log("[LIBPOSTAL] Downloaded %s (%.1f MB -> %.1f MB)" % (
+                filename, 
+                comp_size / (1024.0 * 1024.0),
+                decomp_size / (1024.0 * 1024.0)
+            ))
+            
+            downloaded_count += 1
         
         if downloaded_count == len(LIBPOSTAL_FILES):
             log("[LIBPOSTAL] SUCCESS! All libpostal data files downloaded")
             return True
-        elif downloaded_count > 0:
+        
+        self._data_present_at.pop('libpostal', None)
+        if downloaded_count > 0:
             log("[LIBPOSTAL] WARNING: Only %d/%d libpostal files downloaded" % (
                 downloaded_count, len(LIBPOSTAL_FILES)))
             return True  # Partial success - some parsing may work
@@ -2661,34 +3930,20 @@ with open(sys.argv[1], 'rb') as f_in:
     def _get_iso_code(self, region_id):
         """Get ISO country code for a region_id."""
         # Direct lookup
-        if region_id in REGION_TO_ISO:
-            return REGION_TO_ISO[region_id]
+        iso_code = REGION_TO_ISO.get(region_id)
+        if iso_code is not None:
+            return iso_code
         
         # Try to extract from region name (e.g., 'europe/austria' -> look for 'austria')
         region_name = region_id.split('/')[-1].lower()
         
-        # Common mappings for region names
-        name_to_iso = {
-            'austria': 'AT', 'hungary': 'HU', 'germany': 'DE', 'switzerland': 'CH',
-            'czech-republic': 'CZ', 'slovakia': 'SK', 'poland': 'PL', 'italy': 'IT',
-            'france': 'FR', 'spain': 'ES', 'portugal': 'PT', 'netherlands': 'NL',
-            'belgium': 'BE', 'united-kingdom': 'GB', 'great-britain': 'GB',
-            'sweden': 'SE', 'norway': 'NO', 'finland': 'FI', 'denmark': 'DK',
-            'greece': 'GR', 'croatia': 'HR', 'slovenia': 'SI', 'serbia': 'RS',
-            'romania': 'RO', 'bulgaria': 'BG', 'ukraine': 'UA', 'russia': 'RU',
-            'liechtenstein': 'LI', 'luxembourg': 'LU', 'azores': 'PT',
-            'usa': 'US', 'canada': 'CA', 'japan': 'JP', 'china': 'CN',
-            'india': 'IN', 'australia': 'AU', 'new-zealand': 'NZ',
-            'ireland': 'GB-IE', 'cyprus': 'CY', 'malta': 'MT', 'iceland': 'IS',
-            'estonia': 'EE', 'latvia': 'LV', 'lithuania': 'LT',
-            'bosnia-herzegovina': 'BA', 'albania': 'AL', 'montenegro': 'ME',
-            'macedonia': 'MK', 'kosovo': 'RS', 'moldova': 'MD', 'belarus': 'BY',
-        }
-        
-        return name_to_iso.get(region_name)
+        return REGION_NAME_TO_ISO.get(region_name)
 
     def _check_parser_data(self, iso_code):
-        """Check if parser data exists for an ISO country code."""
+        """Check if parser data exists for an ISO country code (positive results are memoized)."""
+        key = 'parser:' + iso_code
+        if self._data_recently_present(key):
+            return True
         parser_dir = os.path.join(LIBPOSTAL_PARSER_DIR, iso_code, 'address_parser')
         if not os.path.exists(parser_dir):
             return False
@@ -2696,12 +3951,14 @@ with open(sys.argv[1], 'rb') as f_in:
         for filename in LIBPOSTAL_PARSER_FILES:
             if not os.path.exists(os.path.join(parser_dir, filename)):
                 return False
+        self._data_present_at[key] = time.time()
         return True
 
-    def _download_parser_data(self, region_id, log_func=None):
+    def _download_parser_data(self, region_id, log_func=None, iso_code=None):
         """Download country-specific libpostal parser data.
         
         Downloads from: https://data.modrana.org/osm_scout_server/postal-country-2/postal/countries-v1/{ISO}/address_parser/
+        iso_code can be passed by callers that already resolved it.
         """
         import sys
         
@@ -2712,7 +3969,8 @@ with open(sys.argv[1], 'rb') as f_in:
                 print(msg)
                 sys.stdout.flush()
         
-        iso_code = self._get_iso_code(region_id)
+        if iso_code is None:
+            iso_code = self._get_iso_code(region_id)
         if not iso_code:
             log("[PARSER] Unknown region %s, cannot determine ISO code" % region_id)
             return False
@@ -2726,31 +3984,21 @@ with open(sys.argv[1], 'rb') as f_in:
         
         log("[PARSER] Downloading parser data for %s (~2 MB compressed)..." % iso_code)
         
-        CHUNK_SIZE = 65536
-        
         # Create directory
         parser_dir = os.path.join(LIBPOSTAL_PARSER_DIR, iso_code, 'address_parser')
-        if not os.path.exists(parser_dir):
-            try:
-                os.makedirs(parser_dir)
-            except Exception as e:
-                log("[PARSER] Error creating directory %s: %s" % (parser_dir, e))
-                return False
-        
-        # Temp directory
-        temp_dir = "/home/user/MyDocs/.valhalla-tmp"
-        if not os.path.exists(temp_dir):
-            try:
-                os.makedirs(temp_dir)
-            except:
-                temp_dir = "/tmp"
+        try:
+            os.makedirs(parser_dir, exist_ok=True)
+        except OSError as e:
+            log("[PARSER] Error creating directory %s: %s" % (parser_dir, e))
+            return False
         
         downloaded_count = 0
+        jobs = []
+        job_files = []
         
         for filename in LIBPOSTAL_PARSER_FILES:
             bz2_filename = filename + ".bz2"
             file_url = LIBPOSTAL_PARSER_BASE_URL + "/" + iso_code + "/address_parser/" + bz2_filename
-            temp_path = os.path.join(temp_dir, bz2_filename)
             out_path = os.path.join(parser_dir, filename)
             
             # Skip if already exists
@@ -2760,52 +4008,31 @@ with open(sys.argv[1], 'rb') as f_in:
                 continue
             
             log("[PARSER] Downloading %s..." % bz2_filename)
-            
-            try:
-                req = Request(file_url)
-                req.add_header('User-Agent', 'ValhallaBikeRouter/3.0')
-                response = urlopen(req, timeout=300)
-                file_size = int(response.headers.get('Content-Length', 0))
-                log("[PARSER] File size: %.1f KB" % (file_size / 1024.0))
-                
-                # Download
-                downloaded = 0
-                with open(temp_path, 'wb') as f:
-                    while True:
-                        chunk = response.read(CHUNK_SIZE)
-                        if not chunk:
-                            break
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                
-                log("[PARSER] Downloaded %s (%.1f KB)" % (bz2_filename, downloaded / 1024.0))
-                
-                # Decompress
-                log("[PARSER] Decompressing %s..." % filename)
-                comp_size, decomp_size = self._decompress_bz2(temp_path, out_path, log)
-                
-                log("[PARSER] Decompressed %s (%.1f KB -> %.1f KB)" % (
-                    filename,
-                    comp_size / 1024.0,
-                    decomp_size / 1024.0
-                ))
-                
-                downloaded_count += 1
-                
-                # Clean up
-                try:
-                    os.remove(temp_path)
-                except:
-                    pass
-                    
-            except Exception as e:
-                log("[PARSER] Error downloading %s: %s" % (bz2_filename, e))
+            jobs.append((file_url, out_path, None))
+            job_files.append(filename)
+        
+        results = self._download_bz2_files(jobs, 300, log)
+        
+        for filename, result in zip(job_files, results):
+            if isinstance(result, Exception):
+                log("[PARSER] Error downloading %s: %s" % (filename + ".bz2", result))
                 continue
+            
+            comp_size, decomp_size = result
+            log("[PARSER] Downloaded %s (%.1f KB -> %.1f KB)" % (
+                filename,
+                comp_size / 1024.0,
+                decomp_size / 1024.0
+            ))
+            
+            downloaded_count += 1
         
         if downloaded_count == len(LIBPOSTAL_PARSER_FILES):
             log("[PARSER] SUCCESS! All parser files for %s downloaded" % iso_code)
             return True
-        elif downloaded_count > 0:
+        
+        self._data_present_at.pop('parser:' + iso_code, None)
+        if downloaded_count > 0:
             log("[PARSER] WARNING: Only %d/%d parser files downloaded" % (
                 downloaded_count, len(LIBPOSTAL_PARSER_FILES)))
             return True
@@ -2814,13 +4041,27 @@ with open(sys.argv[1], 'rb') as f_in:
             return False
 
 
-# Global download manager
+# Global download manager (see get_download_manager)
 download_manager = None
+_download_manager_lock = threading.Lock()
+
+
+def get_download_manager(tiles_dir):
+    """The shared DownloadManager, created on first use"""
+    global download_manager
+    with _download_manager_lock:
+        if download_manager is None:
+            download_manager = DownloadManager(tiles_dir)
+    return download_manager
 
 # Global geocoder instance (cached for speed)
 _geocoder_instance = None
 _geocoder_initialized = False
 
+# _geocoder_instance once geocoder_offline failed to import: the module won't appear
+# while the server runs, so later calls return None without retrying the import
+_GEOCODER_UNAVAILABLE = object()
+
 def get_cached_geocoder(warmup=False):
     """Get or create cached offline geocoder instance.
     
@@ -2828,6 +4069,9 @@ def get_cached_geocoder(warmup=False):
     """
     global _geocoder_instance, _geocoder_initialized
     
+    if _geocoder_instance is _GEOCODER_UNAVAILABLE:
+        return None
+    
     if _geocoder_instance is None:
         try:
             from geocoder_offline import OfflineGeocoder
@@ -2835,6 +4079,7 @@ def get_cached_geocoder(warmup=False):
             print("[SERVER] Created cached geocoder instance", file=sys.stderr)
         except ImportError as e:
             print("[SERVER] Could not import geocoder_offline: %s" % e, file=sys.stderr)
+            _geocoder_instance = _GEOCODER_UNAVAILABLE
             return None
         except Exception as e:
             print("[SERVER] Error creating geocoder: %s" % e, file=sys.stderr)
@@ -2854,9 +4099,171 @@ def get_cached_geocoder(warmup=False):
     return _geocoder_instance
 
 
+# The geocoder's SQLite connections may only be used by the thread that opened them
+# (and libpostal isn't thread-safe), so all geocoder calls run on this one thread
+_geocoder_executor = ThreadPoolExecutor(max_workers=1)
+
+
+def _geocoder_search(query, limit):
+    """get_cached_geocoder().search() on the geocoder thread; None if it's unavailable"""
+    geocoder = get_cached_geocoder()
+    if geocoder is None:
+        return None
+    return geocoder.search(query, limit=limit)
+
+
+class CRouterWorker:
+    """
+    A `vrouter --serve` child kept running between routes, so the tiles it has
+    loaded are reused instead of paying fork/exec and tile parsing per request.
+    
+    One "from_lat from_lon to_lat to_lon" line in, one JSON result line out; its
+    [DEBUG] stderr goes straight to the server's stderr.
+    """
+    
+    def __init__(self, path, tiles_dir):
+        self.path = path
+        self.tiles_dir = tiles_dir
+        self.proc = None
+        self.lock = threading.Lock()
+        # False once the binary exited with its usage error (built before --serve)
+        self.supported = True
+        self._served = False
+    
+    def start(self):
+        with self.lock:
+            self._start()
+    
+    def _start(self):
+        import subprocess
+        if self.proc is None or self.proc.poll() is not None:
+            self._stop()
+            try:
+                self.proc = subprocess.Popen([self.path, '--serve', self.tiles_dir],
+                                             stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            except OSError:
+                self.supported = False
+                raise
+    
+    def _stop(self):
+        """Stop the child; its exit code, or None if none was running"""
+        proc, self.proc = self.proc, None
+        if proc is None:
+            return None
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+        if proc.poll() is None:
+            proc.kill()
+        returncode = proc.wait()
+        proc.stdout.close()
+        return returncode
+    
+    def route(self, from_lat, from_lon, to_lat, to_lon):
+        """vrouter's parsed result, or None if the worker died (restarted on the next call)"""
+        # Always exactly one line: a value that isn't a number raises here instead
+        request = '%.7f %.7f %.7f %.7f\n' % (from_lat, from_lon, to_lat, to_lon)
+        with self.lock:
+            try:
+                self._start()
+            except OSError:
+                return None
+            try:
+                self.proc.stdin.write(request.encode('ascii'))
+                self.proc.stdin.flush()
+                line = self.proc.stdout.readline()
+            except (OSError, ValueError):
+                line = b''
+            if not line:
+                # A binary without --serve prints its usage and exits 1 straight away;
+                # anything else (e.g. a crash) just restarts the worker next time
+                if self._stop() == 1 and not self._served:
+                    self.supported = False
+                return None
+            self._served = True
+        return loads_json(line)
+    
+    def close(self):
+        """Stop the worker, e.g. so tiles replaced on disk are re-read"""
+        with self.lock:
+            self._stop()
+
+
+# CRouterWorker of the running server (see get_c_router)
+_c_router = None
+
+
+def get_c_router(path, tiles_dir):
+    """The shared vrouter worker, or None if the binary is missing or lacks --serve"""
+    global _c_router
+    if _c_router is None:
+        if not os.path.exists(path):
+            return None
+        _c_router = CRouterWorker(path, tiles_dir)
+    return _c_router if _c_router.supported else None
+
+
+# Recent geocode results, least recently used first: (query, limit) -> locations.
+# Autocomplete resends the same query, so repeats skip the libpostal/SQLite search.
+# Cleared when a region download or update completes (new geocoder databases).
+GEOCODE_CACHE_MAX = 256
+_geocode_cache = OrderedDict()
+_geocode_cache_lock = threading.Lock()
+
+
+def clear_geocode_cache():
+    with _geocode_cache_lock:
+        _geocode_cache.clear()
+
+
+def split_query_string(query_string):
+    """
+    'q=...&limit=N' -> {'q': '...', 'limit': 'N'} with values still percent-encoded.
+    
+    The handlers read one or two known keys, so the values are left for the caller
+    to unquote instead of parse_qs decoding every pair into lists; the first
+    occurrence of a key wins, as with parse_qs(...)[key][0].
+    """
+    params = {}
+    if query_string:
+        for pair in query_string.split('&'):
+            key, _, value = pair.partition('=')
+            if value and key not in params:
+                params[key] = value
+    return params
+
+
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer handling each request on a fixed pool of SERVER_WORKERS threads"""
+    
+    def __init__(self, server_address, handler_class, workers=SERVER_WORKERS):
+        HTTPServer.__init__(self, server_address, handler_class)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+    
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process_request_pooled, request, client_address)
+    
+    def _process_request_pooled(self, request, client_address):
+        # Same as socketserver.ThreadingMixIn.process_request_thread
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+    
+    def server_close(self):
+        HTTPServer.server_close(self)
+        self.executor.shutdown(wait=False)
+
+
 class ValhallaHandler(BaseHTTPRequestHandler):
     cache = None
     tiles_dir = None
+    # Buffer wfile (unbuffered by default) so the status line, headers and a typical
+    # JSON body leave in one send; handle_one_request flushes after each request.
+    wbufsize = 64 * 1024
     
     def log_message(self, format, *args):
         pass  # Quiet logging
@@ -2889,24 +4296,15 @@ class ValhallaHandler(BaseHTTPRequestHandler):
         
         if parsed.path in ['/route', '/v2/route']:
             self.handle_route()
+        elif parsed.path in ['/locate', '/v2/locate']:
+            self.handle_locate()
         else:
             self.send_error(404)
     
     def handle_status(self):
         """Server status"""
-        # Count tiles (3-level structure)
-        tile_count = 0
-        if os.path.isdir(self.tiles_dir):
-            for level in ['0', '1', '2']:
-                level_dir = os.path.join(self.tiles_dir, level)
-                if os.path.isdir(level_dir):
-                    for d1 in os.listdir(level_dir):
-                        d1_path = os.path.join(level_dir, d1)
-                        if os.path.isdir(d1_path):
-                            for d2 in os.listdir(d1_path):
-                                d2_path = os.path.join(d1_path, d2)
-                                if os.path.isdir(d2_path):
-                                    tile_count += len([f for f in os.listdir(d2_path) if f.endswith('.gph.gz') or f.endswith('.gph')])
+        # Tiles counted from the cache's path index (rebuilt after each download)
+        tile_count = self.cache.tile_count() if self.cache else 0
         
         self.send_json({
             'status': 'ok',
@@ -2930,32 +4328,15 @@ class ValhallaHandler(BaseHTTPRequestHandler):
     def handle_installed(self):
         """List installed regions"""
         global download_manager
-        if not download_manager:
-            download_manager = DownloadManager(self.tiles_dir)
+        download_manager = get_download_manager(self.tiles_dir)
         installed = download_manager.get_installed_regions()
         self.send_json({'success': True, 'installed': installed})
     
     def handle_tiles(self):
         """List installed tiles"""
         tiles = []
-        if os.path.isdir(self.tiles_dir):
-            for level in ['0', '1', '2']:
-                level_dir = os.path.join(self.tiles_dir, level)
-                if os.path.isdir(level_dir):
-                    # 3-level structure: level/xxx/yyy/zzz.gph.gz
-                    for d1 in os.listdir(level_dir):
-                        d1_path = os.path.join(level_dir, d1)
-                        if os.path.isdir(d1_path):
-                            for d2 in os.listdir(d1_path):
-                                d2_path = os.path.join(d1_path, d2)
-                                if os.path.isdir(d2_path):
-                                    for f in os.listdir(d2_path):
-                                        if f.endswith('.gph.gz') or f.endswith('.gph'):
-                                            try:
-                                                tile_id = int(d1) * 1000000 + int(d2) * 1000 + int(f.split('.')[0])
-                                                tiles.append({'level': int(level), 'id': tile_id})
-                                            except:
-                                                pass
+        if self.cache:
+            tiles = [{'level': level, 'id': tile_id} for level, tile_id in self.cache.tile_keys()]
         
         self.send_json({'tiles': tiles, 'count': len(tiles)})
     
@@ -2967,10 +4348,19 @@ class ValhallaHandler(BaseHTTPRequestHandler):
         region_id = path[len('/download/'):]
         print("[SERVER] handle_download: region_id = %s" % region_id)
         
-        if not download_manager:
-            download_manager = DownloadManager(self.tiles_dir)
+        download_manager = get_download_manager(self.tiles_dir)
+        
+        # New tiles on disk - refresh the tile path index once the download completes
+        cache = self.cache
+        def on_download_done(region, status):
+            if status == 'complete':
+                if cache:
+                    cache.rescan()
+                if _c_router is not None:
+                    _c_router.close()  # Drop tiles it loaded before the download
+                clear_geocode_cache()
         
-        result = download_manager.download_region(region_id)
+        result = download_manager.download_region(region_id, callback=on_download_done)
         self.send_json(result)
     
     def handle_download_status(self):
@@ -2989,26 +4379,22 @@ class ValhallaHandler(BaseHTTPRequestHandler):
         region_id = path[len('/update/'):]
         print("[SERVER] handle_update: region_id = %s" % region_id)
         
-        if not download_manager:
-            download_manager = DownloadManager(self.tiles_dir)
+        download_manager = get_download_manager(self.tiles_dir)
         
-        result = download_manager.update_region(region_id)
+        def on_update_done(region, status):
+            if status == 'complete':
+                clear_geocode_cache()  # Geocoder databases may have been added
+        
+        result = download_manager.update_region(region_id, callback=on_update_done)
         self.send_json(result)
     
     def handle_geocode(self, query_string):
         """Offline geocoding with cached libpostal - much faster than CLI"""
         try:
             # Parse query params
-            params = {}
-            if query_string:
-                try:
-                    from urllib.parse import parse_qs
-                except ImportError:
-                    from urlparse import parse_qs
-                params = parse_qs(query_string)
-            
-            query = params.get('q', [''])[0]
-            limit = int(params.get('limit', ['10'])[0])
+            params = split_query_string(query_string)
+            query = unquote_plus(params.get('q', ''))
+            limit = int(params.get('limit', '10'))
             
             if not query:
                 self.send_json({'success': False, 'error': 'Missing q parameter'})
@@ -3016,14 +4402,21 @@ class ValhallaHandler(BaseHTTPRequestHandler):
             
             print("[SERVER] Geocode query: %s" % query, file=sys.stderr)
             
-            # Get cached geocoder
-            geocoder = get_cached_geocoder()
-            if geocoder is None:
-                self.send_json({'success': False, 'error': 'Geocoder not available', 'locations': []})
+            cache_key = (query, limit)
+            with _geocode_cache_lock:
+                locations = _geocode_cache.get(cache_key)
+                if locations is not None:
+                    _geocode_cache.move_to_end(cache_key)
+            if locations is not None:
+                print("[SERVER] Geocode cache hit (%d results)" % len(locations), file=sys.stderr)
+                self.send_json({'success': True, 'locations': locations, 'source': 'offline'})
                 return
             
-            # Search
-            results = geocoder.search(query, limit=limit)
+            # Search with the cached geocoder
+            results = _geocoder_executor.submit(_geocoder_search, query, limit).result()
+            if results is None:
+                self.send_json({'success': False, 'error': 'Geocoder not available', 'locations': []})
+                return
             
             # Format results for API compatibility
             locations = []
@@ -3037,6 +4430,10 @@ class ValhallaHandler(BaseHTTPRequestHandler):
                 })
             
             print("[SERVER] Geocode returned %d results" % len(locations), file=sys.stderr)
+            with _geocode_cache_lock:
+                _geocode_cache[cache_key] = locations
+                while len(_geocode_cache) > GEOCODE_CACHE_MAX:
+                    _geocode_cache.popitem(last=False)
             self.send_json({'success': True, 'locations': locations, 'source': 'offline'})
             
         except Exception as e:
@@ -3045,11 +4442,29 @@ class ValhallaHandler(BaseHTTPRequestHandler):
             traceback.print_exc(file=sys.stderr)
             self.send_json({'success': False, 'error': str(e), 'locations': []})
     
+    def _run_c_router_once(self, c_router_path, from_lat, from_lon, to_lat, to_lon):
+        """Run vrouter for one route; its parsed result, or None if it failed"""
+        import subprocess
+        result = subprocess.run(
+            [c_router_path, self.tiles_dir, 
+             str(from_lat), str(from_lon), str(to_lat), str(to_lon)],
+            capture_output=True  # No timeout - let it run as long as needed
+        )
+        
+        # C router stderr for debugging: first 30 lines, only decoding those
+        if result.stderr and (result.returncode != 0 or VROUTER_DEBUG):
+            for line in result.stderr.strip().split(b'\n', 30)[:30]:
+                print("[C-ROUTER] %s" % line.decode('utf-8', errors='replace'))
+        
+        if result.returncode != 0:
+            print("[ROUTE] C router exit code %d" % result.returncode)
+            return None
+        return loads_json(result.stdout)
+    
     def handle_route(self):
         try:
             length = int(self.headers.get('Content-Length', 0))
-            body = self.rfile.read(length).decode('utf-8')
-            params = json.loads(body)
+            params = loads_json(self.rfile.read(length))
         except:
             self.send_error(400, "Invalid JSON")
             return
@@ -3070,41 +4485,47 @@ class ValhallaHandler(BaseHTTPRequestHandler):
         if None in [from_lat, from_lon, to_lat, to_lon]:
             self.send_json({'error': 'Invalid coordinates'})
             return
+        try:
+            from_lat, from_lon = float(from_lat), float(from_lon)
+            to_lat, to_lon = float(to_lat), float(to_lon)
+        except (TypeError, ValueError):
+            self.send_error(400, "Invalid coordinates")
+            return
+        # float() accepts 'nan' and 'inf', which neither router can route from
+        isfinite = math.isfinite
+        if not (isfinite(from_lat) and isfinite(from_lon) and isfinite(to_lat) and isfinite(to_lon)):
+            self.send_error(400, "Invalid coordinates")
+            return
         
-        # Try fast C router first
-        c_router_path = '/opt/valhalla-bike-router/vrouter'
+        # Try fast C router first: the persistent worker, or one vrouter run per
+        # request if the binary predates --serve
+        c_router_path = C_ROUTER_PATH
         if os.path.exists(c_router_path):
             try:
-                import subprocess
                 import time as time_module
                 t0 = time_module.time()
-                result = subprocess.run(
-                    [c_router_path, self.tiles_dir, 
-                     str(from_lat), str(from_lon), str(to_lat), str(to_lon)],
-                    capture_output=True  # No timeout - let it run as long as needed
-                )
+                c_result = None
+                worker = get_c_router(c_router_path, self.tiles_dir)
+                if worker is not None:
+                    c_result = worker.route(from_lat, from_lon, to_lat, to_lon)
+                if worker is None or not worker.supported:
+                    c_result = self._run_c_router_once(c_router_path, from_lat, from_lon,
+                                                       to_lat, to_lon)
                 elapsed = time_module.time() - t0
                 
-                # Always print C router stderr for debugging
-                c_stderr = result.stderr.decode('utf-8', errors='replace').strip()
-                if c_stderr:
-                    for line in c_stderr.split('\n')[:30]:  # First 30 lines
-                        print("[C-ROUTER] %s" % line)
-                
-                if result.returncode == 0:
-                    c_result = json.loads(result.stdout.decode('utf-8'))
+                if c_result is not None:
                     if 'coords' in c_result and c_result['coords']:
                         print("[ROUTE] C router: %.2fs, %d nodes" % (elapsed, len(c_result['coords'])))
                         # Build Valhalla-compatible response
                         coords = c_result['coords']
-                        distance = 0
-                        for i in range(1, len(coords)):
-                            distance += haversine(
-                                coords[i-1]['lat'], coords[i-1]['lon'],
-                                coords[i]['lat'], coords[i]['lon']
-                            )
-                        
-                        shape = encode_polyline(coords)
+                        if 'shape' in c_result:
+                            # vrouter already encoded the shape and summed the distance
+                            shape = c_result['shape']
+                            distance = c_result['distance_m']
+                        else:
+                            # Older vrouter binary: only the coordinates
+                            distance = path_length(coords)
+                            shape = encode_polyline(coords)
                         self.send_json({
                             'trip': {
                                 'locations': locations,
@@ -3128,9 +4549,7 @@ class ValhallaHandler(BaseHTTPRequestHandler):
                         })
                         return
                     else:
-                        print("[ROUTE] C router returned no coords: %s" % result.stdout.decode('utf-8')[:200])
-                else:
-                    print("[ROUTE] C router exit code %d" % result.returncode)
+                        print("[ROUTE] C router returned no coords: %s" % str(c_result)[:200])
                 print("[ROUTE] C router failed, falling back to Python")
             except Exception as e:
                 print("[ROUTE] C router error: %s, falling back to Python" % e)
@@ -3149,12 +4568,18 @@ class ValhallaHandler(BaseHTTPRequestHandler):
             avoid_cars=avoid_cars
         )
         
-        # Route
-        result, error = route(self.cache, costing, from_lat, from_lon, to_lat, to_lon, use_hierarchy=False, simple_cost=False)
-        
-        if error:
-            self.send_json({'error': error})
-            return
+        # Route (recently computed routes are served from the cache)
+        cache_key = TileCache.route_cache_key(from_lat, from_lon, to_lat, to_lon, costing)
+        result = self.cache.route_cache_get(cache_key)
+        if result is None:
+            result, error = route(self.cache, costing, from_lat, from_lon, to_lat, to_lon, use_hierarchy=False, simple_cost=False)
+            
+            if error:
+                self.send_json({'error': error})
+                return
+            self.cache.route_cache_put(cache_key, result)
+        else:
+            print("[ROUTE] Served from route cache")
         
         # Format as Valhalla response
         car_dist = result.get('car_distance', 0) / 1000.0  # km
@@ -3190,20 +4615,93 @@ class ValhallaHandler(BaseHTTPRequestHandler):
         
         self.send_json(response)
     
+    def handle_locate(self):
+        """Snap a list of locations to their nearest routing nodes (level 2)"""
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            params = loads_json(self.rfile.read(length))
+        except:
+            self.send_error(400, "Invalid JSON")
+            return
+        if not isinstance(params, dict) or not isinstance(params.get('locations', []), list):
+            self.send_error(400, "Invalid JSON")
+            return
+        
+        try:
+            locations = params.get('locations', [])
+            if not locations:
+                self.send_json({'error': 'Need at least 1 location'})
+                return
+            
+            # Group the points by tile so each tile is looked up once and its queries
+            # share bucket gathers
+            level = 2
+            tile_size = TILE_LEVELS[level]
+            tiles_per_row = int(360.0 / tile_size)
+            by_tile = {}
+            coords = [None] * len(locations)
+            results = [None] * len(locations)
+            for i, loc in enumerate(locations):
+                try:
+                    lat = float(loc['lat'])
+                    lon = float(loc['lon'])
+                except (KeyError, TypeError, ValueError):
+                    lat = lon = None
+                # float() accepts 'nan' and 'inf' - the range checks reject those too
+                if lat is None or not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+                    results[i] = {'error': 'Invalid coordinates'}
+                    continue
+                coords[i] = (lat, lon)
+                tile_id = int((lat + 90.0) / tile_size) * tiles_per_row + int((lon + 180.0) / tile_size)
+                by_tile.setdefault(tile_id, []).append(i)
+            
+            for tile_id, indices in by_tile.items():
+                tile = self.cache.get_tile(level, tile_id, None)
+                if tile is None:
+                    for i in indices:
+                        results[i] = {'error': 'No tile data for location'}
+                    continue
+                lats = [coords[i][0] for i in indices]
+                lons = [coords[i][1] for i in indices]
+                for i, (node_id, dist) in zip(indices, find_nearest_nodes_batch(tile, lats, lons)):
+                    if node_id is None:
+                        results[i] = {'error': 'Could not find nodes near coordinates'}
+                        continue
+                    results[i] = {
+                        'lat': coords[i][0],
+                        'lon': coords[i][1],
+                        'node': {
+                            'level': level,
+                            'tile_id': tile_id,
+                            'node_id': node_id,
+                            'lat': tile.node_lats[node_id],
+                            'lon': tile.node_lons[node_id],
+                            'distance': dist,
+                        },
+                    }
+            
+            self.send_json(results)
+            
+        except Exception as e:
+            import traceback
+            print("[SERVER] Locate error: %s" % e, file=sys.stderr)
+            traceback.print_exc(file=sys.stderr)
+            self.send_json({'error': str(e)})
+    
     def send_json(self, data):
-        response = json.dumps(data)
+        response = dumps_json(data)
         self.send_response(200)
         self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
         self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
-        self.wfile.write(response.encode('utf-8'))
+        self.wfile.write(response)
 
 
 def run_server(tiles_dir=None, port=SERVER_PORT):
     tiles_dir = tiles_dir or TILES_DIR
     
-    if not os.path.exists(tiles_dir):
-        os.makedirs(tiles_dir)
+    os.makedirs(tiles_dir, exist_ok=True)
     
     ValhallaHandler.tiles_dir = tiles_dir
     ValhallaHandler.cache = TileCache(tiles_dir)
@@ -3231,13 +4729,25 @@ def run_server(tiles_dir=None, port=SERVER_PORT):
     warmup_thread.start()
     print("[SERVER] libpostal loading in background (search uses fast mode until ready)")
     
-    server = HTTPServer(('127.0.0.1', port), ValhallaHandler)
+    # Keep the C router running so routes skip its startup
+    c_router = get_c_router(C_ROUTER_PATH, tiles_dir)
+    if c_router is not None:
+        try:
+            c_router.start()
+            print("[SERVER] C router worker started")
+        except OSError as e:
+            print("[SERVER] Could not start C router worker: %s" % e, file=sys.stderr)
+    
+    server = PooledHTTPServer(('127.0.0.1', port), ValhallaHandler)
     
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         print("\nShutting down...")
         server.shutdown()
+    finally:
+        if c_router is not None:
+            c_router.close()
 
 
 if __name__ == '__main__':
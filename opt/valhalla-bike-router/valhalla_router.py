@@ -9,18 +9,36 @@ Uses opp_index to traverse edges in reverse direction.
 
 import math
 import heapq
+from collections import deque
+from array import array
+from itertools import compress
 
+# Numba is optional (not available on the N9); the pure Python haversine is used without it
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
-def haversine(lat1, lon1, lat2, lon2):
+DEG_TO_RAD = 0.017453292519943295
+DEG_TO_M = 6371000 * DEG_TO_RAD   # metres per degree of latitude
+
+
+def haversine_py(lat1, lon1, lat2, lon2):
     """Calculate distance in meters between two points"""
     R = 6371000
-    phi1, phi2 = math.radians(lat1), math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlam = math.radians(lon2 - lon1)
+    phi1, phi2 = lat1 * DEG_TO_RAD, lat2 * DEG_TO_RAD
+    dphi = (lat2 - lat1) * DEG_TO_RAD
+    dlam = (lon2 - lon1) * DEG_TO_RAD
     a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlam/2)**2
     return 2 * R * math.atan2(math.sqrt(a), math.sqrt(1-a))
 
 
+if njit is not None:
+    haversine = njit('f8(f8,f8,f8,f8)', fastmath=True, cache=True)(haversine_py)
+else:
+    haversine = haversine_py
+
+
 class BidirectionalAStar:
     """
     Bidirectional A* search algorithm.
@@ -33,34 +51,78 @@ class BidirectionalAStar:
         self.costing = costing
         self.get_edge_details = get_edge_details_func
         self.tiles = {}
+        # tile_id -> (costs, times) per-edge arrays under self.costing, NaN until first relaxed
+        self.edge_costs = {}
         
         # Speed for heuristic (m/s) - use max possible bike speed
         self.max_speed_mps = 25.0 / 3.6  # 25 kph in m/s
     
     def load_tile(self, tile_id):
-        """Load and cache a tile"""
-        if tile_id not in self.tiles:
+        """
+        Load and cache a tile.
+        
+        self.tiles pins every tile this search has touched, so eviction from the
+        shared TileCache never drops a tile out from under a running route.
+        """
+        tile = self.tiles.get(tile_id)
+        if tile is None:
             tile = self.cache.get_tile(2, tile_id, self.costing)
-            if tile:
-                self.tiles[tile_id] = tile
-        return self.tiles.get(tile_id)
+            if not tile:
+                return None
+            self.tiles[tile_id] = tile
+        return tile
     
     def find_nearest_node(self, lat, lon, tile_id):
-        """Find nearest node to a location in a tile"""
+        """
+        Find nearest node to a location in a tile.
+        
+        Tiles with a spatial bucket index (0.01 degree buckets, see
+        TileData.lookup_bucket_range) rank the +-2 buckets around the query first;
+        the whole tile is only scanned when the winner lies farther away than
+        that window is guaranteed to cover.
+        """
         tile = self.load_tile(tile_id)
         if not tile:
             return None
         
-        best_dist = float('inf')
+        lookup = getattr(tile, 'lookup_bucket_range', None)
+        if lookup is not None:
+            lat_b, lon_b = int(lat * 100), int(lon * 100)
+            candidates = []
+            for dlat in range(-2, 3):
+                candidates.extend(lookup(lat_b + dlat, lon_b - 2, lon_b + 2))
+            best_node, best_a = self._nearest_among(tile, lat, lon, candidates)
+            if best_node is not None:
+                # Anything outside the window is at least two buckets (0.02 deg) away
+                margin = 0.02 * DEG_TO_M * math.cos(min(abs(lat) + 0.03, 90.0) * DEG_TO_RAD)
+                dist = 2 * 6371000 * math.atan2(math.sqrt(best_a), math.sqrt(1 - best_a))
+                if dist <= margin:
+                    return best_node
+        
+        return self._nearest_among(tile, lat, lon, range(tile.node_count))[0]
+    
+    def _nearest_among(self, tile, lat, lon, candidates):
+        """(node_id, haversine 'a' term) of the candidate closest to (lat, lon)"""
+        # Rank by the haversine 'a' term (monotonic in the distance) with the
+        # query point's cosine hoisted; sqrt/atan2 aren't needed for an argmin
+        best_a = float('inf')
         best_node = None
-        
-        for i in range(tile.node_count):
-            d = haversine(lat, lon, tile.node_lats[i], tile.node_lons[i])
-            if d < best_dist:
-                best_dist = d
+        node_lats = tile.node_lats
+        node_lons = tile.node_lons
+        sin = math.sin
+        cos = math.cos
+        cos_lat = cos(lat * DEG_TO_RAD)
+        
+        for i in candidates:
+            node_lat = node_lats[i]
+            s_dlat = sin((node_lat - lat) * DEG_TO_RAD * 0.5)
+            s_dlon = sin((node_lons[i] - lon) * DEG_TO_RAD * 0.5)
+            a = s_dlat * s_dlat + cos_lat * cos(node_lat * DEG_TO_RAD) * s_dlon * s_dlon
+            if a < best_a or (a == best_a and i < best_node):
+                best_a = a
                 best_node = i
         
-        return best_node
+        return best_node, best_a
     
     def get_node_coords(self, tile_id, node_id):
         """Get coordinates of a node"""
@@ -69,31 +131,58 @@ class BidirectionalAStar:
             return tile.node_lats[node_id], tile.node_lons[node_id]
         return None, None
     
-    def heuristic(self, tile_id, node_id, target_lat, target_lon):
-        """A* heuristic - estimated time to reach target."""
+    def heuristic(self, tile_id, node_id, target_lat, target_lon, lon_scale=None):
+        """
+        A* heuristic - estimated time to reach target.
+        
+        Equirectangular distance with cos(lat) fixed at the target; lon_scale
+        (DEG_TO_M * cos(target_lat)) is computed once per route by the caller.
+        """
         lat, lon = self.get_node_coords(tile_id, node_id)
         if lat is None:
             return float('inf')
         
-        dist = haversine(lat, lon, target_lat, target_lon)
-        return dist / self.max_speed_mps
+        if lon_scale is None:
+            lon_scale = DEG_TO_M * math.cos(target_lat * DEG_TO_RAD)
+        dy = (lat - target_lat) * DEG_TO_M
+        dx = (lon - target_lon) * lon_scale
+        return math.sqrt(dy * dy + dx * dx) / self.max_speed_mps
+    
+    def edge_cost(self, tile_id, tile, edge_idx):
+        """(cost, time) of an edge, costed once per tile and edge (inf if it has no details)"""
+        tables = self.edge_costs.get(tile_id)
+        if tables is None:
+            unset = array('d', [float('nan')])
+            tables = self.edge_costs[tile_id] = (unset * tile.edge_count, unset * tile.edge_count)
+        costs, times = tables
+        cost = costs[edge_idx]
+        if cost != cost:  # NaN - not costed yet
+            edge = self.get_edge_details(tile, edge_idx)
+            if edge:
+                cost, time = self.costing.edge_cost(edge)
+            else:
+                cost, time = float('inf'), 0.0
+            costs[edge_idx] = cost
+            times[edge_idx] = time
+            return cost, time
+        return cost, times[edge_idx]
     
     def get_outgoing_edges(self, tile_id, node_id):
-        """Get all outgoing edges from a node"""
+        """
+        Get all outgoing edges from a node as (edge_idx, end_tileid, end_id, opp_index).
+        
+        Slices the tile's per-edge columns and filters them by edge_has_bike, instead
+        of building a per-edge tuple through tile.edge_ends.
+        """
         tile = self.tiles.get(tile_id)
         if not tile or node_id >= tile.node_count:
             return []
         
-        edges = []
-        edge_idx = tile.node_edge_idx[node_id]
-        edge_cnt = tile.node_edge_cnt[node_id]
-        
-        for i in range(edge_idx, min(edge_idx + edge_cnt, tile.edge_count)):
-            end_tileid, end_id, has_bike, opp_index = tile.edge_ends[i]
-            if has_bike:
-                edges.append((i, end_tileid, end_id, opp_index))
-        
-        return edges
+        lo = tile.node_edge_idx[node_id]
+        hi = min(lo + tile.node_edge_cnt[node_id], tile.edge_count)
+        return list(compress(zip(range(lo, hi), tile.edge_end_tileid[lo:hi],
+                                 tile.edge_end_id[lo:hi], tile.edge_opp_index[lo:hi]),
+                             tile.edge_has_bike[lo:hi]))
     
     def get_opposing_edge_at_node(self, tile_id, node_id, opp_local_idx):
         """
@@ -115,49 +204,69 @@ class BidirectionalAStar:
         if global_idx >= tile.edge_count:
             return None
         
-        end_tileid, end_id, has_bike, opp_index = tile.edge_ends[global_idx]
-        if not has_bike:
+        if not tile.edge_has_bike[global_idx]:
             return None
         
-        return (global_idx, end_tileid, end_id, opp_index)
+        return (global_idx, tile.edge_end_tileid[global_idx], tile.edge_end_id[global_idx],
+                tile.edge_opp_index[global_idx])
+    
+    def _expansion_context(self, target_lat, lon_scale, h_cache):
+        """Locals shared by expand_forward/expand_reverse: (lon_scale, h_cache, max speed)"""
+        if lon_scale is None:
+            lon_scale = DEG_TO_M * math.cos(target_lat * DEG_TO_RAD)
+        if h_cache is None:
+            h_cache = {}
+        return lon_scale, h_cache, self.max_speed_mps
     
-    def expand_forward(self, tile_id, node_id, current_cost, target_lat, target_lon):
+    def expand_forward(self, tile_id, node_id, current_cost, target_lat, target_lon,
+                       lon_scale=None, h_cache=None):
         """
         Expand edges in forward direction from a node.
         Returns list of (new_cost, sort_cost, next_tile_id, next_node_id, edge_idx)
+        
+        The heuristic is evaluated inline (memoized per node in h_cache) and tiles,
+        the edge cost lookup and math.sqrt are bound to locals for the edge loop.
         """
         tile = self.load_tile(tile_id)
         if not tile or node_id >= tile.node_count:
             return []
         
+        lon_scale, h_cache, max_speed = self._expansion_context(target_lat, lon_scale, h_cache)
+        tiles = self.tiles
+        load_tile = self.load_tile
+        edge_cost = self.edge_cost
+        h_get = h_cache.get
+        sqrt = math.sqrt
+        inf = float('inf')
         neighbors = []
         
         for edge_idx, end_tileid, end_id, opp_index in self.get_outgoing_edges(tile_id, node_id):
             # Load destination tile
-            dest_tile = self.load_tile(end_tileid)
+            dest_tile = tiles.get(end_tileid) or load_tile(end_tileid)
             if not dest_tile or end_id >= dest_tile.node_count:
                 continue
             
             # Get edge cost
-            edge = self.get_edge_details(tile, edge_idx)
-            if not edge:
-                continue
-            
-            cost, time = self.costing.edge_cost(edge)
-            if cost == float('inf'):
+            cost, time = edge_cost(tile_id, tile, edge_idx)
+            if cost == inf:
                 continue
             
             new_cost = current_cost + cost
             
-            # Calculate heuristic
-            h = self.heuristic(end_tileid, end_id, target_lat, target_lon)
-            sort_cost = new_cost + h
+            # Heuristic (see heuristic())
+            key = (end_tileid << 32) | end_id
+            h = h_get(key)
+            if h is None:
+                dy = (dest_tile.node_lats[end_id] - target_lat) * DEG_TO_M
+                dx = (dest_tile.node_lons[end_id] - target_lon) * lon_scale
+                h = h_cache[key] = sqrt(dy * dy + dx * dx) / max_speed
             
-            neighbors.append((new_cost, sort_cost, end_tileid, end_id, edge_idx))
+            neighbors.append((new_cost, new_cost + h, end_tileid, end_id, edge_idx))
         
         return neighbors
     
-    def expand_reverse(self, tile_id, node_id, current_cost, target_lat, target_lon):
+    def expand_reverse(self, tile_id, node_id, current_cost, target_lat, target_lon,
+                       lon_scale=None, h_cache=None):
         """
         Expand edges in REVERSE direction from a node.
         
@@ -169,41 +278,49 @@ class BidirectionalAStar:
         if not tile or node_id >= tile.node_count:
             return []
         
+        lon_scale, h_cache, max_speed = self._expansion_context(target_lat, lon_scale, h_cache)
+        tiles = self.tiles
+        load_tile = self.load_tile
+        edge_cost = self.edge_cost
+        get_opposing_edge_at_node = self.get_opposing_edge_at_node
+        h_get = h_cache.get
+        sqrt = math.sqrt
+        inf = float('inf')
         neighbors = []
         
         # For each outgoing edge from this node
         for edge_idx, end_tileid, end_id, opp_index in self.get_outgoing_edges(tile_id, node_id):
             # Load the tile containing the neighbor (end node of outgoing edge)
-            neighbor_tile = self.load_tile(end_tileid)
+            neighbor_tile = tiles.get(end_tileid) or load_tile(end_tileid)
             if not neighbor_tile or end_id >= neighbor_tile.node_count:
                 continue
             
             # Get the opposing edge at the neighbor node
             # This edge goes FROM neighbor TO current node
-            opp_edge_info = self.get_opposing_edge_at_node(end_tileid, end_id, opp_index)
+            opp_edge_info = get_opposing_edge_at_node(end_tileid, end_id, opp_index)
             if not opp_edge_info:
                 continue
             
-            opp_edge_idx, _, _, _ = opp_edge_info
+            opp_edge_idx = opp_edge_info[0]
             
             # Get the cost of the opposing edge
-            opp_edge = self.get_edge_details(neighbor_tile, opp_edge_idx)
-            if not opp_edge:
-                continue
-            
-            cost, time = self.costing.edge_cost(opp_edge)
-            if cost == float('inf'):
+            cost, time = edge_cost(end_tileid, neighbor_tile, opp_edge_idx)
+            if cost == inf:
                 continue
             
             new_cost = current_cost + cost
             
-            # Calculate heuristic to origin (target for reverse search)
-            h = self.heuristic(end_tileid, end_id, target_lat, target_lon)
-            sort_cost = new_cost + h
+            # Heuristic to origin (target for reverse search)
+            key = (end_tileid << 32) | end_id
+            h = h_get(key)
+            if h is None:
+                dy = (neighbor_tile.node_lats[end_id] - target_lat) * DEG_TO_M
+                dx = (neighbor_tile.node_lons[end_id] - target_lon) * lon_scale
+                h = h_cache[key] = sqrt(dy * dy + dx * dx) / max_speed
             
             # In reverse search, we're finding nodes that can reach us
             # So the "neighbor" we're adding is the end_tileid/end_id
-            neighbors.append((new_cost, sort_cost, end_tileid, end_id, opp_edge_idx))
+            neighbors.append((new_cost, new_cost + h, end_tileid, end_id, opp_edge_idx))
         
         return neighbors
     
@@ -224,51 +341,72 @@ class BidirectionalAStar:
         
         print(f"Routing from tile {origin_tile_id} node {origin_node} to tile {dest_tile_id} node {dest_node}")
         
+        # Heuristic longitude scale towards each search's target
+        dest_lon_scale = DEG_TO_M * math.cos(dest_lat * DEG_TO_RAD)
+        origin_lon_scale = DEG_TO_M * math.cos(origin_lat * DEG_TO_RAD)
+        
+        heappush = heapq.heappush
+        heappop = heapq.heappop
+        inf = float('inf')
+        
+        # Nodes are keyed by one int, (tile_id << 32) | node_id, which hashes and
+        # compares cheaper than a (tile_id, node_id) tuple and orders the same way
+        
         # Initialize forward search
-        # Priority queue: (sort_cost, cost, tile_id, node_id)
+        # Priority queue: (sort_cost, cost, key)
         fwd_pq = []
-        fwd_visited = {}  # (tile_id, node_id) -> (cost, pred_tile, pred_node)
-        fwd_pred = {}     # (tile_id, node_id) -> (pred_tile, pred_node)
+        fwd_visited = {}  # key -> cost
+        fwd_pred = {}     # key -> predecessor key
+        fwd_h = {}        # key -> heuristic towards the destination
+        fwd_g = {}        # key -> lowest cost pushed so far
         
-        origin_h = self.heuristic(origin_tile_id, origin_node, dest_lat, dest_lon)
-        heapq.heappush(fwd_pq, (origin_h, 0, origin_tile_id, origin_node))
+        origin_h = self.heuristic(origin_tile_id, origin_node, dest_lat, dest_lon,
+                                  dest_lon_scale)
+        origin_key = (origin_tile_id << 32) | origin_node
+        heapq.heappush(fwd_pq, (origin_h, 0, origin_key))
         
         # Initialize reverse search
         rev_pq = []
         rev_visited = {}
         rev_pred = {}
+        rev_h = {}
+        rev_g = {}
         
-        dest_h = self.heuristic(dest_tile_id, dest_node, origin_lat, origin_lon)
-        heapq.heappush(rev_pq, (dest_h, 0, dest_tile_id, dest_node))
+        dest_h = self.heuristic(dest_tile_id, dest_node, origin_lat, origin_lon,
+                                origin_lon_scale)
+        heapq.heappush(rev_pq, (dest_h, 0, (dest_tile_id << 32) | dest_node))
         
         # Best meeting point
         best_cost = float('inf')
-        meeting_tile = None
-        meeting_node = None
+        meeting_key = None
         
         iterations = 0
         fwd_done = False
         rev_done = False
         
+        # Hot-loop lookups bound to locals
+        expand_forward = self.expand_forward
+        expand_reverse = self.expand_reverse
+        fwd_visited_get = fwd_visited.get
+        rev_visited_get = rev_visited.get
+        fwd_g_get = fwd_g.get
+        rev_g_get = rev_g.get
+        
         while (fwd_pq or rev_pq) and iterations < max_iterations:
             iterations += 1
             
-            # Expand forward
+            # Expand forward (keys already visited are skipped)
             if fwd_pq and not fwd_done:
-                sort_cost, cost, tile_id, node_id = heapq.heappop(fwd_pq)
+                sort_cost, cost, key = heappop(fwd_pq)
                 
-                key = (tile_id, node_id)
-                if key in fwd_visited:
-                    pass  # Skip, already visited
-                else:
+                if key not in fwd_visited:
                     fwd_visited[key] = cost
                     
                     # Check if we met reverse search
-                    if key in rev_visited:
-                        total_cost = cost + rev_visited[key]
-                        if total_cost < best_cost:
-                            best_cost = total_cost
-                            meeting_tile, meeting_node = tile_id, node_id
+                    rev_cost = rev_visited_get(key)
+                    if rev_cost is not None and cost + rev_cost < best_cost:
+                        best_cost = cost + rev_cost
+                        meeting_key = key
                     
                     # Early termination
                     if sort_cost >= best_cost:
@@ -276,29 +414,29 @@ class BidirectionalAStar:
                     else:
                         # Expand
                         for new_cost, new_sort, next_tile, next_node, _ in \
-                                self.expand_forward(tile_id, node_id, cost, dest_lat, dest_lon):
-                            next_key = (next_tile, next_node)
-                            if next_key not in fwd_visited:
-                                heapq.heappush(fwd_pq, (new_sort, new_cost, next_tile, next_node))
+                                expand_forward(key >> 32, key & 0xFFFFFFFF, cost, dest_lat, dest_lon,
+                                               dest_lon_scale, fwd_h):
+                            next_key = (next_tile << 32) | next_node
+                            # A push that doesn't beat the node's queued cost would only
+                            # pop after it and be discarded as visited
+                            if new_cost < fwd_g_get(next_key, inf) and next_key not in fwd_visited:
+                                fwd_g[next_key] = new_cost
+                                heappush(fwd_pq, (new_sort, new_cost, next_key))
                                 if next_key not in fwd_pred:
                                     fwd_pred[next_key] = key
             
             # Expand reverse
             if rev_pq and not rev_done:
-                sort_cost, cost, tile_id, node_id = heapq.heappop(rev_pq)
+                sort_cost, cost, key = heappop(rev_pq)
                 
-                key = (tile_id, node_id)
-                if key in rev_visited:
-                    pass  # Skip
-                else:
+                if key not in rev_visited:
                     rev_visited[key] = cost
                     
                     # Check if we met forward search
-                    if key in fwd_visited:
-                        total_cost = cost + fwd_visited[key]
-                        if total_cost < best_cost:
-                            best_cost = total_cost
-                            meeting_tile, meeting_node = tile_id, node_id
+                    fwd_cost = fwd_visited_get(key)
+                    if fwd_cost is not None and cost + fwd_cost < best_cost:
+                        best_cost = cost + fwd_cost
+                        meeting_key = key
                     
                     # Early termination
                     if sort_cost >= best_cost:
@@ -306,10 +444,14 @@ class BidirectionalAStar:
                     else:
                         # Expand reverse
                         for new_cost, new_sort, next_tile, next_node, _ in \
-                                self.expand_reverse(tile_id, node_id, cost, origin_lat, origin_lon):
-                            next_key = (next_tile, next_node)
-                            if next_key not in rev_visited:
-                                heapq.heappush(rev_pq, (new_sort, new_cost, next_tile, next_node))
+                                expand_reverse(key >> 32, key & 0xFFFFFFFF, cost, origin_lat, origin_lon,
+                                               origin_lon_scale, rev_h):
+                            next_key = (next_tile << 32) | next_node
+                            # A push that doesn't beat the node's queued cost would only
+                            # pop after it and be discarded as visited
+                            if new_cost < rev_g_get(next_key, inf) and next_key not in rev_visited:
+                                rev_g[next_key] = new_cost
+                                heappush(rev_pq, (new_sort, new_cost, next_key))
                                 if next_key not in rev_pred:
                                     rev_pred[next_key] = key
             
@@ -322,38 +464,36 @@ class BidirectionalAStar:
         
         print(f"Search done: {iterations} iterations, fwd={len(fwd_visited)} rev={len(rev_visited)}")
         
-        if meeting_tile is None:
+        if meeting_key is None:
             print("No route found!")
             return None
         
-        print(f"Best cost: {best_cost:.0f}, meeting at tile {meeting_tile} node {meeting_node}")
+        print(f"Best cost: {best_cost:.0f}, meeting at tile {meeting_key >> 32} node {meeting_key & 0xFFFFFFFF}")
         
         # Reconstruct path
-        # Forward path: origin -> meeting
-        fwd_path = []
-        key = (meeting_tile, meeting_node)
+        # Forward path: walk meeting -> origin, prepending so no reverse is needed
+        full_path = deque()
+        key = meeting_key
         while key in fwd_pred:
-            fwd_path.append(key)
+            full_path.appendleft(key)
             key = fwd_pred[key]
-        fwd_path.append((origin_tile_id, origin_node))
-        fwd_path.reverse()
+        full_path.appendleft(origin_key)
         
-        # Reverse path: meeting -> destination
-        rev_path = []
-        key = (meeting_tile, meeting_node)
+        # Reverse path: meeting -> destination (meeting point is already in)
+        key = meeting_key
         while key in rev_pred:
             key = rev_pred[key]
-            rev_path.append(key)
-        
-        # Combine paths (skip duplicate meeting point)
-        full_path = fwd_path + rev_path
+            full_path.append(key)
         
-        # Convert to coordinates
+        # Convert to coordinates (tiles on the path are all pinned in self.tiles)
+        tiles = self.tiles
         coord_path = []
-        for tile_id, node_id in full_path:
-            lat, lon = self.get_node_coords(tile_id, node_id)
-            if lat is not None:
-                coord_path.append((lat, lon))
+        append = coord_path.append
+        for key in full_path:
+            tile = tiles.get(key >> 32)
+            node_id = key & 0xFFFFFFFF
+            if tile and node_id < tile.node_count:
+                append((tile.node_lats[node_id], tile.node_lons[node_id]))
         
         print(f"Route has {len(coord_path)} points")
         
@@ -6,7 +6,12 @@
  *       --sysroot=$SYSROOT -lz -lm -o vrouter vrouter.c
  *
  * Usage: vrouter <tiles_dir> <from_lat> <from_lon> <to_lat> <to_lon>
+ *        vrouter --serve <tiles_dir>
  * Output: JSON with route coordinates
+ *
+ * With --serve, requests "<from_lat> <from_lon> <to_lat> <to_lon>" are read one per
+ * line from stdin and each answered with one JSON line on stdout; loaded tiles stay
+ * in memory between requests.
  */
 
 #define _GNU_SOURCE
@@ -162,6 +167,18 @@ static inline double haversine(double lat1, double lon1, double lat2, double lon
     return EARTH_RADIUS * c;
 }
 
+/* Append one zigzagged polyline delta as 5-bit groups; returns chars written (max 13) */
+static inline int polyline_put(char *out, int64_t v) {
+    uint64_t z = ((uint64_t)v << 1) ^ (uint64_t)(v >> 63);
+    int n = 0;
+    while (z >= 0x20) {
+        out[n++] = (char)((z & 0x1f) + 95);  /* 0x20 continuation bit + 63 */
+        z >>= 5;
+    }
+    out[n++] = (char)(z + 63);
+    return n;
+}
+
 static inline uint64_t read_u64(const uint8_t *data, size_t offset) {
     uint64_t v = 0;
     for (int i = 0; i < 8; i++) {
@@ -271,6 +288,8 @@ static Tile* find_tile(int level, uint32_t tile_id) {
 }
 
 static int g_debug_tile_fails = 0;
+/* Set when load_tile() refused a tile because g_tiles was full */
+static int g_tiles_full = 0;
 
 static Tile* load_tile(int level, uint32_t tile_id) {
     Tile *t = find_tile(level, tile_id);
@@ -278,6 +297,7 @@ static Tile* load_tile(int level, uint32_t tile_id) {
     
     if (g_tile_count >= MAX_TILES) {
         fprintf(stderr, "Too many tiles loaded\n");
+        g_tiles_full = 1;
         return NULL;
     }
     
@@ -566,7 +586,9 @@ static int g_visited_count = 0;
 static int g_visited_collisions = 0;
 
 static void visited_clear(void) {
-    memset(g_visited, 0, g_visited_capacity * sizeof(VisitedEntry));
+    /* Nothing set since calloc()/the last clear: don't fault in the whole table */
+    if (g_visited_count > 0)
+        memset(g_visited, 0, g_visited_capacity * sizeof(VisitedEntry));
     g_visited_count = 0;
     g_visited_collisions = 0;
 }
@@ -902,45 +924,128 @@ static int route(double from_lat, double from_lon, double to_lat, double to_lon)
  * Main
  * ============================================================================ */
 
-int main(int argc, char **argv) {
-    if (argc != 6) {
-        fprintf(stderr, "Usage: %s <tiles_dir> <from_lat> <from_lon> <to_lat> <to_lon>\n", argv[0]);
-        return 1;
+/* Free every loaded tile (--serve keeps tiles between routes up to MAX_TILES / 2) */
+static void tiles_free_all(void) {
+    for (int i = 0; i < g_tile_count; i++) {
+        free(g_tiles[i].nodes);
+        free(g_tiles[i].edge_ends);
+        free(g_tiles[i].raw_data);
+        memset(&g_tiles[i], 0, sizeof(Tile));
     }
-    
-    strncpy(g_tiles_dir, argv[1], sizeof(g_tiles_dir) - 1);
-    double from_lat = atof(argv[2]);
-    double from_lon = atof(argv[3]);
-    double to_lat = atof(argv[4]);
-    double to_lon = atof(argv[5]);
-    
-    visited_init();
-    
-    if (!route(from_lat, from_lon, to_lat, to_lon)) {
-        printf("{\"error\":\"No route found\"}\n");
-        return 1;
+    g_tile_count = 0;
+}
+
+/* Print the route found by route() as one JSON line */
+static int print_route_json(void) {
+    /* The encoded shape (polyline precision 6, as Valhalla) and the distance in
+     * metres are emitted too, so the server needn't walk the coords. */
+    char *shape = malloc((size_t)g_path_len * 26 + 1);
+    if (!shape) {
+        fprintf(stderr, "Out of memory for shape\n");
+        printf("{\"error\":\"Out of memory\"}\n");
+        return 0;
     }
+    size_t shape_len = 0;
+    int64_t prev_lat_e6 = 0, prev_lon_e6 = 0;
     
-    /* Output JSON */
     printf("{\"coords\":[");
     double total_dist = 0;
     double prev_lat = 0, prev_lon = 0;
+    int have_prev = 0;
     for (int i = 0; i < g_path_len; i++) {
         Tile *t = find_tile(g_path[i].level, g_path[i].tile_id);
         if (t && g_path[i].node_id < t->node_count) {
             Node *n = &t->nodes[g_path[i].node_id];
-            if (i > 0) {
+            if (have_prev) {
                 printf(",");
                 total_dist += haversine(prev_lat, prev_lon, n->lat, n->lon);
             }
             printf("{\"lat\":%.7f,\"lon\":%.7f}", n->lat, n->lon);
             prev_lat = n->lat;
             prev_lon = n->lon;
+            have_prev = 1;
+            
+            int64_t lat_e6 = llround(n->lat * 1e6);
+            int64_t lon_e6 = llround(n->lon * 1e6);
+            shape_len += polyline_put(shape + shape_len, lat_e6 - prev_lat_e6);
+            shape_len += polyline_put(shape + shape_len, lon_e6 - prev_lon_e6);
+            prev_lat_e6 = lat_e6;
+            prev_lon_e6 = lon_e6;
         }
     }
-    printf("],\"nodes\":%d,\"total_dist_km\":%.2f}\n", g_path_len, total_dist / 1000.0);
+    shape[shape_len] = '\0';
+    /* Polyline chars are 63..126 - only backslash needs escaping in a JSON string */
+    printf("],\"nodes\":%d,\"total_dist_km\":%.2f,\"distance_m\":%.3f,\"shape\":\"",
+           g_path_len, total_dist / 1000.0, total_dist);
+    for (size_t i = 0; i < shape_len; i++) {
+        if (shape[i] == '\\')
+            putchar('\\');
+        putchar(shape[i]);
+    }
+    printf("\"}\n");
+    free(shape);
     
     fprintf(stderr, "[DEBUG] Output path: %d nodes, %.2f km total\n", g_path_len, total_dist / 1000.0);
-    
+    return 1;
+}
+
+/* --serve: answer route requests from stdin until it is closed */
+static int serve(void) {
+    char line[256];
+    while (fgets(line, sizeof(line), stdin)) {
+        double from_lat, from_lon, to_lat, to_lon;
+        if (sscanf(line, "%lf %lf %lf %lf", &from_lat, &from_lon, &to_lat, &to_lon) != 4) {
+            printf("{\"error\":\"Bad request\"}\n");
+        } else {
+            if (g_tile_count > MAX_TILES / 2)
+                tiles_free_all();
+            int kept_tiles = g_tile_count;
+            g_debug_tile_fails = 0;
+            g_tiles_full = 0;
+            int found = route(from_lat, from_lon, to_lat, to_lon);
+            if (g_tiles_full && kept_tiles > 0) {
+                /* Tiles kept from earlier routes crowded this one out - route again
+                 * from an empty table, as a fresh process would */
+                tiles_free_all();
+                g_debug_tile_fails = 0;
+                g_tiles_full = 0;
+                found = route(from_lat, from_lon, to_lat, to_lon);
+            }
+            if (found)
+                print_route_json();
+            else
+                printf("{\"error\":\"No route found\"}\n");
+        }
+        fflush(stdout);
+    }
     return 0;
 }
+
+int main(int argc, char **argv) {
+    if (argc == 3 && strcmp(argv[1], "--serve") == 0) {
+        strncpy(g_tiles_dir, argv[2], sizeof(g_tiles_dir) - 1);
+        visited_init();
+        return serve();
+    }
+    
+    if (argc != 6) {
+        fprintf(stderr, "Usage: %s <tiles_dir> <from_lat> <from_lon> <to_lat> <to_lon>\n", argv[0]);
+        fprintf(stderr, "       %s --serve <tiles_dir>\n", argv[0]);
+        return 1;
+    }
+    
+    strncpy(g_tiles_dir, argv[1], sizeof(g_tiles_dir) - 1);
+    double from_lat = atof(argv[2]);
+    double from_lon = atof(argv[3]);
+    double to_lat = atof(argv[4]);
+    double to_lon = atof(argv[5]);
+    
+    visited_init();
+    
+    if (!route(from_lat, from_lon, to_lat, to_lon)) {
+        printf("{\"error\":\"No route found\"}\n");
+        return 1;
+    }
+    
+    return print_route_json() ? 0 : 1;
+}